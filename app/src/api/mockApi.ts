@@ -34,6 +34,25 @@ apiClient.interceptors.response.use(
   }
 )
 
+// 离线扫码队列（网络断开时保存，恢复后批量同步）
+const OFFLINE_SCANS_KEY = 'classmint_offline_scans'
+// 服务器每批最多接受的扫码数 (CLAIM_BATCH_MAX in app.py)
+const CLAIM_BATCH_MAX = 200
+
+type OfflineScan = { token: string, user_id: number, scanned_at: number }
+
+const readOfflineScans = (): OfflineScan[] => {
+  try {
+    return JSON.parse(localStorage.getItem(OFFLINE_SCANS_KEY) || '[]')
+  } catch {
+    return []
+  }
+}
+
+const writeOfflineScans = (scans: OfflineScan[]) => {
+  localStorage.setItem(OFFLINE_SCANS_KEY, JSON.stringify(scans))
+}
+
 export const api = {
   // 学生登录
   login: async (username: string, password: string) => {
@@ -75,6 +94,24 @@ export const api = {
     }
   },
 
+  // 分页获取交易记录（before 为上一页最后一条记录的 id）
+  transactions: async (user_id: number, before?: number, per_page: number = 20) => {
+    try {
+      const response = await apiClient.get(getApiUrl(API_CONFIG.ENDPOINTS.TRANSACTIONS), {
+        params: { user_id, before, per_page }
+      })
+      
+      return {
+        transactions: response.data.transactions || [],
+        has_more: !!response.data.has_more,
+        next_before: response.data.next_before
+      }
+    } catch (error: any) {
+      console.error('Transactions API Error:', error)
+      throw new Error(error.response?.data?.error || error.message || 'Failed to get transactions')
+    }
+  },
+
   // 领取奖励
   claim: async (tokenData: any, user_id: number) => {
     try {
@@ -106,8 +143,55 @@ export const api = {
       }
     } catch (error: any) {
       console.error('Claim API Error:', error)
-      throw new Error(error.response?.data?.detail || error.message || 'Claim failed')
+      const err: any = new Error(error.response?.data?.detail || error.message || 'Claim failed')
+      // 没有收到服务器响应：网络问题，可以稍后重试
+      err.offline = !error.response
+      throw err
+    }
+  },
+
+  // 批量领取（同步离线扫码）
+  claimBatch: async (claims: { token: string, scanned_at: number }[], user_id: number) => {
+    try {
+      const response = await apiClient.post(getApiUrl(API_CONFIG.ENDPOINTS.CLAIM_BATCH), {
+        user_id,
+        claims
+      })
+      return response.data
+    } catch (error: any) {
+      console.error('Batch Claim API Error:', error)
+      throw new Error(error.response?.data?.detail || error.message || 'Batch claim failed')
+    }
+  },
+
+  // 保存离线扫码
+  queueOfflineScan: (token: string, user_id: number) => {
+    const scans = readOfflineScans()
+    if (!scans.some(s => s.token === token && s.user_id === user_id)) {
+      scans.push({ token, user_id, scanned_at: Math.floor(Date.now() / 1000) })
+      writeOfflineScans(scans)
+    }
+    return scans.length
+  },
+
+  offlineScanCount: (user_id: number) => readOfflineScans().filter(s => s.user_id === user_id).length,
+
+  // 分批同步该用户的所有离线扫码；每批成功后只移除该批的扫码，重复发送不会重复入账
+  syncOfflineScans: async (user_id: number) => {
+    const mine = readOfflineScans().filter(s => s.user_id === user_id)
+    if (mine.length === 0) return null
+    const total = { ok: true, claimed: 0, amount: 0, balance: null as number | null, results: [] as any[] }
+    for (let i = 0; i < mine.length; i += CLAIM_BATCH_MAX) {
+      const chunk = mine.slice(i, i + CLAIM_BATCH_MAX)
+      const result = await api.claimBatch(chunk.map(s => ({ token: s.token, scanned_at: s.scanned_at })), user_id)
+      const synced = new Set(chunk.map(s => s.token))
+      writeOfflineScans(readOfflineScans().filter(s => s.user_id !== user_id || !synced.has(s.token)))
+      total.claimed += result.claimed
+      total.amount += result.amount
+      total.balance = result.balance
+      total.results.push(...result.results)
     }
+    return total
   },
 
   // 验证区块链完整性
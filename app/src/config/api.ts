@@ -12,7 +12,9 @@ export const API_CONFIG = {
   ENDPOINTS: {
     LOGIN: '/api/auth/login',
     BALANCE: '/api/user/balance',
+    TRANSACTIONS: '/api/user/transactions',
     CLAIM: '/api/claim',
+    CLAIM_BATCH: '/api/claim/batch',
     VERIFY: '/api/ledger/verify',
     STUDENTS: '/api/students',
     SHOP_ITEMS: '/api/shop/items',
@@ -1,15 +1,30 @@
 import os, sqlite3, json, time, hashlib, hmac, base64
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, g, request, redirect, url_for, render_template, session, send_file, jsonify, flash
+from flask import Flask, g, request, redirect, url_for, render_template, session, send_file, jsonify, flash, Response, stream_with_context
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
-import qrcode
 from io import BytesIO
+from ledger import build_block, verify_chain
+from gencache import GenerationCache
+import gencache
+import profiling
+import metrics
+import shards
+import export
+import rollups
+import idempotency
+import ratelimit
+import sweeper
+import responses
+import records
+import search
+import history
+import maintenance
 
 
 APP_SECRET = os.environ.get("CM_SECRET", "change-me-secret")  # HMAC secret key
-DB_PATH = "classmint.db"
+DB_PATH = os.environ.get("CM_DB", "classmint.db")
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET", "dev-key")
@@ -18,6 +33,15 @@ bcrypt = Bcrypt(app)
 # Configure CORS to allow cross-origin requests from all sources
 CORS(app, origins=['*'], methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
 
+# Opt-in request profiling (CM_PROFILE=1), see profiling.py
+profiling.init_app(app)
+# Prometheus metrics at /metrics, see metrics.py
+metrics.init_app(app)
+# gzip/brotli for large responses, see responses.py
+responses.init_app(app)
+# Per-route rate limits and load shedding, see ratelimit.py
+ratelimit.init_app(app, queue_depth=lambda: pools.depth() if pools is not None else 0)
+
 # Add Jinja2 filters
 @app.template_filter('from_json')
 def from_json_filter(value):
@@ -38,13 +62,120 @@ def timestamp_to_datetime_filter(timestamp):
     except (ValueError, TypeError):
         return 'N/A'
 
+# Production serving mode (serve.py): read connections come from a pool and
+# every write transaction runs on a single writer thread per database, see dbpool.py
+pools = None
+
+def current_db_path():
+    """Database of this request: its classroom shard (shards.py) or DB_PATH"""
+    return g.get("db_path") or DB_PATH
+
+# Shards whose schema this process has brought up to date
+_migrated_shards = set()
+
+def use_class(class_id):
+    """Route the rest of this request to the shard of class_id (raises shards.UnknownClass)"""
+    path = shards.existing_shard_path(class_id)
+    if path not in _migrated_shards:
+        # Shards created by an older version lack the tables added since
+        shards.migrate(path)
+        _migrated_shards.add(path)
+    if g.get("db_path") != path:
+        close_db()
+        g.cls = class_id
+        g.db_path = path
+
+def request_class():
+    """Class id a request asks for: signed token payload, teacher session, then client hints"""
+    data = request.get_json(silent=True) if request.is_json else None
+    data = data if isinstance(data, dict) else {}
+    token = data.get("token")
+    if token is None and isinstance(data.get("claims"), list) and data["claims"]:
+        # Batch claims go to the class of their first token
+        first = data["claims"][0]
+        token = first.get("token") if isinstance(first, dict) else None
+    if isinstance(token, str):
+        payload = verify_token_sig(token.strip())
+        if payload and payload.get("cls"):
+            return payload["cls"]
+    return (session.get("cls") or request.headers.get("X-Class-Id") or request.args.get("cls")
+            or data.get("cls"))
+
+@app.before_request
+def _route_shard():
+    if not shards.ENABLED:
+        return
+    class_id = request_class()
+    if class_id:
+        try:
+            use_class(str(class_id))
+        except shards.UnknownClass:
+            return jsonify({"ok": False, "detail": f"unknown class: {class_id}"}), 404
+
 # Database connection
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        g.db.row_factory = sqlite3.Row
+        path = current_db_path()
+        if pools is not None:
+            g.db = pools.reader(path).acquire()
+            g.db_source = path
+        else:
+            g.db = sqlite3.connect(path, check_same_thread=False, factory=profiling.connection_factory())
+            g.db.row_factory = sqlite3.Row
     return g.db
 
+def run_write(fn, *args):
+    """Run fn(db, *args) as one write transaction and return its result.
+
+    fn must not commit. Under serve.py it runs on the writer thread; otherwise
+    on this request's connection, which takes the write lock up front
+    (BEGIN IMMEDIATE) so a read-then-write transaction never has to upgrade it.
+    """
+    if pools is not None:
+        with profiling.span("write_queue"):
+            return pools.writer(current_db_path()).submit(fn, *args)
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(db, *args)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return result
+
+def run_idempotent(fn, *args):
+    """run_write(fn, *args) for fn returning (body, status), as a JSON response.
+
+    With an Idempotency-Key header the first response is stored with the
+    transaction and returned again for retries (see idempotency.py).
+    """
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        body, status = run_write(fn, *args)
+        return jsonify(body), status
+    if len(key) > idempotency.MAX_KEY_LENGTH:
+        return jsonify({"ok": False, "detail": "Idempotency-Key is too long"}), 400
+
+    route = request.path
+    fp = idempotency.fingerprint(request.get_data())
+    try:
+        # Most retries are answered from a read connection, without waiting for the writer
+        stored = idempotency.lookup(get_db(), route, key, fp)
+        if stored is None:
+            body, status, replayed = run_write(idempotency.run, route, key, fp, fn, *args)
+        else:
+            (body, status), replayed = stored, True
+    except idempotency.KeyReused:
+        return jsonify({"ok": False, "detail": "Idempotency-Key was already used for a different request"}), 422
+
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        metrics.IDEMPOTENT_REPLAYS.inc(route)
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
 from datetime import datetime
 
 @app.template_filter("datetime")
@@ -59,10 +190,22 @@ def _fmt(ts: int):
 def close_db(_e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        source = g.pop("db_source", None)
+        if source is not None:
+            pools.reader(source).release(db)
+        else:
+            db.close()
+
+# Bump whenever init_schema changes: databases already at this version skip it entirely
+SCHEMA_VERSION = 5
 
 def init_db():
-    db = get_db()
+    init_schema(get_db())
+
+def init_schema(db):
+    """Create the tables, default accounts and shop items in db (also used for new shards)"""
+    if db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
     db.executescript("""
     CREATE TABLE IF NOT EXISTS users (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -119,10 +262,23 @@ def init_db():
     except sqlite3.OperationalError:
         db.execute("ALTER TABLE tokens ADD COLUMN description TEXT DEFAULT ''")
     
+    db.executescript(gencache.SCHEMA)
+    db.executescript(rollups.SCHEMA)
+    db.executescript(idempotency.SCHEMA)
+    db.executescript(maintenance.SCHEMA)
+    # Claims are looked up by token (claim checks, batch sync) and blocks by transaction
+    db.execute("CREATE INDEX IF NOT EXISTS idx_claims_token ON claims(token_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_tx ON ledger(tx_id)")
+    db.execute(sweeper.INDEX_SQL)
+    # Full-text search index and its sync triggers (filled from existing rows when new)
+    search.ensure(db)
+    
     try:
         db.execute("SELECT block_data FROM ledger LIMIT 1")
     except sqlite3.OperationalError:
         db.execute("ALTER TABLE ledger ADD COLUMN block_data TEXT")
+    # Per-student transaction history (filled from existing claims, purchases and opening balances when new)
+    history.ensure(db)
     
     # Default admin
     u = db.execute("SELECT 1 FROM users WHERE username='admin'").fetchone()
@@ -172,6 +328,9 @@ def init_db():
             """, (name, description, price, category, image_url, stock, now_ts(), now_ts()))
             db.commit()
 
+    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    db.commit()
+
 # Authentication
 def login_required(f):
     @wraps(f)
@@ -203,65 +362,320 @@ def verify_token_sig(token: str) -> dict | None:
     except Exception:
         return None
 
-def add_block(tx_id: int, claim_data: dict = None):
-    """Add new block to blockchain"""
-    db = get_db()
-    prev = db.execute("SELECT record_hash FROM ledger ORDER BY id DESC LIMIT 1").fetchone()
-    prev_hash = prev["record_hash"] if prev else ""
+def add_block(db, tx_id: int, claim_data: dict = None):
+    """Add new block to blockchain (inside the caller's write transaction)"""
+    with profiling.span("add_block"), metrics.LEDGER_APPEND.time():
+        prev = db.execute("SELECT record_hash FROM ledger ORDER BY id DESC LIMIT 1").fetchone()
+        prev_hash = prev["record_hash"] if prev else ""
+        
+        # 使用统一的时间戳
+        current_time = now_ts()
+        payload, record_hash = build_block(prev_hash, tx_id, claim_data, current_time)
+        
+        db.execute("INSERT INTO ledger (tx_id, prev_hash, record_hash, created_at, block_data) VALUES (?,?,?,?,?)",
+                   (tx_id, prev_hash, record_hash, current_time, payload))
+    return record_hash
+
+# Write transactions, run through run_write()
+def insert_token(db, token_str, amount, one_time, expires_at, issued_by, description):
+    created = now_ts()
+    cur = db.execute("INSERT INTO tokens (token, amount, one_time, expires_at, issued_by, status, created_at, description) VALUES (?,?,?,?,?,?,?,?)",
+                     (token_str, amount, one_time, expires_at, issued_by, "ACTIVE", created, description))
+    rollups.record_token(db, created, amount)
+    return cur.lastrowid
+
+def void_token(db, token_id):
+    db.execute("UPDATE tokens SET status='VOID' WHERE id=? AND status='ACTIVE'", (token_id,))
+
+def claim_token(db, token_str, claimer, scanned_at=None):
+    """Claim a token for claimer; returns (response body, HTTP status).
+
+    scanned_at (batch sync of offline scans) is when the student scanned the
+    code; expiry is checked against it instead of the current time.
+    """
+    t = db.execute("SELECT * FROM tokens WHERE token=?", (token_str,)).fetchone()
+    
+    if not t: 
+        metrics.CLAIMS.inc("invalid")
+        return {"detail":"invalid token"}, 400
+    status = t["status"]
+    if status == "EXPIRED" and scanned_at and scanned_at <= t["expires_at"]:
+        status = "ACTIVE"  # scanned offline before it expired, swept since (sweeper.py)
+    if status == "EXPIRED":
+        metrics.CLAIMS.inc("expired")
+        return {"detail":"token expired"}, 400
+    if status != "ACTIVE": 
+        metrics.CLAIMS.inc("already_claimed" if status == "USED" else "inactive")
+        return {"detail":"token inactive"}, 400
+    if (scanned_at or now_ts()) > t["expires_at"]: 
+        metrics.CLAIMS.inc("expired")
+        return {"detail":"token expired"}, 400
+
+    existing_claim = db.execute("SELECT claimer FROM claims WHERE token_id=? LIMIT 1", (t["id"],)).fetchone()
     
-    # 使用统一的时间戳
-    current_time = now_ts()
+    if existing_claim:
+        metrics.CLAIMS.inc("already_claimed")
+        return {"detail":f"Token already claimed by {existing_claim['claimer']}"}, 400
     
-    # Build block data
-    block_data = {
+    db.execute("UPDATE tokens SET status='USED' WHERE id=? AND status IN ('ACTIVE', 'EXPIRED')", (t["id"],))
+
+    # 记录领取
+    claimed_at = now_ts()
+    tx_id = db.execute("INSERT INTO claims (token_id, claimer, amount, created_at) VALUES (?,?,?,?)",
+                       (t["id"], claimer, t["amount"], claimed_at)).lastrowid
+    rollups.record_claim(db, claimed_at, t["amount"], t["created_at"])
+
+    # 更新用户余额
+    db.execute("""
+        INSERT INTO user_balances (user_id, balance, updated_at) 
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET 
+            balance = balance + ?,
+            updated_at = ?
+    """, (int(claimer), t["amount"], now_ts(), t["amount"], now_ts()))
+    history.record(db, int(claimer), "claim", tx_id, t["amount"], t["description"] or "", claimed_at)
+
+    # 构建区块链数据
+    claim_data = {
+        "claimer": claimer,
+        "amount": t["amount"],
+        "token_id": t["id"],
+        "description": t["description"] if "description" in t.keys() else ""
+    }
+
+    # 写入区块链
+    block_hash = add_block(db, tx_id, claim_data)
+    gencache.bump(db, "balances")
+    metrics.CLAIMS.inc("ok")
+    
+    return {
+        "ok": True,
+        "amount": t["amount"],
+        "amount_yuan": t["amount"] / 100,
         "tx_id": tx_id,
-        "timestamp": current_time,
-        "prev_hash": prev_hash,
-        "claim_data": claim_data
+        "block_hash": block_hash,
+        "description": t["description"] if "description" in t.keys() else ""
+    }, 200
+
+def claim_batch(db, claimer, scans):
+    """Claim scans [(token_str, scanned_at)] in the given order; returns (results, balance).
+
+    A token this claimer already holds is reported as a duplicate with its
+    original transaction instead of an error, so resending a batch is harmless.
+    """
+    results = []
+    for token_str, scanned_at in scans:
+        prior = db.execute("""
+            SELECT c.id, c.amount, l.record_hash
+            FROM tokens t
+            JOIN claims c ON c.token_id = t.id
+            LEFT JOIN ledger l ON l.tx_id = c.id
+                 -- purchase blocks reuse the same tx_id numbers, so match the claim's own block
+                 AND json_extract(l.block_data, '$.claim_data.token_id') = t.id
+            WHERE t.token = ? AND c.claimer = ?
+        """, (token_str, claimer)).fetchone()
+        if prior:
+            results.append({"token": token_str, "ok": True, "duplicate": True, "amount": prior["amount"],
+                            "tx_id": prior["id"], "block_hash": prior["record_hash"]})
+            continue
+        body, status = claim_token(db, token_str, claimer, scanned_at)
+        if status == 200:
+            results.append({"token": token_str, "ok": True, "duplicate": False, "amount": body["amount"],
+                            "tx_id": body["tx_id"], "block_hash": body["block_hash"]})
+        else:
+            results.append({"token": token_str, "ok": False, "detail": body["detail"]})
+
+    balance = db.execute("SELECT balance FROM user_balances WHERE user_id=?", (int(claimer),)).fetchone()
+    return results, balance["balance"] if balance else 0
+
+def purchase_item(db, user_id, item_id, quantity):
+    """Buy quantity of item_id for user_id; returns (response body, HTTP status)"""
+    # 获取商品信息
+    item = db.execute("SELECT * FROM shop_items WHERE id=? AND status='ACTIVE'", (item_id,)).fetchone()
+    if not item:
+        metrics.PURCHASES.inc("not_found")
+        return {"ok": False, "message": "Item not found"}, 404
+    
+    # 检查库存
+    if item["stock"] != -1 and item["stock"] < quantity:
+        metrics.PURCHASES.inc("insufficient_stock")
+        return {"ok": False, "message": "Insufficient stock"}, 400
+    
+    # 计算总价
+    total_price = item["price"] * quantity
+    
+    # 检查用户余额
+    balance_row = db.execute("SELECT balance FROM user_balances WHERE user_id=?", (user_id,)).fetchone()
+    current_balance = balance_row["balance"] if balance_row else 0
+    
+    if current_balance < total_price:
+        metrics.PURCHASES.inc("insufficient_balance")
+        return {"ok": False, "message": "Insufficient balance"}, 400
+    
+    purchased_at = now_ts()
+    purchase_id = db.execute("""
+        INSERT INTO purchases (user_id, item_id, quantity, total_price, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, item_id, quantity, total_price, purchased_at)).lastrowid
+    rollups.record_purchase(db, purchased_at, item_id, quantity, total_price)
+    
+    # 更新用户余额
+    db.execute("""
+        UPDATE user_balances 
+        SET balance = balance - ?, updated_at = ?
+        WHERE user_id = ?
+    """, (total_price, now_ts(), user_id))
+    history.record(db, user_id, "purchase", purchase_id, -total_price,
+                   f"Purchased {quantity}x {item['name']}", purchased_at)
+    
+    if item["stock"] != -1:
+        db.execute("UPDATE shop_items SET stock = stock - ? WHERE id = ?", (quantity, item_id))
+        gencache.bump(db, "shop")
+    
+    purchase_data = {
+        "type": "purchase",
+        "user_id": user_id,
+        "item_id": item_id,
+        "item_name": item["name"],
+        "quantity": quantity,
+        "total_price": total_price,
+        "description": f"Purchased {quantity}x {item['name']}"
     }
     
-    payload = json.dumps(block_data, separators=(",", ":"))
-    # 修复：使用相同的时间戳进行哈希计算
-    record_hash = sha256((prev_hash + payload + str(current_time)).encode())
+    # 写入区块链
+    block_hash = add_block(db, purchase_id, purchase_data)
+    gencache.bump(db, "balances")
+    metrics.PURCHASES.inc("ok")
     
-    db.execute("INSERT INTO ledger (tx_id, prev_hash, record_hash, created_at, block_data) VALUES (?,?,?,?,?)",
-               (tx_id, prev_hash, record_hash, current_time, payload))
-    db.commit()
-    return record_hash
+    return {
+        "ok": True,
+        "message": "Purchase successful",
+        "item_name": item["name"],
+        "quantity": quantity,
+        "total_price": total_price,
+        "new_balance": current_balance - total_price,
+        "purchase_id": purchase_id,
+        "block_hash": block_hash
+    }, 200
+
+def ensure_balance_row(db, user_id):
+    db.execute("""
+        INSERT OR IGNORE INTO user_balances (user_id, balance, updated_at) 
+        VALUES (?, 0, ?)
+    """, (user_id, now_ts()))
+
+def add_shop_item(db, name, description, price, category, stock):
+    db.execute("""
+        INSERT INTO shop_items (name, description, price, category, stock, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'ACTIVE', ?, ?)
+    """, (name, description, price, category, stock, now_ts(), now_ts()))
+    gencache.bump(db, "shop")
+
+def update_shop_item(db, item_id, name, description, price, category, stock, status):
+    """Returns False when the item does not exist"""
+    cur = db.execute("""
+        UPDATE shop_items 
+        SET name=?, description=?, price=?, category=?, stock=?, status=?, updated_at=?
+        WHERE id=?
+    """, (name, description, price, category, stock, status, now_ts(), item_id))
+    gencache.bump(db, "shop")
+    return cur.rowcount > 0
+
+def deactivate_shop_item(db, item_id):
+    """Returns False when the item does not exist"""
+    cur = db.execute("UPDATE shop_items SET status='INACTIVE', updated_at=? WHERE id=?", (now_ts(), item_id))
+    gencache.bump(db, "shop")
+    return cur.rowcount > 0
+
+def render_qr_png(token_str: str) -> BytesIO:
+    """Render the claim URL of a token as a PNG QR code"""
+    url_text = f"https://classmint.local/claim?token={token_str}"
+    # qrcode (and Pillow behind it) load on the first render, not at startup
+    import qrcode
+    with profiling.span("qr_render"), metrics.QR_RENDER.time():
+        img = qrcode.make(url_text)
+        buf = BytesIO()
+        img.save(buf, format="PNG")
+    buf.seek(0)
+    return buf
+
+def check_password(password_hash: str, password: str) -> bool:
+    """bcrypt check, tracked as in-flight work and as a profiling span"""
+    with profiling.span("bcrypt"), metrics.BCRYPT_IN_FLIGHT.track():
+        return bcrypt.check_password_hash(password_hash, password)
+
+@metrics.register_collector
+def ledger_metrics():
+    """Chain length for /metrics (ids are contiguous, so no full COUNT(*))"""
+    n = get_db().execute("SELECT COALESCE(MAX(id) - MIN(id) + 1, 0) FROM ledger").fetchone()[0]
+    return [("classmint_ledger_length", "gauge", "Blocks in the ledger", n)]
+
+@metrics.register_collector
+def write_queue_metrics():
+    if pools is None:
+        return []
+    return [("classmint_write_queue_depth", "gauge", "Write transactions waiting for the writer threads",
+             pools.depth())]
+
+@metrics.register_collector
+def wal_metrics():
+    """WAL size of the default database, kept in check by the maintenance thread (maintenance.py)"""
+    return [("classmint_wal_bytes", "gauge", "Size of the write-ahead log", maintenance.wal_bytes(DB_PATH))]
 
 # Page routes
 @app.route("/login", methods=["GET","POST"])
 def login():
-    init_db()
+    # serve.py initialises the database once at startup
+    if not app.config.get("DB_READY"):
+        init_db()
     if request.method == "POST":
         username = request.form.get("username","")
         password = request.form.get("password","")
+        class_id = request.form.get("class","").strip()
+        if shards.ENABLED and class_id:
+            try:
+                use_class(class_id)
+            except shards.UnknownClass:
+                flash("Unknown class")
+                return render_template("login.html", sharded=shards.ENABLED)
         db = get_db()
         row = db.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
-        if row and bcrypt.check_password_hash(row["password_hash"], password):
+        if row and check_password(row["password_hash"], password):
             session["uid"] = row["id"]; session["uname"] = row["username"]
+            session["cls"] = g.get("cls")
             return redirect(url_for("dashboard"))
         flash("Invalid username or password")
-    return render_template("login.html")
+    return render_template("login.html", sharded=shards.ENABLED)
 
 @app.route("/logout")
 def logout():
     session.clear()
     return redirect(url_for("login"))
 
+# Dashboard statistics in one statement
+DASHBOARD_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM tokens) AS total_tokens,
+        (SELECT COUNT(*) FROM claims) AS total_claims,
+        (SELECT COALESCE(SUM(amount), 0) FROM tokens WHERE status='ACTIVE') AS active_amount,
+        (SELECT COUNT(*) FROM ledger) AS blockchain_length,
+        (SELECT COUNT(*) FROM purchases) AS total_purchases
+"""
+
 @app.route("/")
 @app.route("/dashboard")
 @login_required
 def dashboard():
     db = get_db()
-    tokens = db.execute("SELECT * FROM tokens ORDER BY id DESC LIMIT 50").fetchall()
-    claims = db.execute("SELECT c.*, t.token FROM claims c LEFT JOIN tokens t ON t.id=c.token_id ORDER BY c.id DESC LIMIT 20").fetchall()
+    tokens = records.fetch_all(db, records.Token,
+                               f"SELECT {records.columns(records.Token)} FROM tokens ORDER BY id DESC LIMIT 50")
+    claims = records.fetch_all(db, records.Claim, """
+        SELECT c.id, c.token_id, c.claimer, c.amount, c.created_at, t.token
+        FROM claims c LEFT JOIN tokens t ON t.id=c.token_id ORDER BY c.id DESC LIMIT 20
+    """)
     
     # Get statistics
-    total_tokens = db.execute("SELECT COUNT(*) as count FROM tokens").fetchone()["count"]
-    total_claims = db.execute("SELECT COUNT(*) as count FROM claims").fetchone()["count"]
-    active_amount = db.execute("SELECT COALESCE(SUM(amount), 0) as total FROM tokens WHERE status='ACTIVE'").fetchone()["total"]
-    blockchain_length = db.execute("SELECT COUNT(*) as count FROM ledger").fetchone()["count"]
+    stats = dict(db.execute(DASHBOARD_STATS_SQL).fetchone())
     
     # Get page parameter
     page = request.args.get('page', 'dashboard')
@@ -269,7 +683,7 @@ def dashboard():
     # If page is records, get additional data
     purchases = None
     if page == 'records':
-        purchases = db.execute("""
+        purchases = records.fetch_all(db, records.Purchase, """
             SELECT 
                 p.id, p.user_id, p.item_id, p.quantity, p.total_price, p.status, p.created_at,
                 u.username, si.name as item_name, si.category, si.price
@@ -277,7 +691,7 @@ def dashboard():
             LEFT JOIN users u ON p.user_id = u.id
             LEFT JOIN shop_items si ON p.item_id = si.id
             ORDER BY p.created_at DESC
-        """).fetchall()
+        """)
     
     return render_template("dashboard_new.html", 
                          tokens=tokens, 
@@ -285,12 +699,7 @@ def dashboard():
                          purchases=purchases,
                          uname=session.get("uname"),
                          current_page=page,
-                         stats={
-                             "total_tokens": total_tokens,
-                             "total_claims": total_claims,
-                             "active_amount": active_amount,
-                             "blockchain_length": blockchain_length
-                         })
+                         stats=stats)
 
 @app.route("/token/new", methods=["POST"])
 @login_required
@@ -319,12 +728,11 @@ def token_new():
             "nonce": sha256(os.urandom(16)),
             "desc": description
         }
+        if g.get("cls"):
+            payload["cls"] = g.cls  # routes the claim to this class's shard
         
         token_str = sign_payload(payload)
-        db = get_db()
-        db.execute("INSERT INTO tokens (token, amount, one_time, expires_at, issued_by, status, created_at, description) VALUES (?,?,?,?,?,?,?,?)",
-                   (token_str, amount_cents, one_time, payload["exp"], session["uid"], "ACTIVE", now_ts(), description))
-        db.commit()
+        run_write(insert_token, token_str, amount_cents, one_time, payload["exp"], session["uid"], description)
         
         flash(f"Successfully generated ¥{amount_yuan:.2f} reward token!")
         return redirect(url_for("dashboard"))
@@ -344,12 +752,7 @@ def token_qr(token_id:int):
     if not row: return "Not found", 404
     
     # Generate QR code
-    url_text = f"https://classmint.local/claim?token={row['token']}"
-    img = qrcode.make(url_text)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    return send_file(render_qr_png(row["token"]), mimetype="image/png")
 
 @app.route("/qr/<token_str>")
 @login_required
@@ -360,29 +763,22 @@ def qr_by_token(token_str: str):
     if not row: return "Not found", 404
     
     # Generate QR code
-    url_text = f"https://classmint.local/claim?token={row['token']}"
-    img = qrcode.make(url_text)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    return send_file(render_qr_png(row["token"]), mimetype="image/png")
 
 @app.route("/token/void/<int:token_id>", methods=["POST"])
 @login_required
 def token_void(token_id:int):
-    db = get_db()
-    db.execute("UPDATE tokens SET status='VOID' WHERE id=? AND status='ACTIVE'", (token_id,))
-    db.commit()
+    run_write(void_token, token_id)
     flash("Token has been voided")
     return redirect(url_for("dashboard"))
 
 @app.route("/blockchain")
 @login_required
 def blockchain_view():
-    """Blockchain visualization page"""
-    db = get_db()
-    blocks = db.execute("SELECT * FROM ledger ORDER BY id ASC").fetchall()
-    return render_template("blockchain.html", blocks=blocks, uname=session.get("uname"))
+    """Blockchain visualization page (a shell; blocks come from /api/ledger/blocks)"""
+    last_id = get_db().execute("SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+    return render_template("blockchain.html", last_id=last_id, page_size=LEDGER_PAGE_SIZE,
+                           uname=session.get("uname"))
 
 @app.route("/token-records")
 @login_required
@@ -419,20 +815,21 @@ def api_token_create():
             "nonce": sha256(os.urandom(16)),
             "desc": description
         }
+        if g.get("cls"):
+            payload["cls"] = g.cls  # routes the claim to this class's shard
         
         token_str = sign_payload(payload)
-        db = get_db()
-        db.execute("INSERT INTO tokens (token, amount, one_time, expires_at, issued_by, status, created_at, description) VALUES (?,?,?,?,?,?,?,?)",
-                   (token_str, amount_cents, one_time, payload["exp"], 0, "ACTIVE", now_ts(), description))
-        db.commit()
-        tid = db.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
         
-        return jsonify({
-            "token_id": tid, 
-            "token": token_str,
-            "amount_yuan": amount_yuan,
-            "expires_at": payload["exp"]
-        })
+        def create(db):
+            tid = insert_token(db, token_str, amount_cents, one_time, payload["exp"], 0, description)
+            return {
+                "token_id": tid, 
+                "token": token_str,
+                "amount_yuan": amount_yuan,
+                "expires_at": payload["exp"]
+            }, 200
+        
+        return run_idempotent(create)
         
     except ValueError:
         return jsonify({"detail": "invalid amount"}), 400
@@ -448,132 +845,83 @@ def api_claim():
         claimer = str(data.get("user_id") or data.get("claimer") or "unknown")
 
         if not token_str:
+            metrics.CLAIMS.inc("invalid")
             return jsonify({"detail": "token is required"}), 400
 
-        db = get_db()
-        
-        try:
-            db.execute("BEGIN TRANSACTION")
-            t = db.execute("SELECT * FROM tokens WHERE token=?", (token_str,)).fetchone()
-            
-            if not t: 
-                db.rollback()
-                return jsonify({"detail":"invalid token"}), 400
-            if t["status"] != "ACTIVE": 
-                db.rollback()
-                return jsonify({"detail":"token inactive"}), 400
-            if now_ts() > t["expires_at"]: 
-                db.rollback()
-                return jsonify({"detail":"token expired"}), 400
-
-            existing_claim = db.execute("SELECT claimer FROM claims WHERE token_id=? LIMIT 1", (t["id"],)).fetchone()
-            
-            if existing_claim:
-                db.rollback()
-                return jsonify({"detail":f"Token already claimed by {existing_claim['claimer']}"}), 400
-            
-            db.execute("UPDATE tokens SET status='USED' WHERE id=? AND status='ACTIVE'", (t["id"],))
-            if db.execute("SELECT changes()").fetchone()[0] == 0:
-                db.rollback()
-                return jsonify({"detail":"Token already claimed"}), 400
+        return run_idempotent(claim_token, token_str, claimer)
 
-            # 记录领取
-            db.execute("INSERT INTO claims (token_id, claimer, amount, created_at) VALUES (?,?,?,?)",
-                       (t["id"], claimer, t["amount"], now_ts()))
-            tx_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
+    except Exception as e:
+        if metrics.is_busy(e):
+            metrics.SQLITE_BUSY.inc("/api/claim")
+            metrics.CLAIMS.inc("locked")
+        else:
+            metrics.CLAIMS.inc("error")
+        return jsonify({"detail": f"claim failed: {str(e)}"}), 500
 
-            # 更新用户余额
-            db.execute("""
-                INSERT INTO user_balances (user_id, balance, updated_at) 
-                VALUES (?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET 
-                    balance = balance + ?,
-                    updated_at = ?
-            """, (int(claimer), t["amount"], now_ts(), t["amount"], now_ts()))
-
-            # 构建区块链数据
-            claim_data = {
-                "claimer": claimer,
-                "amount": t["amount"],
-                "token_id": t["id"],
-                "description": t["description"] if "description" in t.keys() else ""
-            }
-
-            # 写入区块链
-            block_hash = add_block(tx_id, claim_data)
-
-            # 提交事务
-            db.commit()
-            
-            return jsonify({
-                "ok": True,
-                "amount": t["amount"],
-                "amount_yuan": t["amount"] / 100,
-                "tx_id": tx_id,
-                "block_hash": block_hash,
-                "description": t["description"] if "description" in t.keys() else ""
-            })
-            
-        except Exception as e:
-            db.rollback()
-            raise e
+# 离线扫码批量同步
+CLAIM_BATCH_MAX = 200
+# Offline scans older than this are checked for expiry as if scanned this long ago
+CLAIM_SCAN_GRACE = 3600
+
+@app.route("/api/claim/batch", methods=["POST"])
+def api_claim_batch():
+    """Claim tokens scanned while offline: {"user_id", "claims": [{"token", "scanned_at"}]}
+
+    All claims run in one write transaction and are appended to the ledger in
+    scan order. Results come back in request order, one per claim.
+    """
+    try:
+        data = request.get_json(force=True)
+        user_id = data.get("user_id")
+        claims = data.get("claims")
+
+        if not user_id or not str(user_id).isdigit():
+            return jsonify({"ok": False, "detail": "user_id is required"}), 400
+        if not isinstance(claims, list) or not claims:
+            return jsonify({"ok": False, "detail": "claims must be a non-empty list"}), 400
+        if len(claims) > CLAIM_BATCH_MAX:
+            return jsonify({"ok": False, "detail": f"at most {CLAIM_BATCH_MAX} claims per batch"}), 400
+
+        now = now_ts()
+        scans = []
+        for i, claim in enumerate(claims):
+            claim = claim if isinstance(claim, dict) else {"token": claim}
+            token_str = str(claim.get("token") or "").strip()
+            try:
+                scanned_at = int(claim.get("scanned_at") or now)
+            except (TypeError, ValueError):
+                scanned_at = now
+            # Client clocks are not trusted beyond the grace window
+            scans.append((max(now - CLAIM_SCAN_GRACE, min(scanned_at, now)), i, token_str))
+        scans.sort()
+
+        valid = [(token_str, scanned_at) for scanned_at, _i, token_str in scans if token_str]
+        outcome, balance = run_write(claim_batch, str(user_id), valid) if valid else ([], None)
+
+        results = [None] * len(claims)
+        outcome = iter(outcome)
+        for _scanned_at, i, token_str in scans:
+            results[i] = next(outcome) if token_str else {"token": "", "ok": False, "detail": "token is required"}
+        claimed = [r for r in results if r["ok"] and not r["duplicate"]]
+
+        return jsonify({
+            "ok": True,
+            "claimed": len(claimed),
+            "amount": sum(r["amount"] for r in claimed),
+            "balance": balance,
+            "results": results
+        })
 
     except Exception as e:
-        return jsonify({"detail": f"claim failed: {str(e)}"}), 500
+        if metrics.is_busy(e):
+            metrics.SQLITE_BUSY.inc("/api/claim/batch")
+        return jsonify({"ok": False, "detail": f"batch claim failed: {str(e)}"}), 500
 
 @app.route("/api/ledger/verify")
 def api_ledger_verify():
     """Verify blockchain integrity"""
     try:
-        db = get_db()
-        rows = db.execute("SELECT * FROM ledger ORDER BY id ASC").fetchall()
-        
-        if not rows:
-            return jsonify({"ok": True, "length": 0, "message": "Blockchain is empty"})
-        
-        prev = ""
-        for r in rows:
-            try:
-                # Parse block data
-                if r["block_data"]:
-                    block_data = json.loads(r["block_data"])
-                else:
-                    # Compatible with old data
-                    block_data = {"tx_id": r["tx_id"]}
-                
-                payload = json.dumps(block_data, separators=(",", ":"))
-                expect = sha256((prev + payload + str(r["created_at"])).encode())
-                
-                if expect != r["record_hash"]:
-                    return jsonify({
-                        "ok": False, 
-                        "broken_at": r["id"],
-                        "expected_hash": expect,
-                        "actual_hash": r["record_hash"],
-                        "message": "Hash mismatch"
-                    })
-                prev = r["record_hash"]
-                
-            except (json.JSONDecodeError, TypeError) as e:
-                # If data format has issues, use basic verification
-                payload = json.dumps({"tx_id": r["tx_id"]}, separators=(",", ":"))
-                expect = sha256((prev + payload + str(r["created_at"])).encode())
-                
-                if expect != r["record_hash"]:
-                    return jsonify({
-                        "ok": False,
-                        "broken_at": r["id"],
-                        "message": "Block data format error, but hash verification failed"
-                    })
-                prev = r["record_hash"]
-        
-        return jsonify({
-            "ok": True, 
-            "length": len(rows),
-            "message": "All blocks verified successfully",
-            "last_hash": prev
-        })
-        
+        return jsonify(verify_chain(get_db()))
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -616,6 +964,44 @@ def api_ledger_status():
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+# Ledger pages: blocks (ids page*LEDGER_PAGE_SIZE+1 .. (page+1)*LEDGER_PAGE_SIZE) never change once
+# written, so a page whose last block exists is cached for good, checked against that block's hash
+LEDGER_PAGE_SIZE = 100
+ledger_pages = gencache.FragmentCache(max_entries=512)
+
+def _ledger_page(db, page, complete):
+    """JSON text of one ledger page"""
+    return responses.envelope(
+        {"ok": True, "page": page, "page_size": LEDGER_PAGE_SIZE, "complete": complete},
+        blocks=responses.rows_json(db, f"""
+            SELECT {records.columns(records.Block)} FROM ledger WHERE id > ? AND id <= ? ORDER BY id
+        """, records.Block._fields, (page * LEDGER_PAGE_SIZE, (page + 1) * LEDGER_PAGE_SIZE),
+            json_columns=("block_data",)))
+
+@app.route("/api/ledger/blocks")
+def api_ledger_blocks():
+    """One page of ledger blocks in chain order (?page=0 starts at the genesis block)"""
+    try:
+        page = int(request.args.get("page", 0))
+        if page < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"ok": False, "error": "page must be a non-negative integer"}), 400
+    try:
+        db = get_db()
+        last = db.execute("SELECT record_hash FROM ledger WHERE id = ?", ((page + 1) * LEDGER_PAGE_SIZE,)).fetchone()
+        if last is None:
+            # Open (or empty) page: still growing, never cached
+            return responses.send(_ledger_page(db, page, False))
+        body = ledger_pages.get((current_db_path(), page), last["record_hash"],
+                                lambda: responses.Prepared(_ledger_page(db, page, True)))
+        response = responses.send(body)
+        response.cache_control.private = True
+        response.cache_control.max_age = 3600
+        return response
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
 # 学生端API接口
 @app.route("/api/auth/login", methods=["POST"])
 def api_auth_login():
@@ -637,22 +1023,19 @@ def api_auth_login():
             return jsonify({"ok": False, "message": "Invalid username or password"}), 401
         
         # 验证密码
-        if not bcrypt.check_password_hash(row["password_hash"], password):
+        if not check_password(row["password_hash"], password):
             return jsonify({"ok": False, "message": "Invalid username or password"}), 401
         
         if not username.startswith("student"):
             return jsonify({"ok": False, "message": "This is not a student account"}), 403
         
-        db.execute("""
-            INSERT OR IGNORE INTO user_balances (user_id, balance, updated_at) 
-            VALUES (?, 0, ?)
-        """, (row["id"], now_ts()))
-        db.commit()
+        run_write(ensure_balance_row, row["id"])
         
         return jsonify({
             "ok": True, 
             "user_id": row["id"], 
-            "username": row["username"]
+            "username": row["username"],
+            "cls": g.get("cls")
         })
         
     except Exception as e:
@@ -675,26 +1058,8 @@ def api_user_balance():
         balance_row = db.execute("SELECT balance FROM user_balances WHERE user_id = ?", (user_id,)).fetchone()
         balance = balance_row["balance"] if balance_row else 0
         
-        # 获取最近的交易记录
-        recent_txs = db.execute("""
-            SELECT c.id, c.claimer, c.amount, t.token, c.created_at 
-            FROM claims c
-            LEFT JOIN tokens t ON c.token_id = t.id
-            WHERE c.claimer = ?
-            ORDER BY c.created_at DESC 
-            LIMIT 10
-        """, (str(user_id),)).fetchall()
-        
-        recent = []
-        for tx in recent_txs:
-            recent.append({
-                "id": tx["id"],
-                "user_id": user_id,
-                "amount": tx["amount"],
-                "type": "earn",
-                "token": tx["token"] or f"TX_{tx['id']}",
-                "created_at": tx["created_at"]
-            })
+        # 获取最近的交易记录 (claims and purchases, see history.py)
+        recent = [_history_item(tx, user_id) for tx in history.page(db, user_id, limit=10)]
         
         return jsonify({
             "ok": True,
@@ -707,69 +1072,90 @@ def api_user_balance():
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
-@app.route("/api/students", methods=["GET"])
-def api_list_students():
-    """获取所有学生账户列表"""
+def _history_item(tx, user_id):
+    """A history row in the student app's transaction format (amount unsigned, type earn/redeem)"""
+    return {
+        **tx,
+        "user_id": user_id,
+        "type": "earn" if tx["amount"] >= 0 else "redeem",
+        "amount": abs(tx["amount"]),
+    }
+
+@app.route("/api/user/transactions", methods=["GET"])
+def api_user_transactions():
+    """Newest-first transaction history of a student, one page at a time.
+
+    ?before= takes next_before of the previous page; each page is one range
+    scan of the (user_id, created_at) index, however far back it is.
+    """
     try:
-        db = get_db()
-        
-        students = db.execute("""
-            SELECT u.id, u.username, COALESCE(ub.balance, 0) as balance, ub.updated_at
-            FROM users u
-            LEFT JOIN user_balances ub ON u.id = ub.user_id
-            WHERE u.username LIKE 'student%'
-            ORDER BY u.id
-        """).fetchall()
-        
-        result = []
-        for student in students:
-            result.append({
-                "id": student["id"],
-                "username": student["username"],
-                "balance": student["balance"],
-                "updated_at": student["updated_at"]
-            })
-        
+        user_id = int(request.args["user_id"])
+        before = int(request.args["before"]) if request.args.get("before") else None
+        per_page = min(history.MAX_PER_PAGE, max(1, int(request.args.get("per_page", 20))))
+    except (KeyError, ValueError):
+        return jsonify({"ok": False, "error": "user_id is required; user_id, before and per_page are numbers"}), 400
+    try:
+        # One extra row tells whether there is a next page without counting the history
+        rows = history.page(get_db(), user_id, before, per_page + 1)
+        items = [_history_item(tx, user_id) for tx in rows[:per_page]]
+        has_more = len(rows) > per_page
         return jsonify({
             "ok": True,
-            "students": result
+            "user_id": user_id,
+            "per_page": per_page,
+            "has_more": has_more,
+            "next_before": items[-1]["id"] if has_more else None,
+            "transactions": items,
         })
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/api/students", methods=["GET"])
+def api_list_students():
+    """获取所有学生账户列表"""
+    try:
+        return responses.send(responses.envelope({"ok": True}, students=_students_with_balances(get_db())))
         
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+def _students_with_balances(db):
+    """JSON array of the students with their balances"""
+    return responses.rows_json(db, """
+        SELECT u.id, u.username, COALESCE(ub.balance, 0) as balance, ub.updated_at
+        FROM users u
+        LEFT JOIN user_balances ub ON u.id = ub.user_id
+        WHERE u.username LIKE 'student%'
+        ORDER BY u.id
+    """, ("id", "username", "balance", "updated_at"))
+
 # 商店管理API
+shop_items_cache = GenerationCache("shop")
+
+def _active_shop_items(db):
+    """Response body of /api/shop/items, serialised once per cache generation"""
+    items = responses.rows_json(db, """
+        SELECT id, name, description, price, category, image_url, stock, status, created_at
+        FROM shop_items
+        WHERE status = 'ACTIVE'
+        ORDER BY category, name
+    """, ("id", "name", "description", "price", "category", "image_url", "stock", "status", "created_at"))
+    return responses.Prepared(responses.envelope({"ok": True}, items=items))
+
+def _all_shop_items(db):
+    """JSON array of every shop item, inactive ones last"""
+    return responses.rows_json(db, """
+        SELECT id, name, description, price, category, image_url, stock, status, created_at, updated_at
+        FROM shop_items 
+        ORDER BY status DESC, category, name
+    """, ("id", "name", "description", "price", "category", "image_url", "stock", "status",
+          "created_at", "updated_at"))
+
 @app.route("/api/shop/items", methods=["GET"])
 def api_shop_items():
     """获取商店商品列表"""
     try:
-        db = get_db()
-        
-        items = db.execute("""
-            SELECT id, name, description, price, category, image_url, stock, status, created_at
-            FROM shop_items 
-            WHERE status = 'ACTIVE'
-            ORDER BY category, name
-        """).fetchall()
-        
-        result = []
-        for item in items:
-            result.append({
-                "id": item["id"],
-                "name": item["name"],
-                "description": item["description"],
-                "price": item["price"],
-                "category": item["category"],
-                "image_url": item["image_url"],
-                "stock": item["stock"],
-                "status": item["status"],
-                "created_at": item["created_at"]
-            })
-        
-        return jsonify({
-            "ok": True,
-            "items": result
-        })
+        return responses.send(shop_items_cache.get(get_db(), current_db_path(), _active_shop_items))
         
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -779,33 +1165,7 @@ def api_shop_items():
 def api_admin_shop_items():
     """Get all shop items"""
     try:
-        db = get_db()
-        
-        items = db.execute("""
-            SELECT id, name, description, price, category, image_url, stock, status, created_at, updated_at
-            FROM shop_items 
-            ORDER BY status DESC, category, name
-        """).fetchall()
-        
-        result = []
-        for item in items:
-            result.append({
-                "id": item["id"],
-                "name": item["name"],
-                "description": item["description"],
-                "price": item["price"],
-                "category": item["category"],
-                "image_url": item["image_url"],
-                "stock": item["stock"],
-                "status": item["status"],
-                "created_at": item["created_at"],
-                "updated_at": item["updated_at"]
-            })
-        
-        return jsonify({
-            "ok": True,
-            "items": result
-        })
+        return responses.send(responses.envelope({"ok": True}, items=_all_shop_items(get_db())))
         
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -825,13 +1185,7 @@ def api_admin_shop_add_item():
         if not name or price <= 0:
             return jsonify({"ok": False, "message": "Name and price are required"}), 400
         
-        db = get_db()
-        
-        db.execute("""
-            INSERT INTO shop_items (name, description, price, category, stock, status, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, 'ACTIVE', ?, ?)
-        """, (name, description, price, category, stock, now_ts(), now_ts()))
-        db.commit()
+        run_write(add_shop_item, name, description, price, category, stock)
         
         return jsonify({
             "ok": True,
@@ -857,20 +1211,9 @@ def api_admin_shop_update_item(item_id):
         if not name or price <= 0:
             return jsonify({"ok": False, "message": "Name and price are required"}), 400
         
-        db = get_db()
-        
-        # 检查商品是否存在
-        item = db.execute("SELECT id FROM shop_items WHERE id=?", (item_id,)).fetchone()
-        if not item:
+        if not run_write(update_shop_item, item_id, name, description, price, category, stock, status):
             return jsonify({"ok": False, "message": "Item not found"}), 404
         
-        db.execute("""
-            UPDATE shop_items 
-            SET name=?, description=?, price=?, category=?, stock=?, status=?, updated_at=?
-            WHERE id=?
-        """, (name, description, price, category, stock, status, now_ts(), item_id))
-        db.commit()
-        
         return jsonify({
             "ok": True,
             "message": "Item updated successfully"
@@ -884,16 +1227,9 @@ def api_admin_shop_update_item(item_id):
 def api_admin_shop_delete_item(item_id):
     """Delete shop item"""
     try:
-        db = get_db()
-        
-        # 检查商品是否存在
-        item = db.execute("SELECT id FROM shop_items WHERE id=?", (item_id,)).fetchone()
-        if not item:
+        if not run_write(deactivate_shop_item, item_id):
             return jsonify({"ok": False, "message": "Item not found"}), 404
         
-        db.execute("UPDATE shop_items SET status='INACTIVE', updated_at=? WHERE id=?", (now_ts(), item_id))
-        db.commit()
-        
         return jsonify({
             "ok": True,
             "message": "Item deleted successfully"
@@ -912,115 +1248,106 @@ def api_shop_purchase():
         quantity = int(data.get("quantity", 1))
         
         if not user_id or not item_id:
+            metrics.PURCHASES.inc("invalid")
             return jsonify({"ok": False, "message": "Missing user_id or item_id"}), 400
         
-        db = get_db()
-        
-        # 获取商品信息
-        item = db.execute("SELECT * FROM shop_items WHERE id=? AND status='ACTIVE'", (item_id,)).fetchone()
-        if not item:
-            return jsonify({"ok": False, "message": "Item not found"}), 404
-        
-        # 检查库存
-        if item["stock"] != -1 and item["stock"] < quantity:
-            return jsonify({"ok": False, "message": "Insufficient stock"}), 400
-        
-        # 计算总价
-        total_price = item["price"] * quantity
-        
-        # 检查用户余额
-        balance_row = db.execute("SELECT balance FROM user_balances WHERE user_id=?", (user_id,)).fetchone()
-        current_balance = balance_row["balance"] if balance_row else 0
-        
-        if current_balance < total_price:
-            return jsonify({"ok": False, "message": "Insufficient balance"}), 400
-        
-        try:
-            db.execute("BEGIN TRANSACTION")
-            db.execute("""
-                INSERT INTO purchases (user_id, item_id, quantity, total_price, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, item_id, quantity, total_price, now_ts()))
-            purchase_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
-            
-            # 更新用户余额
-            db.execute("""
-                UPDATE user_balances 
-                SET balance = balance - ?, updated_at = ?
-                WHERE user_id = ?
-            """, (total_price, now_ts(), user_id))
-            
-            if item["stock"] != -1:
-                db.execute("UPDATE shop_items SET stock = stock - ? WHERE id = ?", (quantity, item_id))
-            
-            purchase_data = {
-                "type": "purchase",
-                "user_id": user_id,
-                "item_id": item_id,
-                "item_name": item["name"],
-                "quantity": quantity,
-                "total_price": total_price,
-                "description": f"Purchased {quantity}x {item['name']}"
-            }
-            
-            # 写入区块链
-            block_hash = add_block(purchase_id, purchase_data)
-            
-            # 提交事务
-            db.commit()
-            
-        except Exception as e:
-            db.rollback()
-            raise e
-        
-        # 获取更新后的余额
-        new_balance_row = db.execute("SELECT balance FROM user_balances WHERE user_id=?", (user_id,)).fetchone()
-        new_balance = new_balance_row["balance"] if new_balance_row else 0
-        
-        return jsonify({
-            "ok": True,
-            "message": "Purchase successful",
-            "item_name": item["name"],
-            "quantity": quantity,
-            "total_price": total_price,
-            "new_balance": new_balance,
-            "purchase_id": purchase_id,
-            "block_hash": block_hash
-        })
+        return run_idempotent(purchase_item, user_id, item_id, quantity)
         
     except Exception as e:
+        if metrics.is_busy(e):
+            metrics.SQLITE_BUSY.inc("/api/shop/purchase")
+            metrics.PURCHASES.inc("locked")
+        else:
+            metrics.PURCHASES.inc("error")
         return jsonify({"ok": False, "error": str(e)}), 500
 
 # 排行榜API
+leaderboard_cache = GenerationCache("balances")
+
+def _leaderboard(db):
+    """Response body of /api/leaderboard, serialised once per cache generation"""
+    # 获取所有学生的余额排行
+    students = responses.rows_json(db, """
+        SELECT ROW_NUMBER() OVER (ORDER BY COALESCE(ub.balance, 0) DESC, u.username) AS rank,
+               u.id AS user_id, u.username, COALESCE(ub.balance, 0) as balance
+        FROM users u
+        LEFT JOIN user_balances ub ON u.id = ub.user_id
+        WHERE u.username LIKE 'student%'
+        ORDER BY balance DESC, u.username
+    """, ("rank", "user_id", "username", "balance"))
+    return responses.Prepared(responses.envelope({"ok": True}, students=students))
+
 @app.route("/api/leaderboard", methods=["GET"])
 def api_leaderboard():
     """Leaderboard"""
     try:
-        db = get_db()
-        
-        # 获取所有学生的余额排行
-        students = db.execute("""
-            SELECT u.id, u.username, COALESCE(ub.balance, 0) as balance
-            FROM users u
-            LEFT JOIN user_balances ub ON u.id = ub.user_id
-            WHERE u.username LIKE 'student%'
-            ORDER BY balance DESC, u.username
-        """).fetchall()
-        
-        result = []
-        for i, student in enumerate(students, 1):
-            result.append({
-                "rank": i,
-                "user_id": student["id"],
-                "username": student["username"],
-                "balance": student["balance"]
-            })
+        return responses.send(leaderboard_cache.get(get_db(), current_db_path(), _leaderboard))
         
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# 全校汇总API: fan out over every classroom shard (see shards.py)
+SCHOOL_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM users WHERE username LIKE 'student%') AS students,
+        (SELECT COUNT(*) FROM tokens) AS tokens,
+        (SELECT COUNT(*) FROM claims) AS claims,
+        (SELECT COALESCE(SUM(amount), 0) FROM claims) AS claimed_amount,
+        (SELECT COUNT(*) FROM purchases) AS purchases,
+        (SELECT COALESCE(SUM(total_price), 0) FROM purchases) AS spent_amount,
+        (SELECT COALESCE(MAX(id) - MIN(id) + 1, 0) FROM ledger) AS blocks
+"""
+
+@app.route("/api/school/leaderboard", methods=["GET"])
+@login_required
+def api_school_leaderboard():
+    """Leaderboard across all classes"""
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 1000))
+
+        def top_students(db):
+            return [dict(r) for r in db.execute("""
+                SELECT u.id AS user_id, u.username, COALESCE(ub.balance, 0) AS balance
+                FROM users u
+                LEFT JOIN user_balances ub ON u.id = ub.user_id
+                WHERE u.username LIKE 'student%'
+                ORDER BY balance DESC, u.username
+                LIMIT ?
+            """, (limit,))]
+
+        per_class = shards.fan_out(top_students, shards.databases(DB_PATH))
+        students = sorted((dict(st, cls=cls) for cls, rows in per_class.items() for st in rows),
+                          key=lambda st: (-st["balance"], st["cls"], st["username"]))[:limit]
+        for i, st in enumerate(students, 1):
+            st["rank"] = i
+
         return jsonify({
             "ok": True,
-            "students": result
+            "classes": len(per_class),
+            "students": students
         })
-        
+
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/api/school/stats", methods=["GET"])
+@login_required
+def api_school_stats():
+    """Totals across all classes, with the per-class figures"""
+    try:
+        per_class = shards.fan_out(lambda db: dict(db.execute(SCHOOL_STATS_SQL).fetchone()),
+                                   shards.databases(DB_PATH))
+        totals = {}
+        for stats in per_class.values():
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+
+        return jsonify({
+            "ok": True,
+            "totals": totals,
+            "classes": [dict(stats, cls=cls) for cls, stats in per_class.items()]
+        })
+
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -1030,50 +1357,229 @@ def api_leaderboard():
 def api_admin_purchases():
     """Get all purchases"""
     try:
-        db = get_db()
+        return responses.send(responses.envelope({"ok": True}, purchases=_purchase_records(get_db())))
         
-        # 获取购买记录，包含学生和商品信息
-        purchases = db.execute("""
-            SELECT 
-                p.id,
-                p.user_id,
-                p.item_id,
-                p.quantity,
-                p.total_price,
-                p.status,
-                p.created_at,
-                u.username,
-                si.name as item_name,
-                si.category,
-                si.price
-            FROM purchases p
-            LEFT JOIN users u ON p.user_id = u.id
-            LEFT JOIN shop_items si ON p.item_id = si.id
-            ORDER BY p.created_at DESC
-        """).fetchall()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+def _purchase_records(db, limit=-1):
+    """JSON array of purchases newest first, with student and item details (limit -1: all)"""
+    # 获取购买记录，包含学生和商品信息
+    return responses.rows_json(db, """
+        SELECT 
+            p.id,
+            p.user_id,
+            p.item_id,
+            p.quantity,
+            p.total_price,
+            p.status,
+            p.created_at,
+            u.username,
+            si.name as item_name,
+            si.category,
+            si.price
+        FROM purchases p
+        LEFT JOIN users u ON p.user_id = u.id
+        LEFT JOIN shop_items si ON p.item_id = si.id
+        ORDER BY p.created_at DESC
+        LIMIT ?
+    """, ("id", "user_id", "item_id", "quantity", "total_price", "status", "created_at",
+          "username", "item_name", "category", "price"), (limit,))
+
+# 仪表盘启动数据: everything dashboard_new.html loads, in one request
+BOOTSTRAP_PURCHASES = 500
+
+@app.route("/api/admin/bootstrap", methods=["GET"])
+@login_required
+def api_admin_bootstrap():
+    """Stats, shop items, students with balances and recent purchases from one read snapshot.
+
+    The arrays are serialised by SQLite (responses.rows_json) and spliced into one body.
+
+    The leaderboard is the students list ordered by balance, so it is not sent
+    twice. Only the newest BOOTSTRAP_PURCHASES purchases are included; the
+    dashboard asks /api/admin/purchases for the rest when stats.total_purchases
+    is larger.
+    """
+    try:
+        db = get_db()
+        # One read transaction, so every section sees the same database state
+        if not db.in_transaction:
+            db.execute("BEGIN")
+        try:
+            stats = dict(db.execute(DASHBOARD_STATS_SQL).fetchone())
+            items = _all_shop_items(db)
+            students = _students_with_balances(db)
+            purchases = _purchase_records(db, BOOTSTRAP_PURCHASES)
+        finally:
+            db.rollback()
         
-        # 转换为字典列表
-        purchase_list = []
-        for p in purchases:
-            purchase_list.append({
-                "id": p["id"],
-                "user_id": p["user_id"],
-                "item_id": p["item_id"],
-                "quantity": p["quantity"],
-                "total_price": p["total_price"],
-                "status": p["status"],
-                "created_at": p["created_at"],
-                "username": p["username"],
-                "item_name": p["item_name"],
-                "category": p["category"],
-                "price": p["price"]
-            })
+        return responses.send(responses.envelope({"ok": True, "stats": stats},
+                                                  items=items, students=students, purchases=purchases))
         
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# 记录导出API (streamed, see export.py)
+@app.route("/api/admin/export/<kind>.<fmt>", methods=["GET"])
+@login_required
+def api_admin_export(kind, fmt):
+    """Stream purchases, claims or ledger blocks as CSV or NDJSON"""
+    if kind not in export.EXPORTS or fmt not in export.FORMATS:
+        return jsonify({"ok": False, "message": "Unknown export"}), 404
+    try:
+        filters = {
+            "start": export.parse_time(request.args.get("from")),
+            "end": export.parse_time(request.args.get("to"), end_of_day=True),
+            "user_id": int(request.args["user_id"]) if request.args.get("user_id") else None,
+            "category": request.args.get("category") or None,
+        }
+    except ValueError:
+        return jsonify({"ok": False, "message": "from/to must be YYYY-MM-DD or a timestamp, user_id a number"}), 400
+
+    filename = f"classmint_{g.get('cls') or 'school'}_{kind}_{time.strftime('%Y%m%d')}.{fmt}"
+    return Response(stream_with_context(export.stream(get_db(), kind, fmt, **filters)),
+                    mimetype=export.FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# 学生名单导入 (see roster.py)
+ROSTER_MAX_BYTES = 1024 * 1024
+
+@app.route("/api/admin/roster/import", methods=["POST"])
+@login_required
+def api_admin_roster_import():
+    """Create student accounts from an uploaded CSV roster (username,password per line)"""
+    import roster  # multiprocessing and the bcrypt pool are only needed here
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify({"ok": False, "message": "Upload the roster as a CSV file in the 'file' field"}), 400
+    data = upload.read(ROSTER_MAX_BYTES + 1)
+    if len(data) > ROSTER_MAX_BYTES:
+        return jsonify({"ok": False, "message": "Roster file is too large"}), 413
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return jsonify({"ok": False, "message": "Roster must be UTF-8 text"}), 400
+    try:
+        summary = roster.import_roster(get_db(), text, run_write,
+                                       default_password=request.form.get("default_password") or None,
+                                       rounds=app.config.get("BCRYPT_LOG_ROUNDS", roster.ROUNDS))
+    except ValueError as e:
+        return jsonify({"ok": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, **summary})
+
+# 全文搜索API (FTS5 index, see search.py)
+@app.route("/api/admin/search", methods=["GET"])
+@login_required
+def api_admin_search():
+    """Ranked search over token descriptions, claims and purchases"""
+    text = request.args.get("q", "").strip()
+    kinds = [k for k in request.args.get("kind", "").split(",") if k]
+    if not text:
+        return jsonify({"ok": False, "message": "q is required"}), 400
+    if any(k not in search.KINDS for k in kinds):
+        return jsonify({"ok": False, "message": f"kind must be one of {', '.join(search.KINDS)}"}), 400
+    try:
+        user_id = int(request.args["user_id"]) if request.args.get("user_id") else None
+        start = export.parse_time(request.args.get("from"))
+        end = export.parse_time(request.args.get("to"), end_of_day=True)
+        page = max(1, int(request.args.get("page", 1)))
+        per_page = min(search.MAX_PER_PAGE, max(1, int(request.args.get("per_page", 20))))
+    except ValueError:
+        return jsonify({"ok": False, "message": "from/to must be YYYY-MM-DD or a timestamp, "
+                                               "user_id, page and per_page numbers"}), 400
+    try:
+        # One extra row tells whether there is a next page without counting every match
+        results = search.query(get_db(), text, kinds, user_id, start, end,
+                               limit=per_page + 1, offset=(page - 1) * per_page)
         return jsonify({
             "ok": True,
-            "purchases": purchase_list
+            "q": text,
+            "page": page,
+            "per_page": per_page,
+            "has_more": len(results) > per_page,
+            "results": results[:per_page],
         })
-        
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# 数据库维护状态 (see maintenance.py)
+@app.route("/api/admin/maintenance", methods=["GET"])
+@login_required
+def api_admin_maintenance():
+    """WAL size, free space and last maintenance runs of every database (checkpoints as seen by this worker)"""
+    try:
+        return jsonify({
+            "ok": True,
+            "databases": [{"class_id": cls, **maintenance.status(path)} for cls, path in shards.databases(DB_PATH)],
+        })
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+# 统计分析API (rollup tables, see rollups.py)
+def _analytics_range():
+    """(first_day, last_day) from ?from=&to= (dates or timestamps), default the last 30 days"""
+    end = export.parse_time(request.args.get("to"), end_of_day=True)
+    start = export.parse_time(request.args.get("from"))
+    last_day = rollups.day_of(end if end is not None else now_ts())
+    first_day = rollups.day_of(start) if start is not None else last_day - 29
+    return first_day, last_day
+
+@app.route("/api/admin/analytics/summary", methods=["GET"])
+@login_required
+def api_admin_analytics_summary():
+    """Rewards issued/claimed, redemption rate and claim latency per day or week"""
+    try:
+        first_day, last_day = _analytics_range()
+    except ValueError:
+        return jsonify({"ok": False, "message": "from/to must be YYYY-MM-DD or a timestamp"}), 400
+    bucket = request.args.get("bucket", "day")
+    if bucket not in ("day", "week"):
+        return jsonify({"ok": False, "message": "bucket must be day or week"}), 400
+    try:
+        series = rollups.series(get_db(), first_day, last_day, bucket)
+        totals = {}
+        for entry in series:
+            for key in ("tokens_issued", "amount_issued", "redeemed", "claims", "amount_claimed",
+                        "latency_count", "latency_sum", "purchases", "amount_spent"):
+                totals[key] = totals.get(key, 0) + entry[key]
+        if totals:
+            totals["redemption_rate"] = (round(totals["redeemed"] / totals["tokens_issued"], 4)
+                                         if totals["tokens_issued"] else None)
+            totals["avg_claim_latency"] = (round(totals["latency_sum"] / totals["latency_count"], 1)
+                                           if totals["latency_count"] else None)
+
+        return jsonify({
+            "ok": True,
+            "from": rollups.day_date(first_day),
+            "to": rollups.day_date(last_day),
+            "bucket": bucket,
+            "totals": totals,
+            "series": series
+        })
+
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/api/admin/analytics/top-items", methods=["GET"])
+@login_required
+def api_admin_analytics_top_items():
+    """Best-selling shop items in a date range"""
+    try:
+        first_day, last_day = _analytics_range()
+        limit = max(1, min(int(request.args.get("limit", 10)), 100))
+    except ValueError:
+        return jsonify({"ok": False, "message": "from/to must be YYYY-MM-DD or a timestamp, limit a number"}), 400
+    try:
+        return jsonify({
+            "ok": True,
+            "from": rollups.day_date(first_day),
+            "to": rollups.day_date(last_day),
+            "items": rollups.top_items(get_db(), first_day, last_day, limit)
+        })
+
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -1155,8 +1661,31 @@ def api_ledger_verify_transaction(tx_id):
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+# 性能分析API
+@app.route("/api/admin/profile", methods=["GET"])
+@login_required
+def api_admin_profile():
+    """Rolling per-route request profile (requires CM_PROFILE=1)"""
+    data = profiling.aggregates.snapshot()
+    data.update({
+        "ok": True,
+        "enabled": profiling.ENABLED,
+        "sampling": profiling.SAMPLING,
+        "slow_ms": profiling.SLOW_MS
+    })
+    return jsonify(data)
+
+@app.route("/api/admin/profile", methods=["DELETE"])
+@login_required
+def api_admin_profile_reset():
+    """Clear the rolling profile"""
+    profiling.aggregates.reset()
+    return jsonify({"ok": True, "message": "Profile reset"})
+
 # Startup entry point
 if __name__ == "__main__":
     with app.app_context():
         init_db()
+    sweeper.Sweeper(lambda: [path for _cls, path in shards.databases(DB_PATH)]).start()
+    maintenance.Maintenance(lambda: [path for _cls, path in shards.databases(DB_PATH)]).start()
     app.run(host="0.0.0.0", port=5051, debug=True, use_reloader=False)
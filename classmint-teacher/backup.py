@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint online backup tool
+Snapshot classmint.db with the SQLite online backup API while the server keeps running
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from ledger import verify_chain
+
+SNAPSHOT_PREFIX = "classmint_backup_"
+SNAPSHOT_SUFFIX = ".db"
+# Microseconds keep snapshots taken within the same second apart; names without them are from older versions
+STAMP_FORMATS = ("%Y%m%d_%H%M%S_%f", "%Y%m%d_%H%M%S")
+
+
+def online_backup(db_path, dest_path):
+    """Copy db_path into dest_path in a single backup step.
+
+    A stepped copy restarts from page 0 whenever another connection writes
+    between steps, so on a busy database it may never finish. One step reads
+    a single snapshot of the database; in WAL mode (the server's) that does
+    not block writers (claims, purchases). The copy is written to a .part file
+    and renamed into place once complete, so a crashed backup never leaves a
+    torn snapshot behind.
+    """
+    part_path = dest_path + ".part"
+    if os.path.exists(part_path):
+        os.remove(part_path)
+
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(part_path)
+    try:
+        src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    os.replace(part_path, dest_path)
+    return dest_path
+
+
+def verify_snapshot(path):
+    """Run the integrity check and the ledger hash check against a snapshot"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        integrity = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if integrity != "ok":
+            return {"ok": False, "message": f"quick_check failed: {integrity}"}
+        return verify_chain(conn)
+    finally:
+        conn.close()
+
+
+def source_fingerprint(db_path):
+    """Size and mtime of the database and its WAL; unchanged means nothing to back up"""
+    fingerprint = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+            fingerprint.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+def parse_stamp(stamp):
+    """Time a snapshot was taken from the stamp in its name, or None if it is not one"""
+    for fmt in STAMP_FORMATS:
+        try:
+            return datetime.strptime(stamp, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def list_snapshots(backup_dir):
+    """Return [(taken_at, path)] of the snapshots in backup_dir, oldest first"""
+    snapshots = []
+    if not os.path.isdir(backup_dir):
+        return snapshots
+    for name in os.listdir(backup_dir):
+        if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+            continue
+        stamp = name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)]
+        taken_at = parse_stamp(stamp)
+        if taken_at is None:
+            continue
+        snapshots.append((taken_at, os.path.join(backup_dir, name)))
+    snapshots.sort()
+    return snapshots
+
+
+def apply_retention(backup_dir, keep_last=10, keep_daily=7, now=None):
+    """Delete snapshots not kept by the policy; returns the deleted paths.
+
+    The newest `keep_last` snapshots are always kept, plus the newest snapshot
+    of each of the last `keep_daily` days.
+    """
+    now = now or datetime.now()
+    snapshots = list_snapshots(backup_dir)
+
+    keep = {path for _taken_at, path in snapshots[-keep_last:]} if keep_last > 0 else set()
+    seen_days = set()
+    for taken_at, path in reversed(snapshots):
+        day = taken_at.date()
+        if (now.date() - day).days >= keep_daily or day in seen_days:
+            continue
+        seen_days.add(day)
+        keep.add(path)
+
+    evicted = []
+    for _taken_at, path in snapshots:
+        if path not in keep:
+            os.remove(path)
+            evicted.append(path)
+    return evicted
+
+
+def take_snapshot(db_path, backup_dir, verify=True):
+    """Back up db_path into backup_dir; returns (path, verification result or None)"""
+    os.makedirs(backup_dir, exist_ok=True)
+    dest = os.path.join(
+        backup_dir, f"{SNAPSHOT_PREFIX}{datetime.now().strftime(STAMP_FORMATS[0])}{SNAPSHOT_SUFFIX}")
+    online_backup(db_path, dest)
+
+    result = None
+    if verify:
+        result = verify_snapshot(dest)
+        if not result["ok"]:
+            # Keep the evidence but take it out of the retention rotation
+            os.replace(dest, dest + ".bad")
+            dest = dest + ".bad"
+    return dest, result
+
+
+def run_schedule(db_path, backup_dir, interval, keep_last, keep_daily, once=False):
+    """Take a snapshot every `interval` seconds whenever the database has changed"""
+    last_fingerprint = None
+    while True:
+        fingerprint = source_fingerprint(db_path)
+        if fingerprint != last_fingerprint:
+            started = time.perf_counter()
+            try:
+                path, result = take_snapshot(db_path, backup_dir)
+            except sqlite3.Error as e:
+                print(f"[{datetime.now():%H:%M:%S}] Backup failed: {e}", file=sys.stderr)
+            else:
+                elapsed = time.perf_counter() - started
+                status = "verified" if result["ok"] else f"FAILED verification: {result.get('message')}"
+                print(f"[{datetime.now():%H:%M:%S}] {path} ({elapsed:.2f}s, {status})")
+                if result["ok"]:
+                    last_fingerprint = fingerprint
+                for evicted in apply_retention(backup_dir, keep_last, keep_daily):
+                    print(f"   evicted {evicted}")
+        if once:
+            return
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backups of the ClassMint database")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--dir", default="backups", help="snapshot directory (default: backups)")
+    parser.add_argument("--every", type=float, default=0,
+                        help="seconds between snapshots; 0 takes a single snapshot and exits")
+    parser.add_argument("--keep-last", type=int, default=10, help="always keep the newest N snapshots")
+    parser.add_argument("--keep-daily", type=int, default=7, help="keep one snapshot per day for N days")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    try:
+        run_schedule(args.db, args.dir, args.every, args.keep_last, args.keep_daily, once=args.every <= 0)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
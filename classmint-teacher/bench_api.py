@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint API benchmark
+Seed a synthetic school, drive a realistic request mix and report latency percentiles as JSON
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+# Relative weights of the request mix; a classroom is mostly balance checks
+# and claims, with the odd purchase and very rare full chain verification
+DEFAULT_MIX = {
+    "claim": 30,
+    "balance": 25,
+    "leaderboard": 12,
+    "shop_items": 8,
+    "purchase": 10,
+    "qr_by_id": 6,
+    "qr_by_token": 6,
+    "ledger_verify": 3,
+}
+
+def seed_school(db_path, students=30, tokens=2000, claims=1000, purchases=200, seed=0):
+    """Create a database with a synthetic school (see gen_dataset.py).
+
+    Returns a dict with the student ids, the ids of purchasable items and the
+    pool of still-claimable tokens [(token_id, token_str)] for the load run.
+    """
+    from gen_dataset import generate
+
+    summary = generate(db_path, students, tokens, claims, purchases, seed=seed, batch=10000)
+    conn = sqlite3.connect(db_path)
+    pool = conn.execute("SELECT id, token FROM tokens WHERE status='ACTIVE' ORDER BY id").fetchall()
+    conn.close()
+    return {
+        "student_ids": summary["student_ids"],
+        "item_ids": summary["item_ids"],
+        "token_pool": pool,
+    }
+
+
+class Workload:
+    """Picks the next request of the mix; shared by all load threads"""
+
+    def __init__(self, school, mix, seed):
+        self.school = school
+        self.routes = list(mix)
+        self.weights = [mix[r] for r in self.routes]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = list(school["token_pool"])
+        self.rng.shuffle(self.tokens)
+
+    def next_request(self):
+        """Return (route, method, path, json_body or None)"""
+        with self.lock:
+            route = self.rng.choices(self.routes, self.weights)[0]
+            if route == "claim" and not self.tokens:
+                route = "balance"
+            user_id = self.rng.choice(self.school["student_ids"])
+            token = self.tokens.pop() if route == "claim" else self.rng.choice(self.school["token_pool"])
+            item_id = self.rng.choice(self.school["item_ids"])
+
+        if route == "claim":
+            return route, "POST", "/api/claim", {"token": token[1], "user_id": user_id}
+        if route == "balance":
+            return route, "GET", "/api/user/balance?" + urlencode({"user_id": user_id}), None
+        if route == "leaderboard":
+            return route, "GET", "/api/leaderboard", None
+        if route == "shop_items":
+            return route, "GET", "/api/shop/items", None
+        if route == "purchase":
+            return route, "POST", "/api/shop/purchase", {"user_id": user_id, "item_id": item_id, "quantity": 1}
+        if route == "qr_by_id":
+            return route, "GET", f"/token/qr/{token[0]}", None
+        if route == "qr_by_token":
+            return route, "GET", f"/qr/{token[1]}", None
+        return route, "GET", "/api/ledger/verify", None
+
+
+class Recorder:
+    """Per-route latency samples and error counts"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.bytes = {}
+
+    def record(self, route, seconds, status, size):
+        with self.lock:
+            self.samples.setdefault(route, []).append(seconds)
+            self.bytes[route] = self.bytes.get(route, 0) + size
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, wall):
+        def stats(samples, errors, size):
+            samples = sorted(samples)
+            n = len(samples)
+
+            def pct(p):
+                return round(samples[min(n - 1, max(0, int(round(p / 100 * n)) - 1))] * 1000, 3) if n else None
+
+            return {
+                "count": n,
+                "errors": errors,
+                "error_rate": round(errors / n, 4) if n else 0,
+                "throughput_rps": round(n / wall, 2) if wall else 0,
+                "mean_ms": round(sum(samples) / n * 1000, 3) if n else None,
+                "p50_ms": pct(50),
+                "p95_ms": pct(95),
+                "p99_ms": pct(99),
+                "max_ms": round(samples[-1] * 1000, 3) if n else None,
+                "bytes_per_response": round(size / n) if n else 0,
+            }
+
+        routes = {r: stats(s, self.errors.get(r, 0), self.bytes.get(r, 0)) for r, s in sorted(self.samples.items())}
+        everything = [x for s in self.samples.values() for x in s]
+        total = stats(everything, sum(self.errors.values()), sum(self.bytes.values()))
+        return routes, total
+
+
+def run_client(workload, recorder, requests_total):
+    """Drive the mix in-process through the Flask test client (server cost only)"""
+    import app as cm
+
+    client = cm.app.test_client()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    for _ in range(requests_total):
+        route, method, path, body = workload.next_request()
+        started = time.perf_counter()
+        resp = client.open(path, method=method, json=body)
+        data = resp.get_data()
+        recorder.record(route, time.perf_counter() - started, resp.status_code, len(data))
+
+
+def run_http(workload, recorder, requests_total, threads, host, port):
+    """Drive the mix over real HTTP from `threads` keep-alive connections"""
+    # QR routes need a teacher session
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request("POST", "/login", body=urlencode({"username": "admin", "password": "admin123"}),
+                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie", "").split(";", 1)[0]
+    conn.close()
+
+    remaining = [requests_total]
+    remaining_lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        while True:
+            with remaining_lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            route, method, path, body = workload.next_request()
+            headers = {"Cookie": cookie}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers["Content-Type"] = "application/json"
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                data, status = b"", 599
+            recorder.record(route, time.perf_counter() - started, status, len(data))
+        conn.close()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+
+def start_local_server():
+    """Serve the app from a background thread; returns (server, port)"""
+    import logging
+    from werkzeug.serving import make_server
+    import app as cm
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, cm.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_port
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, result):
+    """Print p50/p95/p99 deltas against a previous JSON result"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'route':<16}{'metric':>8}{'before':>12}{'after':>12}{'delta':>10}", file=sys.stderr)
+    for route, after in sorted(result["routes"].items()):
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if before.get(metric) and after.get(metric) is not None:
+                delta = (after[metric] - before[metric]) / before[metric] * 100
+                print(f"{route:<16}{metric:>8}{before[metric]:>12.3f}{after[metric]:>12.3f}{delta:>9.1f}%",
+                      file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ClassMint API")
+    parser.add_argument("--mode", choices=("client", "http", "serve"), default="client",
+                        help="Flask test client in-process, HTTP against a threaded local server, "
+                             "or HTTP against the serve.py mode (read pool + single writer)")
+    parser.add_argument("--url", help="benchmark an already running server (host:port) instead; "
+                                      "it must serve --db")
+    parser.add_argument("--db", help="database to seed (default: a temporary file)")
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--claims", type=int, default=2000, help="tokens already claimed when the run starts")
+    parser.add_argument("--purchases", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=2000, help="requests to send")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent connections in http mode")
+    parser.add_argument("--mix", help='JSON route weights, e.g. \'{"claim": 1, "balance": 3}\'')
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and request mix")
+    parser.add_argument("--out", help="write the JSON result here instead of stdout")
+    parser.add_argument("--compare", metavar="JSON", help="print deltas against a previous result")
+    args = parser.parse_args(argv)
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = json.loads(args.mix)
+
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.mkdtemp(prefix="classmint-bench-")
+        db_path = os.path.join(tmpdir, "bench.db")
+
+    # init_db() prints account notices; keep stdout clean for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        seed_started = time.perf_counter()
+        school = seed_school(db_path, args.students, args.tokens, args.claims, args.purchases, args.seed)
+        seed_seconds = time.perf_counter() - seed_started
+
+        workload = Workload(school, mix, args.seed)
+        recorder = Recorder()
+        # The mix sends far more claims per student than the rate limits allow;
+        # in-process runs measure the server without them (see ratelimit.py)
+        import ratelimit
+        ratelimit.ENABLED = False
+        started = time.perf_counter()
+        if args.url:
+            host, _, port = args.url.replace("http://", "").rstrip("/").partition(":")
+            run_http(workload, recorder, args.requests, args.threads, host, int(port or 80))
+        elif args.mode in ("http", "serve"):
+            if args.mode == "serve":
+                import serve
+                serve.configure(db_path)
+            server, port = start_local_server()
+            try:
+                run_http(workload, recorder, args.requests, args.threads, "127.0.0.1", port)
+            finally:
+                server.shutdown()
+                if args.mode == "serve":
+                    serve.unconfigure()
+        else:
+            run_client(workload, recorder, args.requests)
+        wall = time.perf_counter() - started
+
+    routes, total = recorder.summary(wall)
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "mode": "http" if args.url else args.mode,
+            "target": args.url,
+            "threads": args.threads if (args.url or args.mode != "client") else 1,
+            "requests": args.requests,
+            "seed": args.seed,
+            "school": {"students": len(school["student_ids"]), "tokens": args.tokens,
+                       "claims": args.claims, "purchases": args.purchases},
+            "mix": mix,
+            "seed_seconds": round(seed_seconds, 3),
+            "wall_seconds": round(wall, 3),
+        },
+        "total": total,
+        "routes": routes,
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        compare(args.compare, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
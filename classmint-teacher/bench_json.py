@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint JSON response benchmark
+Compare the old row -> dict -> jsonify path with SQLite-side serialisation (responses.py):
+CPU time per response and bytes on the wire, plain and compressed
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import responses
+
+# (name, query, columns) of the list endpoints measured
+QUERIES = {
+    "purchases": ("""
+        SELECT p.id, p.user_id, p.item_id, p.quantity, p.total_price, p.status, p.created_at,
+               u.username, si.name as item_name, si.category, si.price
+        FROM purchases p
+        LEFT JOIN users u ON p.user_id = u.id
+        LEFT JOIN shop_items si ON p.item_id = si.id
+        ORDER BY p.created_at DESC
+    """, ("id", "user_id", "item_id", "quantity", "total_price", "status", "created_at",
+          "username", "item_name", "category", "price")),
+    "leaderboard": ("""
+        SELECT ROW_NUMBER() OVER (ORDER BY COALESCE(ub.balance, 0) DESC, u.username) AS rank,
+               u.id AS user_id, u.username, COALESCE(ub.balance, 0) as balance
+        FROM users u
+        LEFT JOIN user_balances ub ON u.id = ub.user_id
+        WHERE u.username LIKE 'student%'
+        ORDER BY balance DESC, u.username
+    """, ("rank", "user_id", "username", "balance")),
+    "shop_items": ("""
+        SELECT id, name, description, price, category, image_url, stock, status, created_at
+        FROM shop_items
+        WHERE status = 'ACTIVE'
+        ORDER BY category, name
+    """, ("id", "name", "description", "price", "category", "image_url", "stock", "status", "created_at")),
+}
+
+
+def old_body(app, db, sql, columns, key):
+    """What the endpoints did before: one dict per row, then jsonify"""
+    from flask import jsonify
+
+    rows = db.execute(sql).fetchall()
+    result = []
+    for row in rows:
+        result.append({name: row[name] for name in columns})
+    with app.app_context():
+        return jsonify({"ok": True, key: result}).get_data()
+
+
+def new_body(db, sql, columns, key):
+    return responses.envelope({"ok": True}, **{key: responses.rows_json(db, sql, columns)}).encode()
+
+
+def cpu_ms(fn, repeat):
+    """Median CPU milliseconds of fn() over repeat runs"""
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        fn()
+        samples.append((time.process_time() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ClassMint JSON serialisation and compression")
+    parser.add_argument("--db", help="existing database (default: a generated one)")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--purchases", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as cm
+        db_path = args.db
+        if not db_path:
+            from gen_dataset import generate
+            db_path = os.path.join(tempfile.mkdtemp(prefix="classmint-json-"), "bench.db")
+            generate(db_path, students=args.students, tokens=args.purchases, claims=args.purchases,
+                     purchases=args.purchases, workers=1)
+
+    db = cm.sqlite3.connect(db_path)
+    db.row_factory = cm.sqlite3.Row
+    result = {"brotli": responses.brotli is not None, "routes": {}}
+    for name, (sql, columns) in QUERIES.items():
+        key = "purchases" if name == "purchases" else ("students" if name == "leaderboard" else "items")
+        old = old_body(cm.app, db, sql, columns, key)
+        new = new_body(db, sql, columns, key)
+        assert json.loads(old) == json.loads(new), name
+        route = {
+            "rows": len(json.loads(new)[key]),
+            "cpu_ms": {
+                "dicts+jsonify": cpu_ms(lambda: old_body(cm.app, db, sql, columns, key), args.repeat),
+                "sqlite_json": cpu_ms(lambda: new_body(db, sql, columns, key), args.repeat),
+                "gzip": cpu_ms(lambda: responses.encode(new, "gzip"), args.repeat),
+            },
+            "bytes": {
+                "dicts+jsonify": len(old),
+                "sqlite_json": len(new),
+                "gzip": len(gzip.compress(new, responses.GZIP_LEVEL)),
+            },
+        }
+        if responses.brotli is not None:
+            route["cpu_ms"]["br"] = cpu_ms(lambda: responses.encode(new, "br"), args.repeat)
+            route["bytes"]["br"] = len(responses.encode(new, "br"))
+        result["routes"][name] = route
+    db.close()
+
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
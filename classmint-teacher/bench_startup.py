@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint startup benchmark
+Cold start of a fresh interpreter: import time per module (python -X importtime),
+then app import, database bootstrap and first request, checked against a budget
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# import app + init_db + first request in a fresh interpreter, on an initialised database
+BUDGET_MS = float(os.environ.get("CM_STARTUP_BUDGET_MS", "600"))
+
+# Runs in the child: phase timings in milliseconds as JSON on the last line of stdout
+STARTUP_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import app as cm
+t1 = time.perf_counter()
+with cm.app.app_context():
+    cm.init_db()
+    cm.close_db()
+t2 = time.perf_counter()
+cm.app.test_client().get("/login")
+t3 = time.perf_counter()
+print(json.dumps({"import_app": (t1 - t0) * 1000, "init_db": (t2 - t1) * 1000, "first_request": (t3 - t2) * 1000}))
+"""
+
+
+def child_env(db_path):
+    env = dict(os.environ, CM_DB=db_path)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def parse_importtime(stderr):
+    """[(module, depth, self_us, cumulative_us)] of a -X importtime report"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def import_report(db_path, top):
+    """Cumulative import time of app and of the top modules it pulls in directly"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=HERE,
+                          env=child_env(db_path), capture_output=True, text=True, check=True)
+    modules = parse_importtime(proc.stderr)
+    app_us = next(cumulative for name, depth, _self, cumulative in modules if name == "app" and depth == 0)
+    direct = sorted(((name, cumulative) for name, depth, _self, cumulative in modules if depth == 1),
+                    key=lambda m: -m[1])
+    return {
+        "app_ms": round(app_us / 1000, 1),
+        "modules": len(modules),
+        "top": {name: round(us / 1000, 1) for name, us in direct[:top]},
+    }
+
+
+def startup_once(db_path):
+    proc = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=HERE, env=child_env(db_path),
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def startup_report(db_path, repeat):
+    """Median phase timings over repeat fresh interpreters"""
+    runs = [startup_once(db_path) for _ in range(repeat)]
+    report = {phase: round(statistics.median(run[phase] for run in runs), 1) for phase in runs[0]}
+    report["total"] = round(sum(report.values()), 1)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ClassMint import and startup time")
+    parser.add_argument("--db", help="existing database to start against (default: a new one)")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=12, help="slowest direct imports to list")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="fail when startup on an initialised database exceeds this (CM_STARTUP_BUDGET_MS)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="classmint-startup-")
+    db_path = args.db or os.path.join(workdir, "startup.db")
+
+    result = {}
+    if not args.db:
+        # The first start creates the schema and the seeded accounts (bcrypt)
+        result["first_start"] = {phase: round(ms, 1) for phase, ms in startup_once(db_path).items()}
+    result["imports"] = import_report(db_path, args.top)
+    result["startup"] = startup_report(db_path, args.repeat)
+    result["budget_ms"] = args.budget_ms
+    result["within_budget"] = result["startup"]["total"] <= args.budget_ms
+
+    print(json.dumps(result, indent=2))
+    return 0 if result["within_budget"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+ClassMint database scheduling
+One writer thread that owns the only write connection, and a pool of read connections.
+
+SQLite allows a single writer at a time. Instead of letting request threads
+race for the write lock (and fail with "database is locked" once the busy
+timeout runs out), serve.py routes every write transaction through
+WriteQueue: requests queue their transaction function and wait for the
+result, and the writer runs queued functions back to back. Several queued
+transactions share one COMMIT (each in its own SAVEPOINT, so a failing one
+is rolled back alone), which turns the per-write fsync into a per-batch one.
+
+Reads use ReadPool connections in WAL mode, so they never wait for the writer.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import metrics
+
+
+class WriteQueue:
+    """Serialises write transactions on one dedicated connection"""
+
+    def __init__(self, path, factory=sqlite3.Connection, maxsize=1000, max_batch=32):
+        self.path = path
+        self.factory = factory
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize)
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            ready = Future()
+            self.thread = threading.Thread(target=self._run, args=(ready,), name="cm-writer", daemon=True)
+            self.thread.start()
+            ready.result()  # surfaces errors opening the database
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, fn, *args):
+        """Run fn(db, *args) in a write transaction on the writer thread and return its result.
+
+        Exceptions raised by fn are re-raised in the caller after its
+        savepoint was rolled back; the other transactions of the batch commit.
+        """
+        future = Future()
+        self.queue.put((fn, args, future, time.perf_counter()))
+        return future.result()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, factory=self.factory)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute("PRAGMA busy_timeout = 5000")
+        return db
+
+    def _run(self, ready):
+        try:
+            db = self._connect()
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            self._run_batch(db, batch)
+        db.close()
+
+    def _run_batch(self, db, batch):
+        done = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for fn, args, future, queued in batch:
+                metrics.WRITE_QUEUE_WAIT.observe(time.perf_counter() - queued)
+                db.execute("SAVEPOINT tx")
+                try:
+                    result = fn(db, *args)
+                except BaseException as e:
+                    db.execute("ROLLBACK TO tx")
+                    db.execute("RELEASE tx")
+                    done.append((future, None, e))
+                else:
+                    db.execute("RELEASE tx")
+                    done.append((future, result, None))
+            db.execute("COMMIT")
+        except BaseException as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            # Nothing of this batch was committed
+            for _fn, _args, future, _queued in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.WRITE_BATCH.observe(len(batch))
+        for future, result, error in done:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class ReadPool:
+    """Fixed set of connections for read-only request work"""
+
+    def __init__(self, path, size=8, factory=sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self.idle = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put(self._connect())
+
+    def _connect(self):
+        # mode=ro: a write that bypassed the writer fails loudly instead of contending for the lock
+        db = sqlite3.connect(Path(self.path).resolve().as_uri() + "?mode=ro", uri=True,
+                             check_same_thread=False, factory=self.factory)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def acquire(self):
+        return self.idle.get()
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        self.idle.put(db)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Pools:
+    """A writer and a read pool per database file (one per classroom shard), opened on first use"""
+
+    def __init__(self, readers=8, max_batch=32, factory=sqlite3.Connection):
+        self.readers = readers
+        self.max_batch = max_batch
+        self.factory = factory
+        self.writers = {}
+        self.read_pools = {}
+        self.lock = threading.Lock()
+
+    def writer(self, path):
+        queue_ = self.writers.get(path)
+        if queue_ is None:
+            with self.lock:
+                queue_ = self.writers.get(path)
+                if queue_ is None:
+                    queue_ = self.writers[path] = WriteQueue(path, self.factory,
+                                                             max_batch=self.max_batch).start()
+        return queue_
+
+    def reader(self, path):
+        pool = self.read_pools.get(path)
+        if pool is None:
+            # The writer opens first: it switches the file to WAL, which read-only connections cannot do
+            self.writer(path)
+            with self.lock:
+                pool = self.read_pools.get(path)
+                if pool is None:
+                    pool = self.read_pools[path] = ReadPool(path, self.readers, self.factory)
+        return pool
+
+    def depth(self):
+        return sum(q.depth() for q in list(self.writers.values()))
+
+    def close(self):
+        with self.lock:
+            for queue_ in self.writers.values():
+                queue_.stop()
+            for pool in self.read_pools.values():
+                pool.close()
+            self.writers.clear()
+            self.read_pools.clear()
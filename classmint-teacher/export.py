@@ -0,0 +1,160 @@
+"""
+ClassMint record export
+Stream purchases, claims and ledger blocks as CSV or NDJSON in constant memory.
+
+Rows are read in keyset batches (WHERE id > last ORDER BY id LIMIT n), so
+each statement is short: a long export never holds a read lock that would
+stall claims on a rollback-journal database, and nothing is buffered beyond
+one batch. The id bound is fixed when the export starts, so rows written
+meanwhile are not picked up half way.
+"""
+
+import csv
+import io
+import time
+from datetime import datetime
+
+import records
+
+BATCH = 1000
+
+# Student id of a ledger block, as in replay_balances.py
+_BLOCK_USER = ("CAST(COALESCE(json_extract(l.block_data, '$.claim_data.user_id'), "
+               "json_extract(l.block_data, '$.claim_data.claimer')) AS INTEGER)")
+
+EXPORTS = {
+    "purchases": {
+        "table": "purchases",
+        "columns": ("id", "created_at", "user_id", "username", "item_id", "item_name", "category",
+                    "quantity", "price", "total_price", "status"),
+        "sql": """
+            SELECT p.id, p.created_at, p.user_id, u.username, p.item_id, si.name, si.category,
+                   p.quantity, si.price, p.total_price, p.status
+            FROM purchases p
+            LEFT JOIN users u ON p.user_id = u.id
+            LEFT JOIN shop_items si ON p.item_id = si.id
+            WHERE p.id > ? AND p.id <= ? {filters}
+            ORDER BY p.id
+            LIMIT ?
+        """,
+        "alias": "p",
+        "user": "p.user_id = ?",
+        "category": "si.category = ?",
+    },
+    "claims": {
+        "table": "claims",
+        "columns": ("id", "created_at", "user_id", "username", "token_id", "amount", "description"),
+        "sql": """
+            SELECT c.id, c.created_at, c.claimer, u.username, c.token_id, c.amount, t.description
+            FROM claims c
+            LEFT JOIN users u ON u.id = CAST(c.claimer AS INTEGER)
+            LEFT JOIN tokens t ON t.id = c.token_id
+            WHERE c.id > ? AND c.id <= ? {filters}
+            ORDER BY c.id
+            LIMIT ?
+        """,
+        "alias": "c",
+        "user": "c.claimer = CAST(? AS TEXT)",
+    },
+    "ledger": {
+        "table": "ledger",
+        "columns": ("id", "created_at", "tx_id", "prev_hash", "record_hash", "block_data"),
+        "json_columns": ("block_data",),
+        "sql": """
+            SELECT l.id, l.created_at, l.tx_id, l.prev_hash, l.record_hash, l.block_data
+            FROM ledger l
+            WHERE l.id > ? AND l.id <= ? {filters}
+            ORDER BY l.id
+            LIMIT ?
+        """,
+        "alias": "l",
+        "user": _BLOCK_USER + " = ?",
+    },
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_time(value, end_of_day=False):
+    """Unix timestamp or YYYY-MM-DD (local time) -> int; None passes through"""
+    if value in (None, ""):
+        return None
+    if value.isdigit():
+        return int(value)
+    day = datetime.strptime(value, "%Y-%m-%d")
+    ts = int(time.mktime(day.timetuple()))
+    return ts + 86399 if end_of_day else ts
+
+
+def export_rows(db, kind, start=None, end=None, user_id=None, category=None, batch=BATCH):
+    """Yield row tuples of one export in id order"""
+    spec = EXPORTS[kind]
+    filters, params = [], []
+    if start is not None:
+        filters.append(f"{spec['alias']}.created_at >= ?")
+        params.append(start)
+    if end is not None:
+        filters.append(f"{spec['alias']}.created_at <= ?")
+        params.append(end)
+    if user_id is not None:
+        filters.append(spec["user"])
+        params.append(user_id)
+    if category and "category" in spec:
+        filters.append(spec["category"])
+        params.append(category)
+    sql = spec["sql"].format(filters="".join(" AND " + f for f in filters))
+
+    top = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {spec['table']}").fetchone()[0]
+    last = 0
+    while True:
+        rows = db.execute(sql, [last, top] + params + [batch]).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield tuple(row)
+        last = rows[-1][0]
+
+
+def to_csv(columns, rows, batch=BATCH):
+    """CSV text chunks: the header first, then one chunk per batch of rows"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+        if n % batch == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def to_ndjson(columns, rows, json_columns=(), batch=BATCH):
+    """One JSON object per line, chunked per batch of rows"""
+    encode = records.encoder(columns, json_columns)
+    lines = []
+    for row in rows:
+        lines.append(encode(row))
+        if len(lines) >= batch:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def stream(db, kind, fmt, **filters):
+    """Text chunks of one export in fmt ("csv" or "ndjson")"""
+    spec = EXPORTS[kind]
+    rows = export_rows(db, kind, **filters)
+    if fmt == "csv":
+        return to_csv(spec["columns"], rows)
+    return to_ndjson(spec["columns"], rows, spec.get("json_columns", ()))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint synthetic dataset generator
+Write signed tokens, claims, purchases, balances and a valid ledger chain straight into SQLite
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import time
+from multiprocessing import Pool
+
+import app as cm
+import gencache
+import history
+import rollups
+from ledger import build_block
+
+STUDENT_PASSWORD = "student123"
+AMOUNTS = (100, 200, 500, 1000)
+
+
+def _sign_chunk(chunk):
+    """Sign [(amount, exp, nonce, desc)] in a worker process"""
+    return [cm.sign_payload({"amount": amount, "one": 1, "exp": exp, "nonce": nonce, "desc": desc})
+            for amount, exp, nonce, desc in chunk]
+
+
+def _chunks(n, size):
+    for low in range(0, n, size):
+        yield low, min(n, low + size)
+
+
+def generate(db_path, students=30, tokens=10000, claims=5000, purchases=1000, days=90,
+             seed=0, workers=None, batch=50000, verbose=False):
+    """Populate db_path and return a summary dict.
+
+    Tokens are issued evenly over the last `days` days; the first `claims`
+    tokens are claimed shortly after issue and purchases are interleaved with
+    the claims, so the ledger is in the same order the app would have written
+    it and /api/ledger/verify accepts the result.
+    """
+    cm.DB_PATH = db_path
+    with cm.app.app_context():
+        cm.init_db()
+        cm.close_db()
+
+    rng = random.Random(seed)
+    claims = min(claims, tokens)
+    now = int(time.time())
+    start = now - days * 86400
+    step = max(1, days * 86400 // max(tokens, 1))
+    timings = {}
+
+    conn = sqlite3.connect(db_path)
+    # Bulk load: the file is rebuilt from scratch if this process dies
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+
+    started = time.perf_counter()
+    # One bcrypt hash shared by every synthetic student keeps generation fast
+    pw_hash = cm.bcrypt.generate_password_hash(STUDENT_PASSWORD).decode()
+    width = max(5, len(str(students)))
+    conn.executemany("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
+                     [(f"student{i:0{width}d}", pw_hash) for i in range(students)])
+    student_ids = [r[0] for r in conn.execute(
+        "SELECT id FROM users WHERE username LIKE 'student%' ORDER BY id")]
+
+    conn.executemany("""
+        INSERT INTO shop_items (name, description, price, category, stock, status, created_at, updated_at)
+        VALUES (?, ?, ?, 'synthetic', -1, 'ACTIVE', ?, ?)
+    """, [(f"Synthetic item {i}", "Generated item", 100 * (i + 1), start, start) for i in range(5)])
+    items = conn.execute("SELECT id, name, price FROM shop_items WHERE category='synthetic'").fetchall()
+    timings["users + items"] = time.perf_counter() - started
+
+    token_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tokens").fetchone()[0]
+    claim_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM claims").fetchone()[0]
+    purchase_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM purchases").fetchone()[0]
+    prev = conn.execute("SELECT record_hash FROM ledger ORDER BY id DESC LIMIT 1").fetchone()
+    prev_hash = prev[0] if prev else ""
+    balances = dict(conn.execute("SELECT user_id, balance FROM user_balances"))
+    for uid in student_ids:
+        balances.setdefault(uid, 0)
+
+    purchase_rate = purchases / claims if claims else 0
+    counts = {"tokens": 0, "claims": 0, "purchases": 0, "ledger": 0}
+    sign_seconds = write_seconds = chain_seconds = 0.0
+
+    pool = Pool(workers) if (workers or os.cpu_count() or 1) > 1 else None
+    try:
+        for low, high in _chunks(tokens, batch):
+            # Token payloads are drawn in the parent so the output only depends on --seed
+            specs, meta = [], []
+            for i in range(low, high):
+                amount = rng.choice(AMOUNTS)
+                created = start + i * step
+                nonce = hashlib.sha256(rng.randbytes(16)).hexdigest()
+                specs.append((amount, now + 30 * 86400 if i >= claims else created + 3600,
+                              nonce, f"Synthetic reward {i}"))
+                meta.append(created)
+
+            t0 = time.perf_counter()
+            if pool:
+                size = max(1, len(specs) // (4 * (workers or os.cpu_count())))
+                signed = [tok for part in pool.map(_sign_chunk, [specs[j:j + size]
+                                                                  for j in range(0, len(specs), size)])
+                          for tok in part]
+            else:
+                signed = _sign_chunk(specs)
+            sign_seconds += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            token_rows, claim_rows, purchase_rows, ledger_rows = [], [], [], []
+            for (amount, exp, _nonce, desc), created, token_str, i in zip(specs, meta, signed, range(low, high)):
+                token_id += 1
+                claimed = i < claims
+                token_rows.append((token_id, token_str, amount, 1, exp, 1, "USED" if claimed else "ACTIVE",
+                                   created, desc))
+                if not claimed:
+                    continue
+
+                claim_id += 1
+                user_id = rng.choice(student_ids)
+                ts = created + rng.randint(1, max(1, min(step, 3600)))
+                claim_rows.append((claim_id, token_id, str(user_id), amount, ts))
+                balances[user_id] += amount
+                payload, record_hash = build_block(prev_hash, claim_id, {
+                    "claimer": str(user_id), "amount": amount, "token_id": token_id, "description": desc
+                }, ts)
+                ledger_rows.append((claim_id, prev_hash, record_hash, ts, payload))
+                prev_hash = record_hash
+
+                if rng.random() < purchase_rate:
+                    item_id, name, price = rng.choice(items)
+                    if balances[user_id] >= price:
+                        purchase_id += 1
+                        purchase_rows.append((purchase_id, user_id, item_id, 1, price, ts))
+                        balances[user_id] -= price
+                        payload, record_hash = build_block(prev_hash, purchase_id, {
+                            "type": "purchase", "user_id": user_id, "item_id": item_id, "item_name": name,
+                            "quantity": 1, "total_price": price, "description": f"Purchased 1x {name}"
+                        }, ts)
+                        ledger_rows.append((purchase_id, prev_hash, record_hash, ts, payload))
+                        prev_hash = record_hash
+            chain_seconds += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            conn.executemany("""
+                INSERT INTO tokens (id, token, amount, one_time, expires_at, issued_by, status, created_at, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, token_rows)
+            conn.executemany("INSERT INTO claims (id, token_id, claimer, amount, created_at) VALUES (?,?,?,?,?)",
+                             claim_rows)
+            conn.executemany("""
+                INSERT INTO purchases (id, user_id, item_id, quantity, total_price, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, purchase_rows)
+            conn.executemany("INSERT INTO ledger (tx_id, prev_hash, record_hash, created_at, block_data) VALUES (?,?,?,?,?)",
+                             ledger_rows)
+            conn.commit()
+            write_seconds += time.perf_counter() - t0
+
+            counts["tokens"] += len(token_rows)
+            counts["claims"] += len(claim_rows)
+            counts["purchases"] += len(purchase_rows)
+            counts["ledger"] += len(ledger_rows)
+            if verbose:
+                print(f"\r   {high}/{tokens} tokens", end="", file=sys.stderr)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if verbose:
+        print(file=sys.stderr)
+
+    conn.executemany("""
+        INSERT INTO user_balances (user_id, balance, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance, updated_at = excluded.updated_at
+    """, [(uid, bal, now) for uid, bal in balances.items()])
+    gencache.bump(conn, "balances", "shop")
+    conn.commit()
+    t0 = time.perf_counter()
+    rollups.backfill(conn)
+    conn.commit()
+    timings["rollups"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    history.backfill(conn)
+    conn.commit()
+    timings["history"] = time.perf_counter() - t0
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("ANALYZE")
+    conn.close()
+
+    timings.update({"sign": sign_seconds, "chain": chain_seconds, "write": write_seconds})
+    return {
+        "db": db_path,
+        "student_ids": student_ids,
+        "item_ids": [r[0] for r in items],
+        "counts": counts,
+        "timings": timings,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large synthetic ClassMint database")
+    parser.add_argument("db", help="database file to create")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--tokens", type=int, default=1000000)
+    parser.add_argument("--claims", type=int, default=800000, help="how many of the tokens get claimed")
+    parser.add_argument("--purchases", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=120, help="history length the data is spread over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="signing processes (default: all cores)")
+    parser.add_argument("--batch", type=int, default=50000, help="tokens per write transaction")
+    parser.add_argument("--force", action="store_true", help="overwrite an existing database file")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.force:
+            print(f"{args.db} already exists (use --force to overwrite)")
+            return 2
+        os.remove(args.db)
+
+    started = time.perf_counter()
+    summary = generate(args.db, args.students, args.tokens, args.claims, args.purchases, args.days,
+                       args.seed, args.workers, args.batch, verbose=True)
+    elapsed = time.perf_counter() - started
+
+    counts = summary["counts"]
+    print(f"Generated {args.db} in {elapsed:.1f}s")
+    for name, value in counts.items():
+        print(f"   {name:<10} {value:>12,}")
+    for name, seconds in summary["timings"].items():
+        print(f"   {name:<14} {seconds:8.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+ClassMint cross-process cache invalidation
+In-process caches that stay correct when several server processes share one database.
+
+Each cache watches a named generation counter in the cache_generations
+table. Write transactions bump the counters of the data they change
+(bump(db, "balances")) in the same transaction, so every process sees the
+new generation exactly when it can see the new rows, and recomputes its
+cached value on the next read. Checking costs one primary-key lookup.
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_generations (
+  name TEXT PRIMARY KEY,
+  generation INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def bump(db, *names):
+    """Invalidate the caches watching `names` (call inside the write transaction)"""
+    try:
+        db.executemany("""
+            INSERT INTO cache_generations (name, generation) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET generation = generation + 1
+        """, [(name,) for name in names])
+    except sqlite3.OperationalError:
+        # Database created before the table existed: no server has cached anything from it
+        pass
+
+
+def generation(db, name):
+    """Current generation of `name`, or None when the table is missing"""
+    try:
+        row = db.execute("SELECT generation FROM cache_generations WHERE name=?", (name,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else 0
+
+
+class GenerationCache:
+    """Values computed from the database, dropped when the watched generation moves"""
+
+    def __init__(self, name):
+        self.name = name
+        self.entries = {}  # key -> (generation, value)
+        self.lock = threading.Lock()
+
+    def get(self, db, key, compute):
+        """Cached value for key, or compute(db) when missing or stale"""
+        # Read the generation before the data: a write in between only costs a recompute
+        gen = generation(db, self.name)
+        if gen is None:
+            return compute(db)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] == gen:
+            return entry[1]
+        value = compute(db)
+        with self.lock:
+            self.entries[key] = (gen, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FragmentCache:
+    """Values for ranges of rows that never change once written (closed ledger pages).
+
+    No generation to watch: each entry is stored with a fingerprint of its
+    range (the hash of the last block) and served while a fresh fingerprint,
+    one primary-key lookup, still matches, which also covers a database
+    restored from a backup. Least recently used entries beyond max_entries
+    are dropped.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (fingerprint, value)
+        self.lock = threading.Lock()
+
+    def get(self, key, fingerprint, compute):
+        """Cached value for key, or compute() when missing or its fingerprint changed"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self.entries.move_to_end(key)
+                return entry[1]
+        value = compute()
+        with self.lock:
+            self.entries[key] = (fingerprint, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint transaction history
+One row per balance change of a student, with the balance after it, kept up to date by the write transactions.
+
+claims.claimer is TEXT holding whatever id the client sent, and purchases
+live in their own table, so a student's history used to be a string match
+on claims alone. transactions holds claims (positive amount), purchases
+(negative) and term opening balances under the integer user id, indexed on
+(user_id, created_at): a page of anyone's history is one range scan of that
+index, however long the history is. Pages are keyed by the last row seen
+(created_at, id) rather than an offset, so deep pages cost the same.
+
+Run this file to rebuild the history from the raw tables, e.g. after
+importing data with tools that bypass app.py. Rebuilt running balances are
+the sums of the rows (opening balances, claims, purchases) in time order.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+MAX_PER_PAGE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  kind TEXT NOT NULL,
+  ref INTEGER,
+  amount INTEGER NOT NULL,
+  balance INTEGER NOT NULL,
+  description TEXT DEFAULT '',
+  created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions(user_id, created_at);
+"""
+
+
+def ensure(db):
+    """Create the history table, filling it from existing rows when it is new"""
+    new = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'transactions'").fetchone() is None
+    db.executescript(SCHEMA)
+    if new:
+        backfill(db)
+
+
+# Write-time maintenance, called inside the write transactions of app.py after user_balances is updated
+def record(db, user_id, kind, ref, amount, description, created_at):
+    """Append one balance change (amount is signed) with the student's balance after it"""
+    db.execute("""
+        INSERT INTO transactions (user_id, kind, ref, amount, balance, description, created_at)
+        SELECT ?, ?, ?, ?, COALESCE((SELECT balance FROM user_balances WHERE user_id = ?), 0), ?, ?
+    """, (user_id, kind, ref, amount, user_id, description, created_at))
+
+
+def record_opening(db, balances, created_at):
+    """Opening balances [(user_id, balance)] of a new term (term_rollover.py)"""
+    db.executemany("""
+        INSERT INTO transactions (user_id, kind, ref, amount, balance, description, created_at)
+        VALUES (?, 'opening', NULL, ?, ?, 'Opening balance carried from previous term', ?)
+    """, [(user_id, balance, balance, created_at) for user_id, balance in balances])
+
+
+# Backfill: claims with a numeric claimer, purchases and the opening-balance blocks of term_rollover.py,
+# with running balances summed per student in time order (claims before purchases within a second)
+BACKFILL_SQL = """
+    INSERT INTO transactions (user_id, kind, ref, amount, balance, description, created_at)
+    SELECT user_id, kind, ref, amount,
+           SUM(amount) OVER (PARTITION BY user_id ORDER BY created_at, seq, ref ROWS UNBOUNDED PRECEDING),
+           description, created_at
+    FROM (
+        SELECT CAST(json_extract(block_data, '$.claim_data.user_id') AS INTEGER) AS user_id, 'opening' AS kind,
+               NULL AS ref, json_extract(block_data, '$.claim_data.amount') AS amount,
+               json_extract(block_data, '$.claim_data.description') AS description, created_at, 0 AS seq
+        FROM ledger
+        WHERE tx_id = 0 AND json_extract(block_data, '$.claim_data.type') = 'opening_balance'
+        UNION ALL
+        SELECT CAST(c.claimer AS INTEGER), 'claim', c.id, c.amount, COALESCE(t.description, ''), c.created_at, 1
+        FROM claims c LEFT JOIN tokens t ON t.id = c.token_id
+        WHERE c.claimer GLOB '[0-9]*' AND c.claimer NOT GLOB '*[^0-9]*'
+        UNION ALL
+        SELECT p.user_id, 'purchase', p.id, -p.total_price,
+               'Purchased ' || p.quantity || 'x ' || COALESCE(si.name, 'item #' || p.item_id), p.created_at, 2
+        FROM purchases p LEFT JOIN shop_items si ON si.id = p.item_id
+    )
+    WHERE created_at IS NOT NULL
+    ORDER BY created_at, seq, ref
+"""
+
+
+def backfill(db):
+    """Rebuild the whole history from the raw tables (caller owns the transaction); returns the row count"""
+    db.execute("DELETE FROM transactions")
+    db.execute("DELETE FROM sqlite_sequence WHERE name = 'transactions'")
+    return db.execute(BACKFILL_SQL).rowcount
+
+
+# Query for the history endpoint
+def page(db, user_id, before=None, limit=20):
+    """Newest-first transactions of user_id, as dicts; before is the id of the last row of the previous page"""
+    where, params = "user_id = ?", [user_id]
+    if before is not None:
+        # (created_at, id) < the cursor row's, as a range on the (user_id, created_at) index
+        where += """ AND created_at <= (SELECT created_at FROM transactions WHERE id = ?)
+                     AND (created_at < (SELECT created_at FROM transactions WHERE id = ?) OR id < ?)"""
+        params += [before, before, before]
+    rows = db.execute(f"""
+        SELECT id, kind, ref, amount, balance, description, created_at
+        FROM transactions
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, params + [limit]).fetchall()
+    return [dict(r) for r in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the ClassMint transaction history from the raw tables")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        conn.executescript(SCHEMA)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = backfill(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        students = conn.execute("SELECT COUNT(DISTINCT user_id) FROM transactions").fetchone()[0]
+    finally:
+        conn.close()
+
+    print(f"Rebuilt {rows} transactions of {students} students in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+ClassMint idempotency keys
+Answer a retried write request with the response of its first attempt.
+
+Clients send an Idempotency-Key header on claim, purchase and token create.
+run() records the response under the key inside the write transaction of the
+request itself, so the key is stored exactly when the effects are: a retry
+after a timeout either finds the committed response and gets it back without
+running anything, or finds nothing because the first attempt rolled back.
+Keys expire after TTL seconds and the writers delete expired rows now and then.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import time
+
+TTL = int(os.environ.get("CM_IDEMPOTENCY_TTL", str(24 * 3600)))
+SWEEP_EVERY = 200  # stores between deletions of expired keys
+MAX_KEY_LENGTH = 128
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  route TEXT NOT NULL,
+  key TEXT NOT NULL,
+  fingerprint BLOB NOT NULL,
+  status INTEGER NOT NULL,
+  body TEXT NOT NULL,
+  created_at INTEGER NOT NULL,
+  PRIMARY KEY (route, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at);
+"""
+
+_stores = itertools.count(1)
+
+
+class KeyReused(ValueError):
+    """The key was already used for a request with a different body"""
+
+
+def fingerprint(data: bytes) -> bytes:
+    """Short digest of a request body, to tell a retry from a different request"""
+    return hashlib.sha256(data).digest()[:16]
+
+
+def lookup(db, route, key, fp):
+    """(body, status) stored for key, or None when unknown or expired; raises KeyReused"""
+    row = db.execute("""
+        SELECT fingerprint, status, body FROM idempotency_keys
+        WHERE route = ? AND key = ? AND created_at >= ?
+    """, (route, key, int(time.time()) - TTL)).fetchone()
+    if row is None:
+        return None
+    if row[0] != fp:
+        raise KeyReused(key)
+    return json.loads(row[2]), row[1]
+
+
+def run(db, route, key, fp, fn, *args):
+    """Write transaction: fn(db, *args) -> (body, status), run once per key.
+
+    Returns (body, status, replayed).
+    """
+    stored = lookup(db, route, key, fp)
+    if stored is not None:
+        return stored + (True,)
+    body, status = fn(db, *args)
+    now = int(time.time())
+    # REPLACE: an expired row may still hold the key
+    db.execute("""
+        INSERT OR REPLACE INTO idempotency_keys (route, key, fingerprint, status, body, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (route, key, fp, status, json.dumps(body, separators=(",", ":")), now))
+    if next(_stores) % SWEEP_EVERY == 0:
+        db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - TTL,))
+    return body, status, False
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint database maintenance
+Checkpoint the WAL, refresh planner statistics, return free pages and check integrity, while the database is quiet.
+
+In WAL mode every commit appends to the -wal file, and the writer copies
+it back into the database every 1000 pages (SQLite's auto-checkpoint).
+A long read, such as an export, a backup or a chain verification, can hold
+that back, and the WAL file never shrinks once it has grown. Nothing
+refreshed the planner statistics either, and the pages freed by term
+rollovers and token purges stayed in the file.
+
+A Maintenance thread checks every database every CM_MAINTENANCE_INTERVAL
+seconds. The database counts as quiet once neither its WAL nor the
+database file itself (written in place when it is not in WAL mode, as
+under the debug server) has changed for CM_MAINTENANCE_QUIET seconds. Then, once per quiet period, it runs:
+- a PASSIVE checkpoint, so the next burst of claims starts on an empty WAL
+- a TRUNCATE checkpoint instead when the WAL is over CM_WAL_TRUNCATE_MB
+- at most one due task: ANALYZE (row-sampled, see ANALYSIS_LIMIT),
+  incremental vacuum (databases with auto_vacuum=INCREMENTAL, which
+  term_rollover.py switches on), or integrity_check on a read-only connection
+Each step is short and uses its own connection with a short busy timeout,
+so a class that starts claiming waits at most one step for the write lock.
+Checkpoints and incremental vacuum cannot run inside the writer's batched
+transactions anyway.
+
+The last run of each task is kept in maintenance_runs, so worker
+processes share one schedule and the status shows runs from this CLI too.
+serve.py (and the debug server) run the thread over every database,
+classroom shards included; /api/admin/maintenance reports the status.
+Run this file to run maintenance now, or to print the status.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+INTERVAL = float(os.environ.get("CM_MAINTENANCE_INTERVAL", "15"))
+QUIET = float(os.environ.get("CM_MAINTENANCE_QUIET", "30"))  # seconds without WAL changes
+TRUNCATE_WAL_BYTES = int(float(os.environ.get("CM_WAL_TRUNCATE_MB", "16")) * 1024 * 1024)
+ANALYZE_EVERY = float(os.environ.get("CM_ANALYZE_HOURS", "6")) * 3600
+VACUUM_EVERY = float(os.environ.get("CM_VACUUM_HOURS", "24")) * 3600
+INTEGRITY_EVERY = float(os.environ.get("CM_INTEGRITY_HOURS", "24")) * 3600
+ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE: milliseconds instead of a full scan
+VACUUM_BATCH = 1000  # pages returned per write transaction
+VACUUM_MAX_PAGES = 25600  # per run (100 MB of 4 KB pages)
+BUSY_MS = 200
+PAUSE = 0.05  # seconds between vacuum batches
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+  task TEXT PRIMARY KEY,
+  last_run INTEGER NOT NULL,
+  seconds REAL NOT NULL,
+  result TEXT
+);
+"""
+
+# task -> seconds between runs
+TASKS = {"analyze": ANALYZE_EVERY, "vacuum": VACUUM_EVERY, "integrity": INTEGRITY_EVERY}
+
+# Last checkpoint per database path, of this process: {"at", "mode", "seconds", "result"}
+checkpoints = {}
+
+
+def connect(path, busy_ms=BUSY_MS):
+    db = sqlite3.connect(path, isolation_level=None, timeout=busy_ms / 1000, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def wal_fingerprint(path):
+    """Size and mtime of the WAL; unchanged means nothing was committed meanwhile"""
+    try:
+        st = os.stat(path + "-wal")
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def activity_fingerprint(path):
+    """Size and mtime of the database file and of its WAL; a commit changes one of them in any journal mode"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns), wal_fingerprint(path)
+
+
+def wal_bytes(path):
+    fingerprint = wal_fingerprint(path)
+    return fingerprint[0] if fingerprint else 0
+
+
+def checkpoint(path, mode=None):
+    """Checkpoint the WAL of path; mode None picks TRUNCATE for an oversized WAL, else PASSIVE.
+
+    Returns the result dict also kept in `checkpoints`, or None when the
+    database is not in WAL mode.
+    """
+    mode = mode or ("TRUNCATE" if wal_bytes(path) > TRUNCATE_WAL_BYTES else "PASSIVE")
+    started = time.perf_counter()
+    db = connect(path)
+    try:
+        if db.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            return None
+        busy, wal_frames, checkpointed = db.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        db.close()
+    result = {
+        "at": int(time.time()),
+        "mode": mode.lower(),
+        "seconds": round(time.perf_counter() - started, 4),
+        # busy: a reader or writer kept the checkpoint from finishing; it is retried next quiet period
+        "result": "busy" if busy else f"{checkpointed}/{wal_frames} frames",
+        "wal_bytes": wal_bytes(path),
+    }
+    checkpoints[path] = result
+    return result
+
+
+def analyze(db):
+    db.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    db.execute("ANALYZE")
+    return "ok"
+
+
+def vacuum(db, max_pages=VACUUM_MAX_PAGES, stop=None):
+    """Return up to max_pages free pages to the filesystem, VACUUM_BATCH per transaction"""
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return "skipped: auto_vacuum is not incremental (see term_rollover.py)"
+    freed = 0
+    while freed < max_pages and (stop is None or not stop.is_set()):
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if free == 0:
+            break
+        batch = min(free, VACUUM_BATCH, max_pages - freed)
+        # executescript steps the pragma to completion; execute() would free a single page
+        db.executescript(f"PRAGMA incremental_vacuum({batch});")
+        freed += batch
+        time.sleep(PAUSE)
+    return f"{freed} pages freed, {db.execute('PRAGMA freelist_count').fetchone()[0]} free"
+
+
+def integrity(path):
+    """integrity_check on a read-only connection, which never blocks the writer in WAL mode"""
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [r[0] for r in db.execute("PRAGMA integrity_check(20)")]
+    finally:
+        db.close()
+    if problems != ["ok"]:
+        print(f"Integrity check of {path} failed: {'; '.join(problems)}", file=sys.stderr)
+    return "; ".join(problems)
+
+
+def last_runs(db):
+    """{task: {"last_run", "seconds", "result"}} from maintenance_runs"""
+    try:
+        rows = db.execute("SELECT task, last_run, seconds, result FROM maintenance_runs").fetchall()
+    except sqlite3.OperationalError:
+        return {}  # database the app has not upgraded yet
+    return {r["task"]: {"last_run": r["last_run"], "seconds": r["seconds"], "result": r["result"]} for r in rows}
+
+
+def run_task(path, task, stop=None):
+    """Run one task now and record it; returns its result text"""
+    started = time.perf_counter()
+    db = connect(path)
+    try:
+        if task == "analyze":
+            result = analyze(db)
+        elif task == "vacuum":
+            result = vacuum(db, stop=stop)
+        elif task == "integrity":
+            result = integrity(path)
+        else:
+            raise ValueError(f"unknown maintenance task {task!r}")
+        db.executescript(SCHEMA)
+        db.execute("""
+            INSERT INTO maintenance_runs (task, last_run, seconds, result) VALUES (?, ?, ?, ?)
+            ON CONFLICT(task) DO UPDATE SET
+                last_run = excluded.last_run, seconds = excluded.seconds, result = excluded.result
+        """, (task, int(time.time()), round(time.perf_counter() - started, 4), result))
+    finally:
+        db.close()
+    return result
+
+
+def due_task(path, now=None):
+    """The task that is most overdue, or None"""
+    now = now or time.time()
+    db = connect(path)
+    try:
+        runs = last_runs(db)
+    finally:
+        db.close()
+    overdue = [(now - runs.get(task, {}).get("last_run", 0) - every, task)
+               for task, every in TASKS.items() if every > 0]
+    overdue = [(late, task) for late, task in overdue if late >= 0]
+    return max(overdue)[1] if overdue else None
+
+
+def status(path):
+    """Database size, WAL size, free pages and the last maintenance runs of one database"""
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    try:
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        info = {
+            "journal_mode": db.execute("PRAGMA journal_mode").fetchone()[0],
+            "auto_vacuum": ("none", "full", "incremental")[db.execute("PRAGMA auto_vacuum").fetchone()[0]],
+            "db_bytes": db.execute("PRAGMA page_count").fetchone()[0] * page_size,
+            "free_bytes": db.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            "wal_bytes": wal_bytes(path),
+            "checkpoint": checkpoints.get(path),
+            "tasks": last_runs(db),
+        }
+    finally:
+        db.close()
+    for task, every in TASKS.items():
+        run = info["tasks"].setdefault(task, {"last_run": None})
+        run["next_due"] = run["last_run"] + int(every) if run["last_run"] and every > 0 else None
+    return info
+
+
+class Maintenance:
+    """Background thread maintaining databases() while they are quiet, checked every interval seconds"""
+
+    def __init__(self, databases, interval=INTERVAL, quiet=QUIET):
+        self.databases = databases
+        self.interval = interval
+        self.quiet = quiet
+        self.seen = {}  # path -> (activity fingerprint, monotonic time it was first seen)
+        self.done = {}  # path -> activity fingerprint after this quiet period's maintenance
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self._run, name="cm-maintenance", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def is_quiet(self, path):
+        fingerprint, now = activity_fingerprint(path), time.monotonic()
+        seen = self.seen.get(path)
+        if seen is None or seen[0] != fingerprint:
+            self.seen[path] = (fingerprint, now)
+            return False
+        return now - seen[1] >= self.quiet
+
+    def tick(self, path):
+        """Once path is quiet: checkpoint (once per quiet period) and run at most one due task.
+
+        Returns [(task, result)] of what ran.
+        """
+        if not self.is_quiet(path):
+            return []
+        ran = []
+        if self.done.get(path) != self.seen[path][0]:
+            ran.append(("checkpoint", checkpoint(path)))
+        task = due_task(path)
+        if task and not self.stopping.is_set():
+            ran.append((task, run_task(path, task, self.stopping)))
+            checkpoint(path)  # the task wrote to the WAL (its run record, ANALYZE statistics, vacuum)
+        if ran:
+            # Our own writes are not activity: the quiet period goes on from here
+            self.seen[path] = (activity_fingerprint(path), self.seen[path][1])
+            self.done[path] = self.seen[path][0]
+        return ran
+
+    def _run(self):
+        while not self.stopping.is_set():
+            for path in self.databases():
+                try:
+                    self.tick(path)
+                except Exception as e:
+                    print(f"Maintenance of {path} failed: {e}", file=sys.stderr)
+                if self.stopping.is_set():
+                    return
+            self.stopping.wait(self.interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run ClassMint database maintenance now, or show its status")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--task", action="append", choices=["checkpoint", *TASKS],
+                        help="run only this task (repeatable; default: all)")
+    parser.add_argument("--truncate", action="store_true", help="always truncate the WAL when checkpointing")
+    parser.add_argument("--status", action="store_true", help="print the status and exit")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+    if args.status:
+        print(json.dumps(status(args.db), indent=2))
+        return 0
+
+    failed = False
+    for task in args.task or ["checkpoint", *TASKS]:
+        started = time.perf_counter()
+        if task == "checkpoint":
+            done = checkpoint(args.db, "TRUNCATE" if args.truncate else None)
+            result = f"{done['mode']}: {done['result']}" if done else "skipped: not in WAL mode"
+        else:
+            result = run_task(args.db, task)
+            failed |= task == "integrity" and result != "ok"
+        print(f"   {task:<12} {result} ({time.perf_counter() - started:.2f}s)")
+    print(f"WAL {wal_bytes(args.db) / 1024 / 1024:.1f} MB")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint metrics
+Prometheus text-format counters, gauges and histograms with per-thread shards.
+
+Every thread increments its own dict without taking a lock; the shards are only
+merged when /metrics is scraped. When a thread exits its shard is folded into
+a retired total so nothing is lost. Run this file with a URL to scrape and
+print a running server's metrics without a Prometheus install.
+"""
+
+import bisect
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+        self.live = {}      # shard id -> values dict of a running thread
+        self.retired = {}   # values of threads that have exited
+        self.local = threading.local()
+        self.collectors = []
+
+    def shard(self):
+        """This thread's values dict: {(metric, labels): number or [buckets..., sum, count]}"""
+        try:
+            return self.local.shard.values
+        except AttributeError:
+            pass
+        shard = _Shard()
+        with self.lock:
+            self.live[id(shard)] = shard.values
+        weakref.finalize(shard, self._retire, id(shard))
+        self.local.shard = shard
+        return shard.values
+
+    def _retire(self, shard_id):
+        with self.lock:
+            values = self.live.pop(shard_id, None)
+            if values:
+                _merge(self.retired, values)
+
+    def merged(self):
+        with self.lock:
+            total = {}
+            _merge(total, self.retired)
+            for values in self.live.values():
+                _merge(total, dict(values))
+        return total
+
+
+class _Shard:
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values = {}
+
+
+def _merge(into, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            have = into.get(key)
+            if have is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    have[i] += v
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+REGISTRY = _Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.metrics.append(self)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = REGISTRY.shard()
+        key = (self, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Up/down gauge; inc and dec from the same thread cancel out in its shard"""
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels):
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = REGISTRY.shard()
+        key = (self, labels)
+        slots = shard.get(key)
+        if slots is None:
+            # one slot per bucket plus +Inf, then sum and count
+            slots = shard[key] = [0] * (len(self.buckets) + 3)
+        slots[bisect.bisect_left(self.buckets, value)] += 1
+        slots[-2] += value
+        slots[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+
+def register_collector(fn):
+    """fn() -> [(name, kind, help, value)] evaluated at scrape time (e.g. chain length)"""
+    REGISTRY.collectors.append(fn)
+    return fn
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _n, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _v), v in zip(pairs, escaped)) + "}"
+
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Current values of every metric in Prometheus text exposition format"""
+    values = REGISTRY.merged()
+    by_metric = {}
+    for (metric, labels), value in values.items():
+        by_metric.setdefault(metric, []).append((labels, value))
+
+    lines = []
+    for metric in REGISTRY.metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in sorted(by_metric.get(metric, []), key=lambda lv: lv[0]):
+            if metric.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _fmt(float(bound))
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, [('le', le)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labelnames, labels)} {_fmt(value[-2])}")
+                lines.append(f"{metric.name}_count{_labels(metric.labelnames, labels)} {value[-1]}")
+            else:
+                lines.append(f"{metric.name}{_labels(metric.labelnames, labels)} {_fmt(value)}")
+
+    for collector in REGISTRY.collectors:
+        try:
+            samples = collector()
+        except Exception:
+            continue
+        for name, kind, documentation, value in samples:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def parse(text):
+    """Parse exposition text into {(name, frozenset(labels)): value} (stand-in collector)"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        head, _, value = line.rpartition(" ")
+        labels = frozenset()
+        name = head
+        if "{" in head:
+            name, _, rest = head.partition("{")
+            pairs = []
+            for part in rest.rstrip("}").split('",'):
+                if part:
+                    k, _, v = part.partition("=")
+                    pairs.append((k, v.strip('"')))
+            labels = frozenset(pairs)
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+# Metrics of the ClassMint server
+HTTP_LATENCY = Histogram("classmint_http_request_duration_seconds", "Request latency by route",
+                         ("route", "method"))
+HTTP_REQUESTS = Counter("classmint_http_requests_total", "Requests by route and status",
+                        ("route", "method", "status"))
+CLAIMS = Counter("classmint_claims_total", "Claim attempts by outcome", ("outcome",))
+PURCHASES = Counter("classmint_purchases_total", "Purchase attempts by outcome", ("outcome",))
+LEDGER_APPEND = Histogram("classmint_ledger_append_duration_seconds", "Time to append one ledger block")
+QR_RENDER = Histogram("classmint_qr_render_duration_seconds", "Time to render one QR code PNG")
+BCRYPT_IN_FLIGHT = Gauge("classmint_bcrypt_in_flight", "Password checks currently hashing")
+SQLITE_BUSY = Counter("classmint_sqlite_busy_total", "Requests that failed with SQLITE_BUSY (database is locked)",
+                      ("route",))
+WRITE_QUEUE_WAIT = Histogram("classmint_write_queue_wait_seconds",
+                             "Time a write transaction waited for the writer thread (serve.py)")
+WRITE_BATCH = Histogram("classmint_write_batch_size", "Write transactions committed together (serve.py)",
+                        buckets=(1, 2, 4, 8, 16, 32, 64))
+IDEMPOTENT_REPLAYS = Counter("classmint_idempotent_replays_total",
+                             "Retried requests answered from a stored Idempotency-Key response", ("route",))
+
+
+def is_busy(exc):
+    """True for the OperationalError SQLite raises when the busy timeout ran out"""
+    return "database is locked" in str(exc) or "database is busy" in str(exc)
+
+
+def init_app(app):
+    """Time every request and expose GET /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_finish(response):
+        started = g.pop("_metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
+            HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        return response
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def main(argv=None):
+    from urllib.request import urlopen
+
+    argv = argv if argv is not None else sys.argv[1:]
+    url = argv[0] if argv else "http://127.0.0.1:5051/metrics"
+    with urlopen(url, timeout=10) as resp:
+        samples = parse(resp.read().decode())
+    for (name, labels), value in sorted(samples.items(), key=lambda kv: (kv[0][0], sorted(kv[0][1]))):
+        label_text = ",".join(f"{k}={v}" for k, v in sorted(labels))
+        print(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+ClassMint request profiling
+Opt-in per-request timing, SQL tracing and a sampling profiler for slow requests.
+
+Enable with CM_PROFILE=1. CM_PROFILE_SAMPLING=1 additionally samples the stacks
+of in-flight requests every CM_PROFILE_INTERVAL_MS and dumps requests slower
+than CM_PROFILE_SLOW_MS as folded stacks (flamegraph.pl / speedscope format)
+into CM_PROFILE_DIR.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+
+ENABLED = os.environ.get("CM_PROFILE") == "1"
+SAMPLING = os.environ.get("CM_PROFILE_SAMPLING") == "1"
+SLOW_MS = float(os.environ.get("CM_PROFILE_SLOW_MS", "250"))
+INTERVAL_MS = float(os.environ.get("CM_PROFILE_INTERVAL_MS", "5"))
+DUMP_DIR = os.environ.get("CM_PROFILE_DIR", "profiles")
+WINDOW = 500  # requests kept per route for the rolling aggregates
+
+_WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class RequestStats:
+    """Counters for one request, kept on flask.g"""
+
+    __slots__ = ("sql_count", "sql_seconds", "lock_seconds", "spans", "samples")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.lock_seconds = 0.0
+        self.spans = {}
+        self.samples = None
+
+
+def current_stats():
+    # Work on the serve.py writer thread runs outside any request
+    return g.get("_profile") if ENABLED and has_app_context() else None
+
+
+def _account(seconds, lock):
+    stats = current_stats()
+    if stats is not None:
+        stats.sql_seconds += seconds
+        if lock:
+            stats.lock_seconds += seconds
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that charges statement and fetch time to the current request"""
+
+    def execute(self, sql, parameters=()):
+        # The first write of a transaction (or an explicit BEGIN/COMMIT) is where
+        # SQLite takes the write lock and spins in its busy handler when another
+        # connection holds it, so that time is reported as lock wait
+        verb = sql.lstrip()[:7].upper()
+        lock = verb.startswith(("BEGIN", "COMMIT")) or (
+            verb.startswith(_WRITE_VERBS) and not self.connection.in_transaction)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.sql_count += 1
+            _account(time.perf_counter() - started, lock)
+
+    def executemany(self, sql, seq_of_parameters):
+        lock = not self.connection.in_transaction
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.sql_count += 1
+            _account(time.perf_counter() - started, lock)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _account(time.perf_counter() - started, False)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size if size is not None else self.arraysize)
+        finally:
+            _account(time.perf_counter() - started, False)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _account(time.perf_counter() - started, False)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            _account(time.perf_counter() - started, False)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose shortcut methods go through TracedCursor"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _account(time.perf_counter() - started, True)
+
+
+def connection_factory():
+    """sqlite3.connect(factory=...) for get_db()"""
+    return TracedConnection if ENABLED else sqlite3.Connection
+
+
+@contextmanager
+def span(name):
+    """Time a block (bcrypt, QR rendering, ...) as a named part of the request"""
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.spans[name] = stats.spans.get(name, 0.0) + time.perf_counter() - started
+
+
+class Sampler:
+    """Background thread that samples the stacks of threads serving requests"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}  # thread id -> RequestStats
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="cm-profiler", daemon=True)
+            self.thread.start()
+
+    def restart_in_child(self):
+        # Threads do not survive fork (serve.py --workers)
+        self.thread = None
+        self.active = {}
+        self.lock = threading.Lock()
+        self.start()
+
+    def watch(self, stats):
+        stats.samples = {}
+        with self.lock:
+            self.active[threading.get_ident()] = stats
+
+    def unwatch(self):
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                watched = dict(self.active)
+            frames = sys._current_frames()
+            for ident, stats in watched.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                folded = ";".join(reversed(stack))
+                stats.samples[folded] = stats.samples.get(folded, 0) + 1
+
+
+class Aggregates:
+    """Rolling per-route window of request measurements"""
+
+    FIELDS = ("wall_ms", "cpu_ms", "sql_count", "sql_ms", "lock_wait_ms", "bytes")
+
+    def __init__(self, window):
+        self.window = window
+        self.routes = {}
+        self.slow = deque(maxlen=50)
+        self.lock = threading.Lock()
+
+    def add(self, route, values, spans):
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {"total": 0, "recent": deque(maxlen=self.window), "spans": {}}
+            entry["total"] += 1
+            entry["recent"].append(values)
+            for name, seconds in spans.items():
+                entry["spans"][name] = entry["spans"].get(name, 0.0) + seconds * 1000
+
+    def snapshot(self):
+        def pct(sorted_values, p):
+            return round(sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))], 3)
+
+        out = {}
+        with self.lock:
+            items = [(route, entry["total"], list(entry["recent"]), dict(entry["spans"]))
+                     for route, entry in self.routes.items()]
+            slow = list(self.slow)
+        for route, total, recent, spans in sorted(items):
+            summary = {"requests": total, "window": len(recent)}
+            for i, field in enumerate(self.FIELDS):
+                column = sorted(r[i] for r in recent)
+                summary[field] = {
+                    "mean": round(sum(column) / len(column), 3),
+                    "p50": pct(column, 50),
+                    "p95": pct(column, 95),
+                    "max": round(column[-1], 3),
+                }
+            summary["spans_total_ms"] = {k: round(v, 3) for k, v in spans.items()}
+            out[route] = summary
+        return {"routes": out, "slow_requests": slow}
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.slow.clear()
+
+
+aggregates = Aggregates(WINDOW)
+sampler = Sampler(INTERVAL_MS / 1000)
+
+
+def _dump_folded(route, wall_ms, samples):
+    os.makedirs(DUMP_DIR, exist_ok=True)
+    slug = "".join(ch if ch.isalnum() else "_" for ch in route).strip("_") or "root"
+    name = f"{time.strftime('%Y%m%d_%H%M%S')}_{int(wall_ms)}ms_{slug}.folded"
+    path = os.path.join(DUMP_DIR, name)
+    with open(path, "w") as f:
+        for stack, count in sorted(samples.items(), key=lambda kv: -kv[1]):
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def init_app(app):
+    """Register the profiling hooks on the Flask app (no-op unless CM_PROFILE=1)"""
+    if not ENABLED:
+        return
+    if SAMPLING:
+        sampler.start()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=sampler.restart_in_child)
+
+    @app.before_request
+    def _profile_start():
+        g._profile = RequestStats()
+        g._profile_started = (time.perf_counter(), time.thread_time())
+        if SAMPLING:
+            sampler.watch(g._profile)
+
+    @app.after_request
+    def _profile_finish(response):
+        stats = g.pop("_profile", None)
+        started = g.pop("_profile_started", None)
+        if stats is None or started is None:
+            return response
+
+        wall_ms = (time.perf_counter() - started[0]) * 1000
+        cpu_ms = (time.thread_time() - started[1]) * 1000
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        size = response.content_length or response.calculate_content_length() or 0
+        aggregates.add(route, (wall_ms, cpu_ms, stats.sql_count, stats.sql_seconds * 1000,
+                               stats.lock_seconds * 1000, size), stats.spans)
+
+        if wall_ms >= SLOW_MS:
+            slow = {"route": route, "path": request.full_path.rstrip("?"), "at": int(time.time()),
+                    "wall_ms": round(wall_ms, 3), "sql_count": stats.sql_count,
+                    "spans_ms": {k: round(v * 1000, 3) for k, v in stats.spans.items()}}
+            if stats.samples:
+                slow["profile"] = _dump_folded(route, wall_ms, stats.samples)
+            with aggregates.lock:
+                aggregates.slow.append(slow)
+        return response
+
+    if SAMPLING:
+        @app.teardown_request
+        def _profile_unwatch(_e=None):
+            sampler.unwatch()
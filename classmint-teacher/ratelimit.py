@@ -0,0 +1,175 @@
+"""
+ClassMint rate limiting and load shedding
+Per-route token buckets by client address and by user, plus early 503s when the server saturates.
+
+Each limited route has budgets per client (remote address) and per user
+(user_id or username of the request). A bucket holds up to `burst` requests
+and refills at `per_minute`; a request that finds its bucket empty gets a 429
+with Retry-After. Buckets live in LRU-ordered dicts capped at MAX_KEYS, so an
+attacker cycling through user ids only evicts idle buckets, which would have
+been full again anyway.
+
+Budgets are per process: with serve.py --workers N a client can get up to N
+times the budget, which is still enough to stop tight loops. Classrooms share
+one address behind NAT, so client budgets are generous and the per-user
+budgets do the real limiting.
+
+Load shedding answers before any database work:
+- writes get a 503 while the writer queue of serve.py is SHED_QUEUE_DEPTH deep
+- heavy reads (QR rendering, exports, analytics, school fan-out) get a 503
+  while this process used more than SHED_CPU of a core over the last second,
+  leaving the CPU to claims and purchases
+
+CM_RATE_LIMIT=0 switches both off (benchmarks, load tests).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+ENABLED = os.environ.get("CM_RATE_LIMIT", "1") != "0"
+MAX_KEYS = int(os.environ.get("CM_RATE_MAX_KEYS", "10000"))
+SHED_QUEUE_DEPTH = int(os.environ.get("CM_SHED_QUEUE_DEPTH", "500"))
+SHED_CPU = float(os.environ.get("CM_SHED_CPU", "0.95"))
+
+# (method, endpoint) -> ((scope, per_minute, burst), ...); scope is "client" or "user"
+LIMITS = {
+    ("POST", "api_claim"): (("client", 600, 100), ("user", 30, 10)),
+    ("POST", "api_claim_batch"): (("client", 120, 30), ("user", 6, 3)),
+    ("POST", "api_shop_purchase"): (("client", 600, 100), ("user", 30, 10)),
+    ("POST", "api_auth_login"): (("client", 120, 60), ("user", 10, 5)),
+    ("POST", "login"): (("client", 30, 10), ("user", 10, 5)),
+    ("POST", "api_admin_roster_import"): (("client", 10, 3),),
+    ("GET", "qr_by_token"): (("client", 120, 60),),
+    ("GET", "token_qr"): (("client", 120, 60),),
+}
+
+WRITE_ENDPOINTS = {"api_claim", "api_claim_batch", "api_shop_purchase", "api_token_create", "token_new",
+                   "api_admin_roster_import"}
+HEAVY_ENDPOINTS = {"qr_by_token", "token_qr", "api_admin_export", "api_admin_analytics_summary",
+                   "api_admin_analytics_top_items", "api_school_leaderboard", "api_school_stats",
+                   "api_admin_purchases"}
+
+RATE_LIMITED = metrics.Counter("classmint_rate_limited_total", "Requests refused by a rate limit",
+                               ("route", "scope"))
+SHED = metrics.Counter("classmint_shed_total", "Requests refused by load shedding", ("route", "reason"))
+
+
+class TokenBuckets:
+    """Token buckets by key, keeping at most max_keys (least recently used evicted)"""
+
+    def __init__(self, per_minute, burst, max_keys=MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> [tokens, last refill]
+        self.lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Spend one token of key's bucket: 0.0 if there was one, else seconds until there is"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class CpuMeter:
+    """Share of one core this process used, measured over windows of at least `window` seconds"""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.lock = threading.Lock()
+        self.wall = self.cpu = None  # first call starts the first window (not import time)
+        self.busy = 0.0
+
+    def utilisation(self):
+        wall = time.monotonic()
+        if self.wall is None:
+            with self.lock:
+                if self.wall is None:
+                    self.wall, self.cpu = wall, time.process_time()
+        elif wall - self.wall >= self.window:
+            with self.lock:
+                if wall - self.wall >= self.window:
+                    cpu = time.process_time()
+                    self.busy = (cpu - self.cpu) / (wall - self.wall)
+                    self.wall, self.cpu = wall, cpu
+        return self.busy
+
+
+_buckets = {(route, scope): TokenBuckets(per_minute, burst)
+            for route, budgets in LIMITS.items() for scope, per_minute, burst in budgets}
+cpu = CpuMeter()
+
+
+def _user_key(request):
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict):
+        value = data.get("user_id") or data.get("username")
+    else:
+        value = request.form.get("username")
+    return str(value)[:64] if value else None
+
+
+def check(request, queue_depth=lambda: 0):
+    """(status, detail, retry_after) when the request must be refused, else None"""
+    if not ENABLED:
+        return None
+    endpoint = request.endpoint
+    if endpoint in WRITE_ENDPOINTS and queue_depth() >= SHED_QUEUE_DEPTH:
+        SHED.inc(endpoint, "write_queue")
+        return 503, "server busy, retry shortly", 1
+    if endpoint in HEAVY_ENDPOINTS and cpu.utilisation() >= SHED_CPU:
+        SHED.inc(endpoint, "cpu")
+        return 503, "server busy, retry shortly", 2
+
+    budgets = LIMITS.get((request.method, endpoint))
+    if not budgets:
+        return None
+    for scope, _per_minute, _burst in budgets:
+        key = request.remote_addr if scope == "client" else _user_key(request)
+        if key is None:
+            continue
+        wait = _buckets[(request.method, endpoint), scope].take(key)
+        if wait:
+            RATE_LIMITED.inc(endpoint, scope)
+            return 429, "too many requests", max(1, int(wait + 0.999))
+    return None
+
+
+def init_app(app, queue_depth=lambda: 0):
+    """Refuse rate limited and shed requests before they reach the view"""
+    from flask import jsonify, request
+
+    @app.before_request
+    def _rate_limit():
+        refused = check(request, queue_depth)
+        if refused is None:
+            return None
+        status, detail, retry_after = refused
+        response = jsonify({"ok": False, "detail": detail})
+        response.status_code = status
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+
+@metrics.register_collector
+def _bucket_metrics():
+    return [("classmint_rate_limit_buckets", "gauge", "Token buckets held in memory", sum(map(len, _buckets.values())))]
@@ -0,0 +1,115 @@
+"""
+ClassMint records
+Tuple-backed row types for the tables the app lists, and a JSON encoder that works off them.
+
+get_db() connections keep sqlite3.Row for the many single-row lookups; list
+queries use fetch_all() instead, which turns each result tuple straight into
+a NamedTuple record: one tuple per row, fields read by index or attribute,
+no sqlite3.Row wrapper and no dict copy. Templates read them like rows
+(record.status).
+
+encoder() compiles a formatter that writes a record (or any tuple with the
+same columns) as a JSON object without building a dict, so serialising a
+list costs one string per row.
+"""
+
+from json.encoder import encode_basestring
+from typing import NamedTuple, Optional
+
+
+class Token(NamedTuple):
+    id: int
+    token: str
+    amount: int
+    one_time: int
+    expires_at: int
+    issued_by: int
+    status: str
+    created_at: int
+    description: Optional[str]
+
+
+class Claim(NamedTuple):
+    id: int
+    token_id: int
+    claimer: str
+    amount: int
+    created_at: int
+    token: Optional[str]  # joined from tokens
+
+
+class Block(NamedTuple):
+    id: int
+    tx_id: int
+    prev_hash: str
+    record_hash: str
+    created_at: int
+    block_data: Optional[str]
+
+
+class Purchase(NamedTuple):
+    id: int
+    user_id: int
+    item_id: int
+    quantity: int
+    total_price: int
+    status: str
+    created_at: int
+    username: Optional[str]  # joined from users
+    item_name: Optional[str]  # joined from shop_items
+    category: Optional[str]
+    price: Optional[int]
+
+
+def columns(record, alias=None):
+    """SELECT list of record's fields, optionally qualified by a table alias"""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + name for name in record._fields)
+
+
+def fetch_all(db, record, sql, params=()):
+    """Rows of sql as records; the query must select record's fields in order"""
+    cur = db.cursor()
+    cur.row_factory = None
+    return list(map(record._make, cur.execute(sql, params)))
+
+
+def _value(v, string=encode_basestring, real=float.__repr__):
+    if v is None:
+        return "null"
+    if v.__class__ is str:
+        return string(v)
+    if v.__class__ is float:
+        return real(v)
+    if v.__class__ is bool:
+        return "true" if v else "false"
+    return str(v)
+
+
+_encoders = {}
+
+
+def encoder(fields, raw_json=()):
+    """Function turning a tuple of these fields into JSON object text.
+
+    Fields in raw_json hold JSON text themselves (ledger block_data) and are
+    embedded as is (empty ones are written like any other value).
+    """
+    key = (tuple(fields), tuple(raw_json))
+    fn = _encoders.get(key)
+    if fn is None:
+        template = "{" + ",".join(f"{encode_basestring(name)}:%s" for name in fields) + "}"
+        raw = [i for i, name in enumerate(fields) if name in raw_json]
+        if raw:
+            def fn(row):
+                values = list(map(_value, row))
+                for i in raw:
+                    if row[i]:
+                        values[i] = row[i]
+                return template % tuple(values)
+        else:
+            def fn(row):
+                return template % tuple(map(_value, row))
+        _encoders[key] = fn
+    return fn
+
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint balance replay tool
+Rebuild user balances from the ledger and compare them with user_balances
+"""
+
+import argparse
+import sqlite3
+import sys
+import os
+import time
+
+import gencache
+
+# Per-user balance delta of each block in an id window, aggregated inside SQLite.
+# Claim blocks carry claim_data.claimer/amount, purchase blocks carry
+# claim_data.user_id/total_price (see add_block callers in app.py) and
+# opening-balance blocks from term_rollover.py carry claim_data.user_id/amount.
+REPLAY_BATCH_SQL = """
+    SELECT uid, SUM(delta) AS delta, COUNT(*) AS blocks
+    FROM (
+        SELECT
+            COALESCE(json_extract(block_data, '$.claim_data.user_id'),
+                     json_extract(block_data, '$.claim_data.claimer')) AS uid,
+            COALESCE(-json_extract(block_data, '$.claim_data.total_price'),
+                     json_extract(block_data, '$.claim_data.amount')) AS delta
+        FROM ledger
+        WHERE id > ? AND id <= ? AND block_data IS NOT NULL
+    )
+    GROUP BY uid
+"""
+
+
+def replay_balances(conn, batch_size=200000, progress=None):
+    """Stream the ledger in id order and return ({user_id: balance}, stats)"""
+    balances = {}
+    stats = {"blocks": 0, "skipped": 0, "unattributed": 0}
+
+    top = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+    low = 0
+    while low < top:
+        high = low + batch_size
+        for uid, delta, blocks in conn.execute(REPLAY_BATCH_SQL, (low, high)):
+            stats["blocks"] += blocks
+            if uid is None or delta is None:
+                stats["skipped"] += blocks
+                continue
+            try:
+                uid = int(uid)
+            except (TypeError, ValueError):
+                # e.g. claims recorded with claimer "unknown"
+                stats["unattributed"] += blocks
+                continue
+            balances[uid] = balances.get(uid, 0) + int(delta)
+        low = high
+        if progress:
+            progress(min(low, top), top)
+
+    return balances, stats
+
+
+def diff_balances(conn, replayed):
+    """Return [(user_id, cached, replayed)] for every user whose balance differs"""
+    cached = dict(conn.execute("SELECT user_id, balance FROM user_balances"))
+    diffs = []
+    for uid in sorted(set(cached) | set(replayed)):
+        have = cached.get(uid)
+        want = replayed.get(uid, 0)
+        if have is None or have != want:
+            diffs.append((uid, have, want))
+    return diffs
+
+
+def repair_balances(conn, diffs):
+    """Write replayed balances for the given diffs (caller owns the transaction)"""
+    ts = int(time.time())
+    conn.executemany("""
+        INSERT INTO user_balances (user_id, balance, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            balance = excluded.balance,
+            updated_at = excluded.updated_at
+    """, [(uid, want, ts) for uid, _have, want in diffs])
+    gencache.bump(conn, "balances")
+
+
+def run(db_path, batch_size=200000, repair=False, verbose=False):
+    """Replay, diff and optionally repair; returns the list of diffs found"""
+    # isolation_level=None: transactions below are explicit so that the
+    # replay and the diff/repair see one consistent snapshot
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # IMMEDIATE holds the write lock from the first ledger read until the
+        # repair commits, so no claim or purchase can slip in between
+        conn.execute("BEGIN IMMEDIATE" if repair else "BEGIN")
+
+        def progress(done, total):
+            print(f"\r   replayed up to block {done}/{total}", end="", file=sys.stderr)
+
+        started = time.perf_counter()
+        replayed, stats = replay_balances(conn, batch_size, progress if verbose else None)
+        elapsed = time.perf_counter() - started
+        if verbose:
+            print(file=sys.stderr)
+
+        diffs = diff_balances(conn, replayed)
+        if repair and diffs:
+            repair_balances(conn, diffs)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    rate = stats["blocks"] / elapsed * 60 if elapsed > 0 else 0
+    print(f"Replayed {stats['blocks']} blocks for {len(replayed)} users in {elapsed:.2f}s "
+          f"({rate:,.0f} blocks/min)")
+    if stats["skipped"] or stats["unattributed"]:
+        print(f"   Skipped {stats['skipped']} blocks without claim data, "
+              f"{stats['unattributed']} with a non-numeric claimer")
+
+    if not diffs:
+        print("user_balances matches the ledger")
+    else:
+        print(f"{len(diffs)} balance(s) differ from the ledger:")
+        shown = diffs if verbose else diffs[:20]
+        for uid, have, want in shown:
+            print(f"   user {uid}: cached={have if have is not None else 'missing'} ledger={want}")
+        if len(shown) < len(diffs):
+            print(f"   ... {len(diffs) - len(shown)} more (use -v to list all)")
+        if repair:
+            print("user_balances repaired")
+    return diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild user_balances from the ledger")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--batch-size", type=int, default=200000,
+                        help="ledger ids aggregated per batch")
+    parser.add_argument("--repair", action="store_true",
+                        help="overwrite mismatching balances with the replayed values")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show progress")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    diffs = run(args.db, args.batch_size, args.repair, args.verbose)
+    return 1 if diffs and not args.repair else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
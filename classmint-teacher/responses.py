@@ -0,0 +1,130 @@
+"""
+ClassMint JSON responses
+Serialise query results to JSON inside SQLite and compress large responses.
+
+rows_json() wraps a query in json_group_array(json_object(...)), so SQLite
+returns the finished JSON array as one string: no sqlite3.Row, dict or
+json.dumps work per row in Python. envelope() splices such arrays into the
+usual {"ok": true, ...} object.
+
+Responses above MIN_SIZE are compressed when the client accepts it: brotli
+when the brotli package is installed, gzip otherwise. Cacheable bodies are
+kept as Prepared objects, which hold the JSON bytes and each encoding once
+computed, so cache hits are served already compressed.
+"""
+
+import gzip
+import json
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+MIN_SIZE = 1024  # bytes; smaller bodies are not worth a compression round
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE = ("application/json", "text/html", "text/css", "text/plain", "application/javascript")
+
+
+def rows_json(db, sql, columns, params=(), json_columns=()):
+    """JSON array text of the rows of sql; columns are its result column names, in order.
+
+    Columns in json_columns hold JSON text (ledger block_data) and are embedded as JSON values.
+    """
+    fields = ", ".join(f"'{name}', json(\"{name}\")" if name in json_columns else f"'{name}', \"{name}\""
+                       for name in columns)
+    return db.execute(f"SELECT COALESCE(json_group_array(json_object({fields})), '[]') FROM ({sql})",
+                      params).fetchone()[0]
+
+
+def envelope(fields, **arrays):
+    """JSON object text of fields (a dict) plus pre-serialised JSON arrays"""
+    parts = [json.dumps(fields, ensure_ascii=False, separators=(",", ":"))[:-1]]
+    for name, raw in arrays.items():
+        parts.append(f'{"," if len(parts) > 1 or fields else ""}"{name}":{raw}')
+    parts.append("}")
+    return "".join(parts)
+
+
+def encode(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def negotiate(accept_encoding, size):
+    """Content-Encoding to use for a body of size bytes, or None"""
+    if size < MIN_SIZE or not accept_encoding:
+        return None
+    offered = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        offered.add(name.strip().lower())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+class Prepared:
+    """A JSON body serialised once, with its compressed encodings made on first use"""
+
+    __slots__ = ("data", "encodings", "lock")
+
+    def __init__(self, text):
+        self.data = text.encode()
+        self.encodings = {}
+        self.lock = threading.Lock()
+
+    def encoded(self, encoding):
+        if encoding is None:
+            return self.data
+        body = self.encodings.get(encoding)
+        if body is None:
+            with self.lock:
+                body = self.encodings.get(encoding)
+                if body is None:
+                    body = self.encodings[encoding] = encode(self.data, encoding)
+        return body
+
+
+def send(body, status=200):
+    """Flask response for JSON text or a Prepared body, compressed as the client accepts"""
+    from flask import current_app, request
+
+    prepared = body if isinstance(body, Prepared) else Prepared(body)
+    encoding = negotiate(request.headers.get("Accept-Encoding"), len(prepared.data))
+    response = current_app.response_class(prepared.encoded(encoding), status=status, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app):
+    """Compress every other large response (jsonify, rendered pages) on the way out"""
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if (response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE or not 200 <= response.status_code < 300):
+            return response
+        encoding = negotiate(request.headers.get("Accept-Encoding"), response.content_length or 0)
+        if encoding is None:
+            return response
+        response.set_data(encode(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
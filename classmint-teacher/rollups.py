@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint analytics rollups
+Per-day totals kept up to date by the write transactions, so range queries never scan raw rows.
+
+rollup_daily holds one row per day: tokens issued, claims, claim latency
+(token created -> claimed), purchases, and how many of the tokens issued
+that day have been claimed so far (for the redemption rate).
+rollup_item_daily holds purchases per item and day. Weeks are summed from
+days at query time.
+
+Run this file to rebuild the rollups from the raw tables. This is needed
+after importing data with tools that bypass app.py. Days older than the
+oldest raw row are kept, so history from archived terms survives.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+# Days start at local midnight of the server's zone (summer time included);
+# CM_TZ_OFFSET (seconds east of UTC) replaces it with a fixed offset
+TZ_OFFSET = int(os.environ["CM_TZ_OFFSET"]) if os.environ.get("CM_TZ_OFFSET") else None
+
+# Claim latency buckets: (column, upper bound in seconds)
+LATENCY_BUCKETS = (("latency_5m", 300), ("latency_1h", 3600), ("latency_1d", 86400), ("latency_more", None))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_daily (
+  day INTEGER PRIMARY KEY,
+  tokens_issued INTEGER NOT NULL DEFAULT 0,
+  amount_issued INTEGER NOT NULL DEFAULT 0,
+  redeemed INTEGER NOT NULL DEFAULT 0,
+  claims INTEGER NOT NULL DEFAULT 0,
+  amount_claimed INTEGER NOT NULL DEFAULT 0,
+  latency_count INTEGER NOT NULL DEFAULT 0,
+  latency_sum INTEGER NOT NULL DEFAULT 0,
+  latency_5m INTEGER NOT NULL DEFAULT 0,
+  latency_1h INTEGER NOT NULL DEFAULT 0,
+  latency_1d INTEGER NOT NULL DEFAULT 0,
+  latency_more INTEGER NOT NULL DEFAULT 0,
+  purchases INTEGER NOT NULL DEFAULT 0,
+  amount_spent INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rollup_item_daily (
+  day INTEGER NOT NULL,
+  item_id INTEGER NOT NULL,
+  purchases INTEGER NOT NULL DEFAULT 0,
+  quantity INTEGER NOT NULL DEFAULT 0,
+  revenue INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, item_id)
+) WITHOUT ROWID;
+"""
+
+
+def utc_offset(ts):
+    """Seconds east of UTC in effect at ts"""
+    return TZ_OFFSET if TZ_OFFSET is not None else time.localtime(ts).tm_gmtoff
+
+
+def day_of(ts):
+    ts = int(ts)
+    return (ts + utc_offset(ts)) // 86400
+
+
+def day_start(day):
+    """Unix timestamp of local midnight starting `day`"""
+    # The offset at midnight itself, which differs from the one at day * 86400 on a summer time switch
+    guess = day * 86400 - utc_offset(day * 86400)
+    return day * 86400 - utc_offset(guess)
+
+
+def day_date(day):
+    return datetime.fromtimestamp(day * 86400, timezone.utc).date().isoformat()
+
+
+def _latency_bucket(seconds):
+    for column, bound in LATENCY_BUCKETS:
+        if bound is None or seconds <= bound:
+            return column
+
+
+# Write-time maintenance, called inside the write transactions of app.py
+def record_token(db, created_at, amount):
+    db.execute("""
+        INSERT INTO rollup_daily (day, tokens_issued, amount_issued) VALUES (?, 1, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            tokens_issued = tokens_issued + 1,
+            amount_issued = amount_issued + excluded.amount_issued
+    """, (day_of(created_at), amount))
+
+
+def record_claim(db, claimed_at, amount, token_created_at=None):
+    day = day_of(claimed_at)
+    if token_created_at is None:
+        db.execute("""
+            INSERT INTO rollup_daily (day, claims, amount_claimed) VALUES (?, 1, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                claims = claims + 1,
+                amount_claimed = amount_claimed + excluded.amount_claimed
+        """, (day, amount))
+        return
+    latency = max(0, claimed_at - token_created_at)
+    bucket = _latency_bucket(latency)
+    db.execute(f"""
+        INSERT INTO rollup_daily (day, claims, amount_claimed, latency_count, latency_sum, {bucket})
+        VALUES (?, 1, ?, 1, ?, 1)
+        ON CONFLICT(day) DO UPDATE SET
+            claims = claims + 1,
+            amount_claimed = amount_claimed + excluded.amount_claimed,
+            latency_count = latency_count + 1,
+            latency_sum = latency_sum + excluded.latency_sum,
+            {bucket} = {bucket} + 1
+    """, (day, amount, latency))
+    db.execute("""
+        INSERT INTO rollup_daily (day, redeemed) VALUES (?, 1)
+        ON CONFLICT(day) DO UPDATE SET redeemed = redeemed + 1
+    """, (day_of(token_created_at),))
+
+
+def record_purchase(db, created_at, item_id, quantity, total_price):
+    day = day_of(created_at)
+    db.execute("""
+        INSERT INTO rollup_daily (day, purchases, amount_spent) VALUES (?, 1, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            purchases = purchases + 1,
+            amount_spent = amount_spent + excluded.amount_spent
+    """, (day, total_price))
+    db.execute("""
+        INSERT INTO rollup_item_daily (day, item_id, purchases, quantity, revenue) VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(day, item_id) DO UPDATE SET
+            purchases = purchases + 1,
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue
+    """, (day, item_id, quantity, total_price))
+
+
+# Backfill: the same totals computed from the raw tables in a few grouped scans
+# SQLite's 'localtime' applies the same zone rules as time.localtime() in day_of()
+_DAY = ("((%s + :offset) / 86400)" if TZ_OFFSET is not None
+        else "(CAST(strftime('%%s', %s, 'unixepoch', 'localtime') AS INTEGER) / 86400)")
+_LATENCY = "MAX(0, c.created_at - t.created_at)"
+
+BACKFILL_SQL = [
+    f"""
+    INSERT INTO rollup_daily (day, tokens_issued, amount_issued)
+    SELECT {_DAY % "created_at"}, COUNT(*), COALESCE(SUM(amount), 0)
+    FROM tokens WHERE created_at IS NOT NULL GROUP BY 1
+    """,
+    f"""
+    INSERT INTO rollup_daily (day, claims, amount_claimed, latency_count, latency_sum,
+                              latency_5m, latency_1h, latency_1d, latency_more)
+    SELECT {_DAY % "c.created_at"}, COUNT(*), COALESCE(SUM(c.amount), 0),
+           COUNT(t.created_at), COALESCE(SUM({_LATENCY}), 0),
+           SUM(t.created_at IS NOT NULL AND {_LATENCY} <= 300),
+           SUM(t.created_at IS NOT NULL AND {_LATENCY} > 300 AND {_LATENCY} <= 3600),
+           SUM(t.created_at IS NOT NULL AND {_LATENCY} > 3600 AND {_LATENCY} <= 86400),
+           SUM(t.created_at IS NOT NULL AND {_LATENCY} > 86400)
+    FROM claims c LEFT JOIN tokens t ON t.id = c.token_id
+    WHERE c.created_at IS NOT NULL GROUP BY 1
+    ON CONFLICT(day) DO UPDATE SET
+        claims = excluded.claims, amount_claimed = excluded.amount_claimed,
+        latency_count = excluded.latency_count, latency_sum = excluded.latency_sum,
+        latency_5m = excluded.latency_5m, latency_1h = excluded.latency_1h,
+        latency_1d = excluded.latency_1d, latency_more = excluded.latency_more
+    """,
+    f"""
+    INSERT INTO rollup_daily (day, redeemed)
+    SELECT {_DAY % "t.created_at"}, COUNT(*)
+    FROM claims c JOIN tokens t ON t.id = c.token_id
+    WHERE t.created_at IS NOT NULL GROUP BY 1
+    ON CONFLICT(day) DO UPDATE SET redeemed = excluded.redeemed
+    """,
+    f"""
+    INSERT INTO rollup_daily (day, purchases, amount_spent)
+    SELECT {_DAY % "created_at"}, COUNT(*), COALESCE(SUM(total_price), 0)
+    FROM purchases WHERE created_at IS NOT NULL GROUP BY 1
+    ON CONFLICT(day) DO UPDATE SET purchases = excluded.purchases, amount_spent = excluded.amount_spent
+    """,
+    f"""
+    INSERT INTO rollup_item_daily (day, item_id, purchases, quantity, revenue)
+    SELECT {_DAY % "created_at"}, item_id, COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(total_price), 0)
+    FROM purchases WHERE created_at IS NOT NULL GROUP BY 1, 2
+    """,
+]
+
+
+def backfill(db):
+    """Recompute the rollups of every day covered by the raw tables (caller owns the transaction).
+
+    Returns the first day rebuilt, or None when the raw tables are empty.
+    """
+    first = db.execute("""
+        SELECT MIN(ts) FROM (
+            SELECT MIN(created_at) AS ts FROM tokens
+            UNION ALL SELECT MIN(created_at) FROM claims
+            UNION ALL SELECT MIN(created_at) FROM purchases
+        )
+    """).fetchone()[0]
+    if first is None:
+        return None
+    first_day = day_of(first)
+    db.execute("DELETE FROM rollup_daily WHERE day >= ?", (first_day,))
+    db.execute("DELETE FROM rollup_item_daily WHERE day >= ?", (first_day,))
+    for sql in BACKFILL_SQL:
+        db.execute(sql, {"offset": TZ_OFFSET})
+    return first_day
+
+
+# Queries for the analytics endpoints
+def series(db, first_day, last_day, bucket="day"):
+    """Totals per day or per week (weeks start on Monday) between two days, inclusive"""
+    rows = db.execute("SELECT * FROM rollup_daily WHERE day BETWEEN ? AND ? ORDER BY day",
+                      (first_day, last_day)).fetchall()
+    buckets = {}
+    for row in rows:
+        # Day 0 (1970-01-01) was a Thursday
+        key = row["day"] - (row["day"] + 3) % 7 if bucket == "week" else row["day"]
+        totals = buckets.setdefault(key, dict.fromkeys(row.keys()[1:], 0))
+        for column in row.keys()[1:]:
+            totals[column] += row[column]
+
+    out = []
+    for key in sorted(buckets):
+        totals = buckets[key]
+        out.append({
+            "date": day_date(key),
+            "start": day_start(key),
+            **totals,
+            "redemption_rate": round(totals["redeemed"] / totals["tokens_issued"], 4)
+            if totals["tokens_issued"] else None,
+            "avg_claim_latency": round(totals["latency_sum"] / totals["latency_count"], 1)
+            if totals["latency_count"] else None,
+        })
+    return out
+
+
+def top_items(db, first_day, last_day, limit=10):
+    return [dict(r) for r in db.execute("""
+        SELECT r.item_id, si.name, si.category,
+               SUM(r.purchases) AS purchases, SUM(r.quantity) AS quantity, SUM(r.revenue) AS revenue
+        FROM rollup_item_daily r
+        LEFT JOIN shop_items si ON si.id = r.item_id
+        WHERE r.day BETWEEN ? AND ?
+        GROUP BY r.item_id
+        ORDER BY revenue DESC, quantity DESC
+        LIMIT ?
+    """, (first_day, last_day, limit))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the ClassMint analytics rollups from the raw tables")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        conn.executescript(SCHEMA)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first_day = backfill(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        days = conn.execute("SELECT COUNT(*) FROM rollup_daily WHERE day >= ?", (first_day or 0,)).fetchone()[0]
+    finally:
+        conn.close()
+
+    if first_day is None:
+        print("No tokens, claims or purchases to roll up")
+    else:
+        print(f"Rebuilt {days} days from {day_date(first_day)} in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
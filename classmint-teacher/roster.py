@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint roster import
+Create student accounts in bulk from a CSV roster (username,password per line).
+
+bcrypt is slow on purpose (~0.25 s per hash at the default cost), so a class
+hashed one password at a time takes minutes. The hashes are computed on a
+process pool across all cores; the users and their zero-balance user_balances
+rows are then inserted in one write transaction. Rows that cannot be imported
+(bad or duplicate username, short password, account already there) are
+reported with their line number and skipped; the rest are imported.
+
+The app lists students by the "student" username prefix, so roster usernames
+must start with it. The dashboard uploads rosters to /api/admin/roster/import;
+run this file to import one into a database directly.
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+import sqlite3
+import sys
+import time
+from multiprocessing import get_context
+
+import bcrypt
+
+import gencache
+from sweeper import run_direct
+
+ROUNDS = 12  # bcrypt cost of Flask-Bcrypt's default, as used by app.bcrypt
+MAX_ROWS = 5000
+MIN_PASSWORD = 6
+STUDENT_PREFIX = "student"
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_.@-]{1,64}$")
+
+
+def _hash(args):
+    """bcrypt hash of one password in a worker process (Flask-Bcrypt's format)"""
+    password, rounds = args
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def hash_passwords(passwords, rounds=ROUNDS, workers=None):
+    """bcrypt hashes of passwords, in order, computed on up to `workers` processes"""
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    jobs = [(password, rounds) for password in passwords]
+    if workers <= 1:
+        return list(map(_hash, jobs))
+    # spawn, not fork: the server process has threads (writer, sweeper) whose locks fork would copy
+    with get_context("spawn").Pool(workers) as pool:
+        return pool.map(_hash, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+
+
+def parse(text, default_password=None):
+    """(rows, errors) of a CSV roster: rows are (line, username, password).
+
+    A header line (username,password) is optional; an empty password cell
+    takes default_password.
+    """
+    rows, errors, seen = [], [], set()
+    for line, cells in enumerate(csv.reader(io.StringIO(text)), 1):
+        cells = [cell.strip() for cell in cells]
+        if not any(cells):
+            continue
+        if line == 1 and cells[0].lower() == "username":
+            continue
+        username = cells[0]
+        password = (cells[1] if len(cells) > 1 else "") or default_password or ""
+        if not USERNAME_RE.match(username):
+            error = "invalid username"
+        elif not username.lower().startswith(STUDENT_PREFIX):
+            error = f"username must start with '{STUDENT_PREFIX}'"
+        elif username in seen:
+            error = "duplicate username in roster"
+        elif len(password) < MIN_PASSWORD:
+            error = f"password must be at least {MIN_PASSWORD} characters"
+        else:
+            error = None
+        if error:
+            errors.append({"line": line, "username": username, "error": error})
+            continue
+        seen.add(username)
+        rows.append((line, username, password))
+        if len(rows) > MAX_ROWS:
+            raise ValueError(f"roster has more than {MAX_ROWS} students")
+    return rows, errors
+
+
+def existing_usernames(db, usernames):
+    """The usernames among `usernames` that already have an account"""
+    found = set()
+    usernames = list(usernames)
+    for low in range(0, len(usernames), 500):
+        chunk = usernames[low:low + 500]
+        found.update(r[0] for r in db.execute(
+            f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def insert_students(db, rows, now):
+    """Write transaction: add (line, username, password_hash) rows with zero balances.
+
+    Returns (created, errors); rows whose username was taken meanwhile become errors.
+    """
+    taken = existing_usernames(db, (username for _line, username, _hash in rows))
+    errors = [{"line": line, "username": username, "error": "username already exists"}
+              for line, username, _hash in rows if username in taken]
+    rows = [(username, pw_hash) for _line, username, pw_hash in rows if username not in taken]
+    before = db.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    db.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)", rows)
+    # AUTOINCREMENT ids only grow, and nothing else writes inside this transaction
+    db.execute("""
+        INSERT OR IGNORE INTO user_balances (user_id, balance, updated_at)
+        SELECT id, 0, ? FROM users WHERE id > ?
+    """, (now, before))
+    gencache.bump(db, "balances")
+    return len(rows), errors
+
+
+def import_roster(db, text, submit, default_password=None, rounds=ROUNDS, workers=None):
+    """Parse, hash and insert a CSV roster; returns a summary dict.
+
+    submit(fn, *args) runs fn(db, *args) as one write transaction: the app
+    passes run_write, the CLI run_direct on its database file.
+    """
+    started = time.perf_counter()
+    rows, errors = parse(text, default_password)
+    # Skip hashing accounts that already exist (re-checked inside the write transaction)
+    taken = existing_usernames(db, (username for _line, username, _password in rows))
+    errors += [{"line": line, "username": username, "error": "username already exists"}
+               for line, username, _password in rows if username in taken]
+    rows = [row for row in rows if row[1] not in taken]
+
+    t0 = time.perf_counter()
+    hashes = hash_passwords([password for _line, _username, password in rows], rounds, workers) if rows else []
+    hash_seconds = time.perf_counter() - t0
+
+    created = 0
+    if rows:
+        created, late = submit(insert_students, [(line, username, pw_hash) for (line, username, _pw), pw_hash
+                                                 in zip(rows, hashes)], int(time.time()))
+        errors += late
+    errors.sort(key=lambda e: e["line"])
+    return {
+        "created": created,
+        "errors": errors,
+        "hash_seconds": round(hash_seconds, 3),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a CSV roster (username,password) of ClassMint students")
+    parser.add_argument("csv", help="roster file; '-' reads standard input")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--default-password", help="password for rows that leave it empty")
+    parser.add_argument("--workers", type=int, help="hashing processes (default: all cores)")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="bcrypt cost")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+    if args.csv == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.csv, encoding="utf-8-sig", newline="") as f:
+            text = f.read()
+
+    db = sqlite3.connect(args.db)
+    try:
+        summary = import_roster(db, text, lambda fn, *a: run_direct(args.db, fn, *a),
+                                args.default_password, args.rounds, args.workers)
+    except ValueError as e:
+        print(e)
+        return 2
+    finally:
+        db.close()
+
+    for error in summary["errors"]:
+        print(f"   line {error['line']}: {error['username'] or '(empty)'}: {error['error']}")
+    print(f"Created {summary['created']} students, {len(summary['errors'])} rows skipped "
+          f"in {summary['seconds']:.1f}s (hashing {summary['hash_seconds']:.1f}s)")
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint full-text search
+One FTS5 index over token descriptions, claims and purchases, kept in sync by triggers.
+
+Each indexed row gets one search_fts entry whose body holds its text:
+- tokens: the description
+- claims: the claimed token's description and the student's username
+- purchases: item name, category and the student's username
+Its tags column holds "k<kind>", "u<student id>", "d<YYYYMMDD>" and
+"m<YYYYMM>" (UTC day and month) terms, so the kind, student and date
+filters are part of the MATCH instead of a scan over every match.
+The kind, source id, student, amount and time are stored unindexed
+alongside, so results need no joins. The entry's rowid is its created_at
+in the high 32 bits and the source id times 4 plus the kind code in the
+low ones: the delete triggers (expiry purges) find it directly from the
+deleted row, and rowid order is time order across kinds, which each
+number their ids on their own. term_rollover empties the whole index at
+once instead, see cleared().
+
+Ranking (bm25 over body) costs time per match, and a word that appears
+in most rows ("reward") matches the whole history. Results are therefore
+ranked among the RANK_WINDOW most recent matches. That covers every
+match of a specific query and keeps broad queries in milliseconds; the
+older matches of a broad one follow the ranked ones, newest first.
+
+Triggers rather than the write paths keep the index in sync, so rows
+written by other tools are covered too: gen_dataset, the token sweeper
+and term_rollover. Run this file to rebuild the index from the raw tables.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+KINDS = {"token": 1, "claim": 2, "purchase": 3}
+MAX_PER_PAGE = 100
+RANK_WINDOW = 5000  # most recent matches ranked per query
+MAX_DAY_TAGS = 62  # date ranges up to this many days match day tags,
+MAX_MONTH_TAGS = 36  # then month tags; longer ones filter on created_at alone
+
+TRIGGERS = ("search_tokens_ai", "search_tokens_ad", "search_claims_ai", "search_claims_ad",
+            "search_purchases_ai", "search_purchases_ad")
+
+
+def _rowid(row, kind):
+    """SQL for the index rowid of a source row (NEW/OLD in triggers, a table alias in rebuilds)"""
+    return f"((COALESCE({row}.created_at, 0) << 32) + (({row}.id * 4 + {kind}) & 4294967295))"
+
+
+# prefix='2 3': two- and three-character prefix queries use their own index
+SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+  body, tags, kind UNINDEXED, ref UNINDEXED, user_id UNINDEXED, amount UNINDEXED, created_at UNINDEXED,
+  tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS search_tokens_ai AFTER INSERT ON tokens BEGIN
+  INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+  VALUES ({_rowid("NEW", 1)}, COALESCE(NEW.description, ''),
+          'ktoken' || COALESCE(strftime(' d%Y%m%d m%Y%m', NEW.created_at, 'unixepoch'), ''),
+          'token', NEW.id, NULL, NEW.amount, NEW.created_at);
+END;
+CREATE TRIGGER IF NOT EXISTS search_tokens_ad AFTER DELETE ON tokens BEGIN
+  DELETE FROM search_fts WHERE rowid = {_rowid("OLD", 1)};
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_claims_ai AFTER INSERT ON claims BEGIN
+  INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+  VALUES ({_rowid("NEW", 2)},
+          COALESCE((SELECT description FROM tokens WHERE id = NEW.token_id), '') || ' ' ||
+          COALESCE((SELECT username FROM users WHERE id = CAST(NEW.claimer AS INTEGER)), NEW.claimer, ''),
+          'kclaim u' || CAST(NEW.claimer AS INTEGER) ||
+          COALESCE(strftime(' d%Y%m%d m%Y%m', NEW.created_at, 'unixepoch'), ''),
+          'claim', NEW.id, CAST(NEW.claimer AS INTEGER), NEW.amount, NEW.created_at);
+END;
+CREATE TRIGGER IF NOT EXISTS search_claims_ad AFTER DELETE ON claims BEGIN
+  DELETE FROM search_fts WHERE rowid = {_rowid("OLD", 2)};
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_purchases_ai AFTER INSERT ON purchases BEGIN
+  INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+  SELECT {_rowid("NEW", 3)},
+         COALESCE(si.name, '') || ' ' || COALESCE(si.category, '') || ' ' || COALESCE(u.username, ''),
+         'kpurchase u' || NEW.user_id || COALESCE(strftime(' d%Y%m%d m%Y%m', NEW.created_at, 'unixepoch'), ''),
+         'purchase', NEW.id, NEW.user_id, NEW.total_price, NEW.created_at
+  FROM (SELECT 1) LEFT JOIN shop_items si ON si.id = NEW.item_id LEFT JOIN users u ON u.id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS search_purchases_ad AFTER DELETE ON purchases BEGIN
+  DELETE FROM search_fts WHERE rowid = {_rowid("OLD", 3)};
+END;
+"""
+
+# Rank by body alone; the tags only filter
+RANK_SQL = "INSERT INTO search_fts (search_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"
+
+REBUILD_SQL = [
+    "DELETE FROM search_fts",
+    f"""
+    INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+    SELECT {_rowid("tokens", 1)}, COALESCE(description, ''),
+           'ktoken' || COALESCE(strftime(' d%Y%m%d m%Y%m', created_at, 'unixepoch'), ''),
+           'token', id, NULL, amount, created_at
+    FROM tokens
+    """,
+    f"""
+    INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+    SELECT {_rowid("c", 2)}, COALESCE(t.description, '') || ' ' || COALESCE(u.username, c.claimer, ''),
+           'kclaim u' || CAST(c.claimer AS INTEGER) ||
+           COALESCE(strftime(' d%Y%m%d m%Y%m', c.created_at, 'unixepoch'), ''),
+           'claim', c.id, CAST(c.claimer AS INTEGER), c.amount, c.created_at
+    FROM claims c
+    LEFT JOIN tokens t ON t.id = c.token_id
+    LEFT JOIN users u ON u.id = CAST(c.claimer AS INTEGER)
+    """,
+    f"""
+    INSERT INTO search_fts (rowid, body, tags, kind, ref, user_id, amount, created_at)
+    SELECT {_rowid("p", 3)},
+           COALESCE(si.name, '') || ' ' || COALESCE(si.category, '') || ' ' || COALESCE(u.username, ''),
+           'kpurchase u' || p.user_id || COALESCE(strftime(' d%Y%m%d m%Y%m', p.created_at, 'unixepoch'), ''),
+           'purchase', p.id, p.user_id, p.total_price, p.created_at
+    FROM purchases p
+    LEFT JOIN shop_items si ON si.id = p.item_id
+    LEFT JOIN users u ON u.id = p.user_id
+    """,
+    "INSERT INTO search_fts (search_fts) VALUES ('optimize')",
+]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def create(db):
+    """Create the index and (re)create its triggers, replacing those of older versions"""
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in TRIGGERS) + SCHEMA)
+
+
+def ensure(db):
+    """Create the index and its triggers, filling it from existing rows when it is new or keyed the old way"""
+    new = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_fts'").fetchone() is None
+    create(db)
+    if new:
+        db.execute(RANK_SQL)
+    # Rowids below 2**32 carry no created_at: the index predates time-ordered rowids
+    if new or db.execute("SELECT MAX(rowid) < 4294967296 FROM search_fts").fetchone()[0]:
+        rebuild(db)
+
+
+@contextmanager
+def cleared(db):
+    """Let the caller empty tokens, claims and purchases in one go, then empty the index too.
+
+    The delete triggers remove one index entry per deleted row, and a table
+    with triggers loses SQLite's truncate optimisation: DELETE without WHERE
+    becomes a row-by-row delete. They are dropped for the duration and put
+    back afterwards (a rollback of the caller's transaction restores them as
+    well). 'delete-all' only works on contentless FTS5 tables, so the index
+    is emptied by dropping and recreating it.
+    """
+    triggers = db.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'trigger' AND name IN ('search_tokens_ad', 'search_claims_ad', 'search_purchases_ad')
+    """).fetchall()
+    table = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'search_fts'").fetchone()
+    for name, _sql in triggers:
+        db.execute(f"DROP TRIGGER {name}")
+    yield
+    if table:
+        db.execute("DROP TABLE search_fts")
+        db.execute(table[0])
+        db.execute(RANK_SQL)
+    for _name, sql in triggers:
+        db.execute(sql)
+
+
+def rebuild(db):
+    """Re-index every token, claim and purchase (caller owns the transaction); returns the entry count"""
+    for sql in REBUILD_SQL:
+        db.execute(sql)
+    return db.execute("SELECT COUNT(*) FROM search_fts").fetchone()[0]
+
+
+def date_tags(start, end):
+    """Tags covering start..end: UTC days or months, or None when the range is too long for either"""
+    first = datetime.fromtimestamp(start, timezone.utc).date()
+    last = datetime.fromtimestamp(end, timezone.utc).date()
+    days = (last - first).days + 1
+    if days <= MAX_DAY_TAGS:
+        return [f"d{first + timedelta(days=i):%Y%m%d}" for i in range(max(days, 0))]
+    months = (last.year - first.year) * 12 + last.month - first.month + 1
+    if months <= MAX_MONTH_TAGS:
+        index = first.year * 12 + first.month - 1
+        return [f"m{(index + i) // 12}{(index + i) % 12 + 1:02d}" for i in range(months)]
+    return None
+
+
+def match_expression(text, kinds=None, user_id=None, start=None, end=None):
+    """FTS5 query for free text: every word must match, as a prefix ("sci qui" finds "science quiz")"""
+    words = _WORD.findall(text or "")
+    if not words:
+        return None
+    expression = "body : (" + " ".join(f'"{word}"*' for word in words) + ")"
+    if kinds:
+        expression += " AND tags : (" + " OR ".join(f"k{kind}" for kind in kinds) + ")"
+    if user_id is not None:
+        expression += f" AND tags : u{int(user_id)}"
+    if start is not None and end is not None:
+        tags = date_tags(start, end)
+        if tags is not None:
+            expression += " AND tags : (" + (" OR ".join(tags) or "dnone") + ")"
+    return expression
+
+
+def query(db, text, kinds=None, user_id=None, start=None, end=None, limit=20, offset=0):
+    """Best-ranked entries matching text, as dicts; kinds, user_id and start/end (timestamps) filter"""
+    expression = match_expression(text, kinds, user_id, start, end)
+    if expression is None:
+        return []
+    where, params = ["search_fts MATCH ?"], [expression]
+    if start is not None:
+        where.append("created_at >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("created_at <= ?")
+        params.append(end)
+
+    # Newest first, matches stream in rowid (time) order: find where the ranked window starts
+    bound = db.execute(f"""
+        SELECT rowid FROM search_fts WHERE {' AND '.join(where)} ORDER BY rowid DESC LIMIT 1 OFFSET ?
+    """, params + [RANK_WINDOW - 1]).fetchone()
+    if bound is None:
+        return _entries(db, where, params, "rank", limit, offset)
+
+    # The window's RANK_WINDOW matches ranked, then the older ones newest first
+    rows = []
+    if offset < RANK_WINDOW:
+        rows = _entries(db, where + ["rowid >= ?"], params + [bound[0]], "rank",
+                        min(limit, RANK_WINDOW - offset), offset)
+    if len(rows) < limit:
+        rows += _entries(db, where + ["rowid < ?"], params + [bound[0]], "rowid DESC",
+                         limit - len(rows), max(0, offset - RANK_WINDOW))
+    return rows
+
+
+def _entries(db, where, params, order, limit, offset):
+    rows = db.execute(f"""
+        SELECT kind, ref AS id, user_id, amount, created_at, body AS text
+        FROM search_fts
+        WHERE {' AND '.join(where)}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+    """, params + [limit, offset]).fetchall()
+    return [dict(r) for r in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the ClassMint full-text search index from the raw tables")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        create(conn)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            entries = rebuild(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    print(f"Indexed {entries} tokens, claims and purchases in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint production server
+Serve the app without the debug server, with pooled reads and one writer thread per database (see dbpool.py)
+
+--workers N pre-forks N processes that accept on one shared socket, so
+requests use more than one core. What keeps that safe:
+
+- Every write transaction starts with BEGIN IMMEDIATE (run_write / dbpool),
+  so the ledger tip is read under the database write lock and two processes
+  can never append to the same tip. Each process's writer thread waits in
+  SQLite's busy handler for the others.
+- In-process caches watch generation counters in the database (gencache.py)
+  and see writes made by any process.
+- Sessions are signed cookies; all workers must share FLASK_SECRET and CM_SECRET,
+  which they do when started from the same environment.
+
+/metrics and /api/admin/profile report on the worker that served the request.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import traceback
+
+import app as cm
+import profiling
+import shards
+from dbpool import Pools
+from maintenance import Maintenance
+from sweeper import Sweeper
+
+sweeper = None
+maintainer = None
+
+
+def prepare_database(db_path=None):
+    """Create or upgrade the schema of every database once, before any worker starts"""
+    if db_path:
+        cm.DB_PATH = db_path
+    with cm.app.app_context():
+        cm.init_db()
+        cm.close_db()
+    for cls, path in shards.databases(cm.DB_PATH):
+        if cls:
+            shards.migrate(path)
+            cm._migrated_shards.add(path)
+
+
+def configure(db_path=None, readers=8, max_batch=32, initialise=True):
+    """Switch app.py to read pools and writer threads"""
+    if db_path:
+        cm.DB_PATH = db_path
+    if initialise:
+        prepare_database()
+
+    # Classroom shards (shards.py) get their own writer and read pool on first use
+    cm.pools = Pools(readers, max_batch, profiling.connection_factory())
+    cm.pools.reader(cm.DB_PATH)
+    cm.app.config["DB_READY"] = True
+
+    # Expired tokens are marked through the writer threads like any other write
+    global sweeper, maintainer
+    sweeper = Sweeper(lambda: [path for _cls, path in shards.databases(cm.DB_PATH)],
+                      lambda path, fn, *args: cm.pools.writer(path).submit(fn, *args)).start()
+    # WAL checkpoints, ANALYZE, incremental vacuum and integrity checks while a database is quiet
+    maintainer = Maintenance(lambda: [path for _cls, path in shards.databases(cm.DB_PATH)]).start()
+    return cm.app
+
+
+def unconfigure():
+    """Stop the writer threads and go back to per-request connections"""
+    global sweeper, maintainer
+    if sweeper is not None:
+        sweeper.stop()
+        sweeper = None
+    if maintainer is not None:
+        maintainer.stop()
+        maintainer = None
+    if cm.pools is not None:
+        cm.pools.close()
+        cm.pools = None
+    cm.app.config["DB_READY"] = False
+
+
+def make_server(host, port, threads, sock=None):
+    """waitress when installed (bounded worker threads), else Werkzeug's threaded server without debug"""
+    try:
+        from waitress.server import create_server
+    except ImportError:
+        from werkzeug.serving import make_server as werkzeug_server
+        fd = sock.fileno() if sock is not None else None
+        return werkzeug_server(host, port, cm.app, threaded=True, fd=fd), "werkzeug"
+    if sock is not None:
+        return create_server(cm.app, sockets=[sock], threads=threads), "waitress"
+    return create_server(cm.app, host=host, port=port, threads=threads), "waitress"
+
+
+def serve(server, kind):
+    """Serve until SIGINT/SIGTERM, then drain the writer"""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        if kind == "waitress":
+            server.run()
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        unconfigure()
+
+
+def listen(host, port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_workers(args, sock):
+    """Fork args.workers processes serving sock; restart any that die until stopped"""
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                configure(args.db, args.readers, args.max_batch, initialise=False)
+                server, kind = make_server(args.host, args.port, args.threads, sock)
+                serve(server, kind)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(_signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(args.workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}), starting a new one")
+            spawn()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ClassMint server in production mode")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5051)
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--workers", type=int, default=1, help="server processes (POSIX only when > 1)")
+    parser.add_argument("--threads", type=int, default=16, help="request threads per process (waitress)")
+    parser.add_argument("--readers", type=int, default=8,
+                        help="pooled read connections per database and process")
+    parser.add_argument("--max-batch", type=int, default=32,
+                        help="most write transactions committed together")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    prepare_database(args.db)
+
+    if args.workers > 1:
+        sock = listen(args.host, args.port)
+        print(f"ClassMint serving {args.db} on http://{args.host}:{args.port} "
+              f"({args.workers} workers, {args.readers} readers and 1 writer per database each)")
+        return run_workers(args, sock)
+
+    configure(args.db, args.readers, args.max_batch, initialise=False)
+    server, kind = make_server(args.host, args.port, args.threads)
+    print(f"ClassMint serving {args.db} on http://{args.host}:{args.port} ({kind}, "
+          f"{args.readers} readers and 1 writer per database)")
+    serve(server, kind)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint classroom shards
+One SQLite database (with its own writer lock and its own chain) per classroom.
+
+Enabled by setting CM_SHARD_DIR: class "7A" then lives in CM_SHARD_DIR/7A.db.
+app.py routes each request to one shard, by the class id in the signed token
+payload ("cls"), the teacher session, or an X-Class-Id header / cls parameter
+from the student app. Requests without a class use the default database
+(CM_DB), which keeps everything written before sharding was switched on.
+
+School-wide questions are answered by fan_out(), which queries every shard
+in parallel on read-only connections. Run this file to list or create shards.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SHARD_DIR = os.environ.get("CM_SHARD_DIR")
+ENABLED = bool(SHARD_DIR)
+FAN_OUT_WORKERS = int(os.environ.get("CM_SHARD_WORKERS", "8"))
+
+_CLASS_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+class UnknownClass(LookupError):
+    """No shard exists for the requested class id"""
+
+
+def shard_path(class_id):
+    """Database file of class_id; raises UnknownClass for ids that cannot name a shard"""
+    if not ENABLED or not class_id or not _CLASS_ID.match(class_id):
+        raise UnknownClass(class_id)
+    return os.path.join(SHARD_DIR, f"{class_id}.db")
+
+
+def existing_shard_path(class_id):
+    path = shard_path(class_id)
+    if not os.path.exists(path):
+        raise UnknownClass(class_id)
+    return path
+
+
+def list_classes():
+    if not ENABLED or not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(name[:-3] for name in os.listdir(SHARD_DIR)
+                  if name.endswith(".db") and _CLASS_ID.match(name[:-3]))
+
+
+def databases(default_path):
+    """[(class_id, path)] of every database to fan out over; the default one has class id "" """
+    found = [("", default_path)] if os.path.exists(default_path) else []
+    return found + [(cls, shard_path(cls)) for cls in list_classes()]
+
+
+def connect_ro(path):
+    db = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def fan_out(fn, targets, workers=FAN_OUT_WORKERS):
+    """Run fn(db) on every (class_id, path) of targets in parallel; returns {class_id: result}.
+
+    sqlite3 releases the GIL while a statement runs, so threads are enough to
+    keep one core per shard busy.
+    """
+    def one(target):
+        db = connect_ro(target[1])
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as pool:
+        return dict(zip([cls for cls, _path in targets], pool.map(one, targets)))
+
+
+def migrate(path):
+    """Bring the schema of a shard up to date (cheap when its user_version is already current)"""
+    import app as cm
+
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    try:
+        cm.init_schema(db)
+    finally:
+        db.close()
+
+
+def create_shard(class_id):
+    """Create and initialise the database of a new class"""
+    path = shard_path(class_id)
+    if os.path.exists(path):
+        return path, False
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    migrate(path)
+    return path, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List or create ClassMint classroom shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="classes with their ledger length and file size")
+    create = sub.add_parser("create", help="create the database of one or more classes")
+    create.add_argument("classes", nargs="+")
+    args = parser.parse_args(argv)
+
+    if not ENABLED:
+        print("Set CM_SHARD_DIR to the directory that holds the class databases")
+        return 2
+
+    if args.command == "create":
+        for class_id in args.classes:
+            try:
+                path, created = create_shard(class_id)
+            except UnknownClass:
+                print(f"Invalid class id: {class_id!r} (letters, digits, _ and -)")
+                return 2
+            print(f"{'Created' if created else 'Exists '} {class_id}: {path}")
+        return 0
+
+    targets = [(cls, path) for cls, path in databases(os.environ.get("CM_DB", "classmint.db")) if cls]
+    lengths = fan_out(lambda db: db.execute("SELECT COUNT(*) FROM ledger").fetchone()[0], targets)
+    print(f"{'class':<16}{'blocks':>10}{'size':>12}")
+    for cls, path in targets:
+        print(f"{cls:<16}{lengths[cls]:>10}{os.path.getsize(path) // 1024:>10} KB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
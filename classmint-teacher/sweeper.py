@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint token expiry sweeper
+Mark expired tokens EXPIRED in small batches, off the request path.
+
+Tokens used to stay ACTIVE after their expiry until someone tried to claim
+them, so the dashboard counted dead tokens as outstanding. The sweeper walks
+the (status, expires_at) index and flips expired ACTIVE tokens to EXPIRED,
+BATCH rows per write transaction with a pause in between, so claims queued
+behind it never wait for more than one small batch. With CM_PURGE_AFTER_DAYS
+set it also deletes EXPIRED tokens that expired that many days ago; their
+QR codes are rendered on demand, so nothing else is left behind.
+
+serve.py (and the debug server) run a Sweeper thread every CM_SWEEP_INTERVAL
+seconds over every database, classroom shards included. Run this file for a
+one-off sweep of one database.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+INTERVAL = float(os.environ.get("CM_SWEEP_INTERVAL", "60"))
+BATCH = int(os.environ.get("CM_SWEEP_BATCH", "500"))
+PURGE_AFTER_DAYS = float(os.environ.get("CM_PURGE_AFTER_DAYS", "0"))  # 0: keep expired tokens
+PAUSE = 0.05  # seconds between batches
+
+INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_tokens_status_expiry ON tokens(status, expires_at)"
+
+
+def expire_batch(db, now, limit=BATCH):
+    """Write transaction: mark up to limit expired ACTIVE tokens EXPIRED; returns how many"""
+    return db.execute("""
+        UPDATE tokens SET status = 'EXPIRED'
+        WHERE id IN (SELECT id FROM tokens WHERE status = 'ACTIVE' AND expires_at < ? LIMIT ?)
+    """, (now, limit)).rowcount
+
+
+def purge_batch(db, before, limit=BATCH):
+    """Write transaction: delete up to limit tokens that expired before `before`; returns how many"""
+    return db.execute("""
+        DELETE FROM tokens
+        WHERE id IN (SELECT id FROM tokens WHERE status = 'EXPIRED' AND expires_at < ? LIMIT ?)
+    """, (before, limit)).rowcount
+
+
+def run_direct(path, fn, *args):
+    """Run fn(db, *args) as one write transaction on a short-lived connection"""
+    db = sqlite3.connect(path, isolation_level=None, timeout=5)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(db, *args)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+    finally:
+        db.close()
+
+
+def sweep(path, submit=run_direct, batch=BATCH, purge_after_days=PURGE_AFTER_DAYS, stop=None):
+    """Expire (and optionally purge) every due token of one database; returns (expired, purged)"""
+    now = int(time.time())
+    totals = []
+    jobs = [(expire_batch, now)]
+    if purge_after_days > 0:
+        jobs.append((purge_batch, now - int(purge_after_days * 86400)))
+    for fn, bound in jobs:
+        total = 0
+        while True:
+            n = submit(path, fn, bound, batch)
+            total += n
+            if n < batch or (stop is not None and stop.is_set()):
+                break
+            time.sleep(PAUSE)
+        totals.append(total)
+    return totals[0], totals[1] if len(totals) > 1 else 0
+
+
+class Sweeper:
+    """Background thread sweeping databases() every interval seconds"""
+
+    def __init__(self, databases, submit=run_direct, interval=INTERVAL):
+        self.databases = databases
+        self.submit = submit
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self._run, name="cm-sweeper", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopping.is_set():
+            for path in self.databases():
+                try:
+                    sweep(path, self.submit, stop=self.stopping)
+                except Exception as e:
+                    print(f"Token sweep of {path} failed: {e}", file=sys.stderr)
+                if self.stopping.is_set():
+                    return
+            self.stopping.wait(self.interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mark expired ClassMint tokens EXPIRED (and optionally purge them)")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--batch", type=int, default=BATCH, help="tokens per write transaction")
+    parser.add_argument("--purge-days", type=float, default=PURGE_AFTER_DAYS,
+                        help="also delete tokens that expired this many days ago (default: keep)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    db = sqlite3.connect(args.db)
+    db.execute(INDEX_SQL)
+    db.close()
+
+    started = time.perf_counter()
+    expired, purged = sweep(args.db, batch=args.batch, purge_after_days=args.purge_days)
+    print(f"Expired {expired} tokens, purged {purged} in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ClassMint term rollover tool
+Archive or clear the transactional tables for a new term, keeping users and shop items
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+import gencache
+import history
+import idempotency
+import search
+from backup import take_snapshot
+from ledger import build_block
+
+# Cleared at rollover; users and shop_items are kept
+TRANSACTIONAL_TABLES = ("purchases", "ledger", "claims", "tokens", "transactions")
+
+COUNTS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM tokens) AS tokens,
+        (SELECT COUNT(*) FROM claims) AS claims,
+        (SELECT COUNT(*) FROM ledger) AS ledger,
+        (SELECT COUNT(*) FROM user_balances) AS user_balances,
+        (SELECT COUNT(*) FROM purchases) AS purchases,
+        (SELECT COUNT(*) FROM transactions) AS transactions,
+        (SELECT COUNT(*) FROM users) AS users,
+        (SELECT COUNT(*) FROM shop_items) AS shop_items
+"""
+
+
+class PhaseTimer:
+    """Collects wall-clock time per rollover phase"""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        for name, elapsed in self.phases:
+            print(f"   {name:<22} {elapsed * 1000:9.1f} ms")
+        print(f"   {'total':<22} {sum(e for _n, e in self.phases) * 1000:9.1f} ms")
+
+
+def table_counts(conn):
+    cur = conn.execute(COUNTS_SQL)
+    row = cur.fetchone()
+    return dict(zip([d[0] for d in cur.description], row))
+
+
+def archive_tables(conn, term):
+    """Copy the transactional tables into the attached `archive` database"""
+    for table in TRANSACTIONAL_TABLES + ("user_balances",):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS "
+                     f"SELECT '' AS term, * FROM main.{table} WHERE 0")
+        conn.execute(f"INSERT INTO archive.{table} SELECT ?, * FROM main.{table}", (term,))
+
+
+def carry_forward(conn, balances, ts):
+    """Write each non-zero balance as an opening-balance genesis block"""
+    rows = []
+    prev_hash = ""
+    for user_id, balance in balances:
+        claim_data = {
+            "type": "opening_balance",
+            "user_id": user_id,
+            "amount": balance,
+            "description": "Opening balance carried from previous term"
+        }
+        payload, record_hash = build_block(prev_hash, 0, claim_data, ts)
+        rows.append((0, prev_hash, record_hash, ts, payload))
+        prev_hash = record_hash
+    conn.executemany("INSERT INTO ledger (tx_id, prev_hash, record_hash, created_at, block_data) VALUES (?,?,?,?,?)",
+                     rows)
+
+
+def reclaim_space(conn):
+    """Return freed pages to the filesystem; returns the vacuum mode used"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        conn.execute("PRAGMA incremental_vacuum")
+        return "incremental"
+    # First rollover on this file: switch to incremental auto-vacuum, which
+    # only takes effect after one full VACUUM
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return "full (auto_vacuum switched to incremental)"
+
+
+def rollover(db_path, archive_path=None, term=None, carry_balances=False, vacuum=True):
+    """Run the rollover and return (counts_before, counts_after, PhaseTimer)"""
+    timer = PhaseTimer()
+    term = term or time.strftime("%Y%m%d")
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        history.ensure(conn)  # databases the app has not upgraded yet
+        conn.executescript(idempotency.SCHEMA)
+        counts_before = table_counts(conn)
+
+        if archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            balances = []
+            if carry_balances:
+                balances = conn.execute(
+                    "SELECT user_id, balance FROM user_balances WHERE balance != 0 ORDER BY user_id").fetchall()
+
+            if archive_path:
+                with timer.phase("archive"):
+                    archive_tables(conn, term)
+
+            with timer.phase("truncate"):
+                # DELETE without WHERE uses SQLite's truncate optimisation only on tables
+                # without triggers: the search index's delete triggers are lifted meanwhile
+                with search.cleared(conn):
+                    for table in TRANSACTIONAL_TABLES:
+                        conn.execute(f"DELETE FROM {table}")
+                conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('tokens', 'claims', 'ledger', 'purchases', 'transactions')")
+                # Stored responses name token, claim and block ids that the new term reuses
+                conn.execute("DELETE FROM idempotency_keys")
+
+            with timer.phase("opening balances"):
+                ts = int(time.time())
+                if balances:
+                    carry_forward(conn, balances, ts)
+                    history.record_opening(conn, balances, ts)
+                carried = dict(balances)
+                conn.execute("DELETE FROM user_balances")
+                conn.execute("""
+                    INSERT INTO user_balances (user_id, balance, updated_at)
+                    SELECT id, 0, ? FROM users WHERE username LIKE 'student%'
+                """, (ts,))
+                conn.executemany("""
+                    INSERT INTO user_balances (user_id, balance, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance
+                """, [(uid, bal, ts) for uid, bal in carried.items()])
+                gencache.bump(conn, "balances")
+
+            with timer.phase("commit"):
+                conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if archive_path:
+            conn.execute("DETACH DATABASE archive")
+
+        with timer.phase("reindex + analyze"):
+            conn.execute("REINDEX")
+            conn.execute("ANALYZE")
+
+        if vacuum:
+            with timer.phase("reclaim space"):
+                mode = reclaim_space(conn)
+            print(f"Space reclaimed ({mode})")
+
+        counts_after = table_counts(conn)
+    finally:
+        conn.close()
+    return counts_before, counts_after, timer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start a new term: clear (or archive) all transactions")
+    parser.add_argument("--db", default=os.environ.get("CM_DB", "classmint.db"),
+                        help="database file (default: classmint.db)")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="append the cleared rows to this archive database before deleting them")
+    parser.add_argument("--term", help="label stored with archived rows (default: today's date)")
+    parser.add_argument("--carry-balances", action="store_true",
+                        help="keep current balances as opening-balance ledger entries")
+    parser.add_argument("--no-backup", action="store_true", help="skip the online backup taken first")
+    parser.add_argument("--no-vacuum", action="store_true", help="skip reclaiming free pages")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("Database file does not exist. Please run the Flask application first to initialize the database.")
+        return 2
+
+    print("ClassMint term rollover")
+    print("=" * 50)
+
+    if not args.no_backup:
+        started = time.perf_counter()
+        path, result = take_snapshot(args.db, os.path.dirname(os.path.abspath(args.db)))
+        if not result["ok"]:
+            print(f"Backup verification failed, rollover cancelled: {result.get('message')} ({path})")
+            return 1
+        print(f"Database backed up to: {path} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+    before, after, timer = rollover(args.db, args.archive, args.term, args.carry_balances,
+                                    vacuum=not args.no_vacuum)
+
+    print()
+    print(f"{'table':<16}{'before':>10}{'after':>10}")
+    for table in before:
+        print(f"{table:<16}{before[table]:>10}{after[table]:>10}")
+    print()
+    print("Phase timings:")
+    timer.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch claim duplicate test script
+Resend a batch claim whose claim id is also the id of an earlier purchase and
+check the duplicate reports the claim's own block, not the purchase's.
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+def test_duplicate_reports_claim_block():
+    """Purchase #1 is on the chain before claim #1; a resent batch gets claim #1's block"""
+    os.environ.setdefault("CM_RATE_LIMIT", "0")
+    import app as cm
+
+    print("=== Batch Claim Duplicate Test ===\n")
+    tmpdir = tempfile.mkdtemp(prefix="classmint-batch-")
+    saved = cm.DB_PATH
+    cm.DB_PATH = os.path.join(tmpdir, "batch.db")
+    try:
+        with cm.app.app_context():
+            cm.init_db()
+            cm.close_db()
+        # Enough balance for a purchase before the first claim
+        conn = sqlite3.connect(cm.DB_PATH)
+        conn.execute("INSERT OR REPLACE INTO user_balances (user_id, balance, updated_at) VALUES (2, 1000, 0)")
+        conn.commit()
+        conn.close()
+
+        client = cm.app.test_client()
+        resp = client.post("/api/shop/purchase", json={"user_id": 2, "item_id": 1, "quantity": 1})
+        assert resp.status_code == 200, resp.get_json()
+
+        resp = client.post("/api/token/create", json={"amount": 5, "description": "Batch"},
+                           headers={"X-Admin-Key": cm.APP_SECRET})
+        assert resp.status_code == 200, resp.get_json()
+        token = resp.get_json()["token"]
+
+        batch = {"user_id": 2, "claims": [{"token": token}]}
+        first = client.post("/api/claim/batch", json=batch).get_json()["results"][0]
+        again = client.post("/api/claim/batch", json=batch).get_json()["results"][0]
+        assert first["ok"] and not first["duplicate"], first
+        assert again["duplicate"], again
+
+        conn = sqlite3.connect(cm.DB_PATH)
+        purchase_id = conn.execute("SELECT MAX(id) FROM purchases").fetchone()[0]
+        blocks = conn.execute("SELECT record_hash FROM ledger WHERE tx_id = ? ORDER BY id",
+                              (first["tx_id"],)).fetchall()
+        conn.close()
+        assert purchase_id == first["tx_id"] == 1 and len(blocks) == 2
+        print(f"  claim and purchase share tx_id {first['tx_id']} ({len(blocks)} blocks)")
+        assert again["tx_id"] == first["tx_id"]
+        assert again["block_hash"] == first["block_hash"] == blocks[1][0]
+        print(f"  duplicate reports the claim's block {again['block_hash'][:16]}")
+    finally:
+        cm.DB_PATH = saved
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_duplicate_reports_claim_block()
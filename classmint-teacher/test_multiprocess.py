@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-process claim test script
+Run serve.py with several worker processes, claim every token twice at once
+from many connections, then check there is one valid chain and the balances
+replay from the ledger.
+"""
+
+import contextlib
+import http.client
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+WORKERS = 4
+THREADS = 16
+TOKENS = 300
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def hammer(port, jobs):
+    """POST /api/claim for every (token, user_id); returns [(token, status, body)]"""
+    results = []
+    lock = threading.Lock()
+
+    def worker(part):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        for token, user_id in part:
+            conn.request("POST", "/api/claim", body=json.dumps({"token": token, "user_id": user_id}),
+                         headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            body = json.loads(resp.read())
+            with lock:
+                results.append((token, resp.status, body))
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(jobs[i::THREADS],)) for i in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def leaderboards(port, n):
+    """n leaderboards, each from a new connection so they spread over the workers"""
+    boards = []
+    for _ in range(n):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("GET", "/api/leaderboard")
+        boards.append({s["user_id"]: s["balance"] for s in json.loads(conn.getresponse().read())["students"]})
+        conn.close()
+    return boards
+
+
+def test_multiprocess_claims():
+    """N workers, every token claimed twice concurrently"""
+    from ledger import verify_chain
+    import replay_balances
+
+    print("=== Multi-process Claim Test ===\n")
+    tmpdir = tempfile.mkdtemp(prefix="classmint-mp-")
+    db_path = os.path.join(tmpdir, "mp.db")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        from gen_dataset import generate
+        school = generate(db_path, students=20, tokens=TOKENS, claims=0, purchases=0, workers=1)
+    conn = sqlite3.connect(db_path)
+    tokens = [r[0] for r in conn.execute("SELECT token FROM tokens WHERE status='ACTIVE'")]
+    conn.close()
+
+    # Each token twice, the two attempts far apart in the list so they land on different connections
+    students = school["student_ids"]
+    jobs = [(tok, students[i % len(students)]) for i, tok in enumerate(tokens)]
+    jobs = jobs + [(tok, students[(i + 1) % len(students)]) for i, tok in enumerate(tokens)]
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1",
+                               "--port", str(port), "--db", db_path, "--workers", str(WORKERS)],
+                              cwd=tmpdir, env={**os.environ, "CM_RATE_LIMIT": "0"},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        leaderboards(port, 4 * WORKERS)  # fill every worker's cache before the claims
+        started = time.perf_counter()
+        results = hammer(port, jobs)
+        elapsed = time.perf_counter() - started
+        boards = leaderboards(port, 4 * WORKERS)
+    finally:
+        server.terminate()
+        server.wait(timeout=20)
+
+    ok = [r for r in results if r[1] == 200]
+    failed = [r for r in results if r[1] >= 500]
+    print(f"{len(results)} claims from {THREADS} connections to {WORKERS} workers in {elapsed:.2f}s")
+    print(f"  succeeded: {len(ok)}, rejected: {len(results) - len(ok) - len(failed)}, errors: {len(failed)}")
+    assert not failed, failed[:3]
+    throttled = [r for r in results if r[1] == 429]
+    assert not throttled, f"{len(throttled)} claims rate limited, the race was not tested for them"
+    assert len(ok) == len(tokens), "every token must be claimed exactly once"
+    assert len({r[0] for r in ok}) == len(tokens)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    chain = verify_chain(conn)
+    conn.close()
+    print(f"  chain: {chain['message']} ({chain.get('length')} blocks)")
+    assert chain["ok"], chain
+    assert chain["length"] == len(tokens)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        diffs = replay_balances.run(db_path)
+    assert not diffs, diffs[:3]
+    print("  balances match the ledger")
+
+    conn = sqlite3.connect(db_path)
+    balances = dict(conn.execute("SELECT user_id, balance FROM user_balances WHERE user_id IN (%s)"
+                                 % ",".join("?" * len(students)), students))
+    conn.close()
+    for board in boards:
+        assert {uid: board[uid] for uid in students} == balances, "stale leaderboard cache"
+    print(f"  {len(boards)} leaderboards after the run are current")
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_multiprocess_claims()
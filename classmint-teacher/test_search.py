@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search window test script
+Index many old claims and one purchase made today, whose id is far below
+the claims' ids, and check the purchase is among the most recent matches
+and that paging through a broad query reaches every match.
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+CLAIMS = 6000
+
+
+def test_window_is_most_recent_across_kinds():
+    """6000 claims from last year, purchase #1 today: a search for the student finds all 6001"""
+    os.environ.setdefault("CM_RATE_LIMIT", "0")
+    import app as cm
+    import search
+
+    print("=== Search Window Test ===\n")
+    tmpdir = tempfile.mkdtemp(prefix="classmint-search-")
+    saved = cm.DB_PATH
+    cm.DB_PATH = os.path.join(tmpdir, "search.db")
+    try:
+        with cm.app.app_context():
+            cm.init_db()
+            cm.close_db()
+        now = int(time.time())
+        old = now - 365 * 86400
+        conn = sqlite3.connect(cm.DB_PATH)
+        conn.executemany("INSERT INTO claims (id, token_id, claimer, amount, created_at) VALUES (?, ?, '2', 100, ?)",
+                         [(i, i, old + i) for i in range(1, CLAIMS + 1)])
+        conn.execute("INSERT INTO purchases (id, user_id, item_id, quantity, total_price, created_at) "
+                     "VALUES (1, 2, 1, 1, 500, ?)", (now,))
+        conn.commit()
+        conn.row_factory = sqlite3.Row
+
+        newest = conn.execute("SELECT kind FROM search_fts WHERE search_fts MATCH 'student1' "
+                              "ORDER BY rowid DESC LIMIT 1").fetchone()
+        assert newest["kind"] == "purchase", "rowid order is not time order"
+        window = search.query(conn, "student1", limit=search.RANK_WINDOW)
+        assert any(r["kind"] == "purchase" for r in window), "today's purchase is not in the ranked window"
+        print(f"  purchase #1 is in the window of the {search.RANK_WINDOW} most recent matches")
+        conn.close()
+
+        client = cm.app.test_client()
+        with client.session_transaction() as sess:
+            sess["uid"] = 1
+        seen, page = set(), 1
+        while True:
+            body = client.get(f"/api/admin/search?q=student1&per_page=100&page={page}").get_json()
+            assert body["ok"], body
+            seen.update((r["kind"], r["id"]) for r in body["results"])
+            if not body["has_more"]:
+                break
+            page += 1
+        assert len(seen) == CLAIMS + 1, len(seen)
+        print(f"  {page} pages of 100 reach all {len(seen)} matches")
+    finally:
+        cm.DB_PATH = saved
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_window_is_most_recent_across_kinds()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Classroom shard migration test script
+Open a shard created by an older version (none of the tables added since,
+user_version 0) and check that tokens, claims and balances work on it.
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+# Tables of the first schema; everything else in a new shard came later
+BASE_TABLES = {"users", "tokens", "claims", "ledger", "user_balances", "shop_items", "purchases", "sqlite_sequence"}
+
+
+def make_old_shard(path):
+    """Strip a freshly created shard back to the first schema"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP TABLE IF EXISTS search_fts")
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        if name not in BASE_TABLES:
+            conn.execute(f"DROP TABLE {name}")
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+
+
+def test_old_shard_is_migrated():
+    """A shard left at the first schema gets the newer tables on first use"""
+    os.environ.setdefault("CM_RATE_LIMIT", "0")
+    import app as cm
+    import shards
+
+    print("=== Shard Migration Test ===\n")
+    tmpdir = tempfile.mkdtemp(prefix="classmint-shards-")
+    saved = cm.DB_PATH, shards.SHARD_DIR, shards.ENABLED
+    cm.DB_PATH = os.path.join(tmpdir, "main.db")
+    shards.SHARD_DIR, shards.ENABLED = os.path.join(tmpdir, "classes"), True
+    try:
+        with cm.app.app_context():
+            cm.init_db()
+            cm.close_db()
+        path, created = shards.create_shard("7A")
+        assert created
+        make_old_shard(path)
+        cm._migrated_shards.discard(path)
+
+        client = cm.app.test_client()
+        resp = client.post("/api/token/create", json={"amount": 5, "description": "Old shard"},
+                           headers={"X-Admin-Key": cm.APP_SECRET, "X-Class-Id": "7A"})
+        assert resp.status_code == 200, resp.get_json()
+        token = resp.get_json()["token"]
+
+        resp = client.post("/api/claim", json={"token": token, "user_id": 2})
+        assert resp.status_code == 200, resp.get_json()
+
+        body = client.get("/api/user/balance?user_id=2&cls=7A").get_json()
+        assert body["ok"], body
+        assert body["balance"] == 500
+        assert [tx["amount"] for tx in body["recent"]] == [500]
+        print(f"  shard 7A: balance {body['balance']}, {len(body['recent'])} transaction(s)")
+
+        conn = sqlite3.connect(path)
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+        assert {"transactions", "rollup_daily", "idempotency_keys", "search_fts", "maintenance_runs"} <= tables
+        assert version == cm.SCHEMA_VERSION
+        print(f"  schema upgraded to version {version}")
+    finally:
+        cm.DB_PATH, shards.SHARD_DIR, shards.ENABLED = saved
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_old_shard_is_migrated()